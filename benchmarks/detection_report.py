@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import argparse
+import statistics
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from lib.detection import DetectionSettings, FaceMetadata, find_faces_from_array
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare finding faces on shrunk images against finding them on the full size image"
+    )
+    parser.add_argument(
+        "--input-files",
+        nargs="+",
+        help="the images to find faces in",
+        required=True,
+    )
+    parser.add_argument(
+        "--detection-sizes",
+        nargs="+",
+        type=int,
+        help="the max detection sizes to compare against the full size image",
+        default=[480, 640, 800, 1024],
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        help="how many times to find faces in each image, to get a stable time",
+        default=3,
+    )
+
+    args = parser.parse_args()
+
+    images = [np.array(Image.open(path).convert("RGB")) for path in args.input_files]
+
+    baseline_times, baseline_faces = _run(images, DetectionSettings(), args.repeat)
+    print(
+        f"{'detection size':>15} {'median ms':>10} {'speedup':>8} {'faces':>6} {'recall':>7} {'iou':>6} "
+        f"{'lmk err':>8}"
+    )
+    print(f"{'full':>15} {statistics.median(baseline_times) * 1000:>10.1f} {1:>8.2f} {_count(baseline_faces):>6}")
+
+    for detection_size in args.detection_sizes:
+        times, faces = _run(images, DetectionSettings(detection_size), args.repeat)
+        recall, iou, landmark_error = _compare(baseline_faces, faces)
+        speedup = statistics.median(baseline_times) / statistics.median(times)
+        print(
+            f"{detection_size:>15} {statistics.median(times) * 1000:>10.1f} {speedup:>8.2f} "
+            f"{_count(faces):>6} {recall:>7.2f} {iou:>6.2f} {landmark_error:>8.3f}"
+        )
+
+    print("")
+    print("recall: fraction of the full size faces that were also found")
+    print("iou: mean overlap of the matched face boxes with the full size ones")
+    print("lmk err: mean landmark distance from the full size landmarks, as a fraction of the face width")
+
+
+def _run(images: List[np.array], settings: DetectionSettings, repeat: int):
+    times = []
+    faces = []
+    for img_data in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = find_faces_from_array(img_data, settings)
+            times.append(time.perf_counter() - start)
+        faces.append(found)
+
+    return times, faces
+
+
+def _count(faces: List[List[FaceMetadata]]) -> int:
+    return sum(len(f) for f in faces)
+
+
+def _compare(expected: List[List[FaceMetadata]], actual: List[List[FaceMetadata]]):
+    matched = 0
+    ious = []
+    landmark_errors = []
+
+    for expected_faces, actual_faces in zip(expected, actual):
+        remaining = list(actual_faces)
+        for face in expected_faces:
+            if len(remaining) == 0:
+                break
+
+            best = max(remaining, key=lambda other: _iou(face.get_bounding_box(), other.get_bounding_box()))
+            iou = _iou(face.get_bounding_box(), best.get_bounding_box())
+            if iou < 0.5:
+                continue
+
+            remaining.remove(best)
+            matched += 1
+            ious.append(iou)
+            landmark_errors.append(_landmark_error(face, best))
+
+    total = _count(expected)
+    recall = matched / total if total > 0 else 1.0
+    mean_iou = statistics.mean(ious) if ious else 0.0
+    mean_landmark_error = statistics.mean(landmark_errors) if landmark_errors else 0.0
+
+    return recall, mean_iou, mean_landmark_error
+
+
+def _iou(a: (int, int, int, int), b: (int, int, int, int)) -> float:
+    a_top, a_right, a_bottom, a_left = a
+    b_top, b_right, b_bottom, b_left = b
+
+    width = min(a_right, b_right) - max(a_left, b_left)
+    height = min(a_bottom, b_bottom) - max(a_top, b_top)
+    if width <= 0 or height <= 0:
+        return 0.0
+
+    intersection = width * height
+    union = (a_right - a_left) * (a_bottom - a_top) + (b_right - b_left) * (b_bottom - b_top) - intersection
+    return intersection / union
+
+
+def _landmark_error(expected: FaceMetadata, actual: FaceMetadata) -> float:
+    top, right, bottom, left = expected.get_bounding_box()
+    face_width = max(1, right - left)
+
+    errors = []
+    for feature in ("left_eye", "right_eye", "top_lip", "bottom_lip"):
+        expected_points = np.array(expected.get_facial_feature_points(feature), dtype=np.float64)
+        actual_points = np.array(actual.get_facial_feature_points(feature), dtype=np.float64)
+        errors.append(np.linalg.norm(expected_points - actual_points, axis=1).mean())
+
+    return float(np.mean(errors)) / face_width
+
+
+if __name__ == "__main__":
+    main()
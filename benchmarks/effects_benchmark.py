@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from lib.detection import FaceMetadata
+from lib.effect import (
+    FaceIdentifyEffect,
+    FusedPointwiseEffect,
+    GhostEffect,
+    ImageEffect,
+    ImageProcessingContext,
+    PointwiseEffect,
+    SaturationEffect,
+    SketchyEyeEffect,
+    SwirlFaceEffect,
+    TvStaticEffect,
+    warm_effect_assets,
+)
+
+# how to create each effect for the benchmark. Every ImageEffect in
+# lib/effect.py needs to be in here, otherwise the benchmark refuses to run
+EFFECT_FACTORIES: Dict[type, Callable[[], ImageEffect]] = {
+    GhostEffect: lambda: GhostEffect(2),
+    SwirlFaceEffect: lambda: SwirlFaceEffect(1),
+    TvStaticEffect: lambda: TvStaticEffect(700),
+    SaturationEffect: lambda: SaturationEffect(0.7),
+    SketchyEyeEffect: lambda: SketchyEyeEffect(),
+    FaceIdentifyEffect: lambda: FaceIdentifyEffect(),
+    # the tail of most photobooth chains
+    FusedPointwiseEffect: lambda: FusedPointwiseEffect([TvStaticEffect(700), SaturationEffect(0.7)]),
+}
+
+# base classes that can't be created themselves
+ABSTRACT_EFFECTS = [PointwiseEffect]
+
+DEFAULT_SAMPLE_IMAGE = "./resources/input/test-image.jpg"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every image effect across image sizes and face counts")
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        help="the image sizes to run the effects on, as WIDTHxHEIGHT",
+        default=["640x480", "1280x720", "1920x1080", "3840x2160"],
+    )
+    parser.add_argument(
+        "--faces",
+        nargs="+",
+        type=int,
+        help="the number of (made up) faces in each image",
+        default=[0, 1, 2, 4, 8],
+    )
+    parser.add_argument(
+        "--effects",
+        nargs="+",
+        help="only run these effects (by class name)",
+        default=None,
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        help="how many times to time each effect",
+        default=5,
+    )
+    parser.add_argument(
+        "--sample-image",
+        help="the image to time finding faces on. Skipped if it (or dlib) is not available",
+        default=DEFAULT_SAMPLE_IMAGE,
+    )
+    parser.add_argument(
+        "--output",
+        help="the file to write the results to as json",
+        default=None,
+    )
+    parser.add_argument(
+        "--compare",
+        help="a previous results file to compare against. Exits with 1 if anything got slower",
+        default=None,
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="how much slower (as a fraction) a result can get before it counts as a regression",
+        default=0.15,
+    )
+    parser.add_argument(
+        "--min-change-ms",
+        type=float,
+        help="how many ms slower a result has to get to count as a regression, so timer noise on quick effects isn't",
+        default=0.5,
+    )
+
+    args = parser.parse_args()
+
+    effect_classes = _get_effect_classes(args.effects)
+    resolutions = [_parse_resolution(resolution) for resolution in args.resolutions]
+
+    warm_effect_assets()
+
+    results = []
+    for (width, height) in resolutions:
+        for num_faces in args.faces:
+            for effect_class in effect_classes:
+                result = time_effect(effect_class, width, height, num_faces, args.repeat)
+                _print_result(result)
+                results.append(result)
+
+    detection_result = time_detection(args.sample_image, args.repeat)
+    if detection_result is not None:
+        _print_result(detection_result)
+        results.append(detection_result)
+
+    report = {"metadata": _get_metadata(), "results": results}
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {len(results)} results to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(baseline["results"], results, args.threshold, args.min_change_ms)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+def time_effect(effect_class: type, width: int, height: int, num_faces: int, repeat: int) -> dict:
+    img_data = create_frame(width, height)
+    faces = create_faces(width, height, num_faces)
+
+    times = []
+    # the first run is thrown away, it pays for any caches being filled
+    for i in range(repeat + 1):
+        effect = EFFECT_FACTORIES[effect_class]()
+        # effects pick things at random, so keep every run the same
+        context = ImageProcessingContext(
+            Image.fromarray(img_data),
+            np.array(img_data),
+            faces,
+            rng=random.Random(i),
+            np_rng=np.random.default_rng(i),
+        )
+
+        start = time.perf_counter()
+        context.set_result(effect.process_image(context))
+        # make sure any lazy conversion back to an image is counted
+        _ = context.img
+        elapsed = time.perf_counter() - start
+
+        if i > 0:
+            times.append(elapsed)
+
+    return _create_result(f"effect/{effect_class.__name__}", width, height, num_faces, times)
+
+
+def time_detection(sample_image_path: str, repeat: int):
+    if not os.path.exists(sample_image_path):
+        print(f"skipping face detection, {sample_image_path} does not exist")
+        return None
+
+    try:
+        import face_recognition  # noqa: F401
+    except ImportError:
+        print("skipping face detection, face_recognition is not installed")
+        return None
+
+    from lib.detection import find_faces_from_array
+
+    img_data = np.array(Image.open(sample_image_path).convert("RGB"))
+    height, width = img_data.shape[:2]
+
+    times = []
+    num_faces = 0
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        num_faces = len(find_faces_from_array(img_data))
+        elapsed = time.perf_counter() - start
+
+        if i > 0:
+            times.append(elapsed)
+
+    return _create_result("detection/find_faces_from_array", width, height, num_faces, times)
+
+
+def create_frame(width: int, height: int) -> np.array:
+    """a made up RGB frame: a smooth gradient with some noise, so it compresses and blurs like a photo"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    gradient = (x[np.newaxis, :] + y[:, np.newaxis]) / 2
+    frame = np.stack([gradient, gradient[::-1], np.full_like(gradient, 128)], axis=2)
+    frame += rng.normal(0, 10, frame.shape).astype(np.float32)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def create_faces(width: int, height: int, num_faces: int) -> List[FaceMetadata]:
+    """made up faces laid out in a grid across the frame, with eyes and lips where you'd expect them"""
+    if num_faces == 0:
+        return []
+
+    columns = min(num_faces, 4)
+    rows = (num_faces + columns - 1) // columns
+    cell_width = width // columns
+    cell_height = height // rows
+    face_width = int(cell_width * 0.6)
+    face_height = int(cell_height * 0.7)
+
+    faces = []
+    for i in range(num_faces):
+        left = (i % columns) * cell_width + (cell_width - face_width) // 2
+        top = (i // columns) * cell_height + (cell_height - face_height) // 2
+        right = left + face_width
+        bottom = top + face_height
+
+        def points(center_x, center_y, spread_x, spread_y):
+            return [
+                (int(center_x + spread_x * np.cos(angle)), int(center_y + spread_y * np.sin(angle)))
+                for angle in np.linspace(0, 2 * np.pi, 6, endpoint=False)
+            ]
+
+        eye_spread = face_width // 10
+        features = {
+            "left_eye": points(left + face_width * 0.3, top + face_height * 0.35, eye_spread, eye_spread // 2),
+            "right_eye": points(left + face_width * 0.7, top + face_height * 0.35, eye_spread, eye_spread // 2),
+            "top_lip": points(left + face_width * 0.5, top + face_height * 0.75, face_width // 5, face_height // 30),
+            "bottom_lip": points(left + face_width * 0.5, top + face_height * 0.8, face_width // 5, face_height // 30),
+        }
+        faces.append(FaceMetadata((top, right, bottom, left), features))
+
+    return faces
+
+
+def compare(baseline: List[dict], results: List[dict], threshold: float, min_change_ms: float = 0.5) -> List[dict]:
+    """
+    print how each result changed from the baseline, returning the ones that
+    got slower than the threshold. Results that got less than min_change_ms
+    slower are never counted, since effects that only take a fraction of a ms
+    can easily change by more than the threshold from timer noise alone
+    """
+    baseline_by_key = {_get_key(result): result for result in baseline}
+
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(_get_key(result))
+        if previous is None:
+            continue
+
+        change = (result["median_ms"] - previous["median_ms"]) / previous["median_ms"]
+        if change > threshold and result["median_ms"] - previous["median_ms"] >= min_change_ms:
+            regressions.append(result)
+            print(
+                f"[REGRESSION] {result['name']} {result['width']}x{result['height']} faces={result['faces']}: "
+                f"{previous['median_ms']:.2f}ms -> {result['median_ms']:.2f}ms ({change:+.0%})"
+            )
+
+    print(f"{len(regressions)} regressions found (threshold {threshold:.0%}, at least {min_change_ms:.2f}ms)")
+    return regressions
+
+
+def _get_effect_classes(names: List[str]) -> List[type]:
+    missing = [cls.__name__ for cls in _get_all_subclasses(ImageEffect) if cls not in EFFECT_FACTORIES]
+    if len(missing) > 0:
+        raise Exception(f"the effects {missing} have no benchmark, add them to EFFECT_FACTORIES")
+
+    effect_classes = list(EFFECT_FACTORIES)
+    if names is not None:
+        effect_classes = [cls for cls in effect_classes if cls.__name__ in names]
+
+    return effect_classes
+
+
+def _get_all_subclasses(cls: type) -> List[type]:
+    subclasses = []
+    for subclass in cls.__subclasses__():
+        if subclass not in ABSTRACT_EFFECTS:
+            subclasses.append(subclass)
+        subclasses += _get_all_subclasses(subclass)
+
+    return subclasses
+
+
+def _parse_resolution(resolution: str) -> (int, int):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def _create_result(name: str, width: int, height: int, num_faces: int, times: List[float]) -> dict:
+    times_ms = sorted(t * 1000 for t in times)
+    return {
+        "name": name,
+        "width": width,
+        "height": height,
+        "faces": num_faces,
+        "runs": len(times_ms),
+        "median_ms": statistics.median(times_ms),
+        "min_ms": times_ms[0],
+        "max_ms": times_ms[-1],
+    }
+
+
+def _get_key(result: dict) -> tuple:
+    return result["name"], result["width"], result["height"], result["faces"]
+
+
+def _print_result(result: dict):
+    print(
+        f"{result['name']:<35} {result['width']:>5}x{result['height']:<5} faces={result['faces']:<2} "
+        f"median={result['median_ms']:>9.2f}ms min={result['min_ms']:>9.2f}ms"
+    )
+
+
+def _get_metadata() -> dict:
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from lib.display import HeadlessDisplay
+from lib.noise import NoiseBank, replace_noise_bank
+from lib.photobooth import Photobooth, PhotoPrinter, RecordedPhotos
+from lib.recording import DEFAULT_RECORDING_DIR, RecordedFaces, RecordedSession, get_file_digest, load_recording
+from lib.timing import TimingLog
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run recorded photobooth sessions again as fast as possible, and check they make the same strips"
+    )
+    parser.add_argument(
+        "recordings",
+        nargs="*",
+        help="the recordings (or directories of them) to replay, in order",
+        default=[DEFAULT_RECORDING_DIR],
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="where to save the replayed strips. Defaults to a new temp dir",
+        default=None,
+    )
+    parser.add_argument(
+        "--timing-log",
+        help="a jsonl file to write the timings of every replayed session to",
+        default=None,
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        help="how many times to replay all the recordings, to load test with more sessions than were recorded",
+        default=1,
+    )
+
+    args = parser.parse_args()
+
+    paths = _find_recordings(args.recordings)
+    if len(paths) == 0:
+        parser.error(f"no recordings found in {args.recordings}")
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="replay_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_sessions = len(paths) * args.repeat
+    timing_log = TimingLog(args.timing_log, window=num_sessions)
+    replayer = SessionReplayer(output_dir, timing_log)
+
+    print(f"replaying {num_sessions} session(s) into {output_dir}")
+    print(f"{'session':<45} {'replayed':>10} {'recorded':>10}  outputs")
+
+    results = []
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for path in paths:
+            result = replayer.replay(load_recording(path))
+            results.append(result)
+            print(
+                f"{result['name']:<45} {result['seconds'] * 1000:>8.1f}ms {result['recorded_seconds'] * 1000:>8.1f}ms"
+                f"  {'identical' if result['identical'] else 'DIFFERENT'}"
+            )
+    elapsed = time.perf_counter() - start
+
+    session_seconds = sum(result["seconds"] for result in results)
+    print("")
+    print(
+        f"replayed {len(results)} session(s) in {elapsed:.1f}s ({session_seconds:.1f}s in sessions), "
+        f"{len(results) * 3600 / session_seconds:.0f} sessions an hour back to back"
+    )
+    print("the recorded times include the countdowns, the replayed ones do not")
+    print("")
+    print(f"{'stage':<25} {'p50':>10} {'p95':>10} {'total':>10} {'count':>6}")
+    for stage, summary in sorted(timing_log.summary().items()):
+        print(
+            f"{stage:<25} {summary['p50'] * 1000:>8.1f}ms {summary['p95'] * 1000:>8.1f}ms "
+            f"{summary['sum']:>9.1f}s {summary['count']:>6}"
+        )
+
+    different = [result["name"] for result in results if not result["identical"]]
+    if len(different) > 0:
+        print("")
+        print(f"[FAIL] {len(different)} session(s) made different strips: {different}")
+        sys.exit(1)
+
+
+class SessionReplayer(object):
+    """
+    Runs recorded sessions again through a Photobooth, with no camera, no
+    countdowns and nothing printed. The photos, faces, seed and noise frames
+    all come from the recording, so each session should save exactly the same
+    strips it did when it was recorded.
+
+    A photobooth is created for each different setup the sessions were
+    recorded with, and reused for every session recorded with that setup.
+    """
+
+    def __init__(self, output_dir: str, timing_log: TimingLog = None):
+        self.output_dir = output_dir
+        self.timing_log = timing_log
+
+        self.__photobooths: Dict[tuple, Photobooth] = {}
+        self.__saved: List[str] = []
+
+        super().__init__()
+
+    def replay(self, recording: RecordedSession) -> dict:
+        """run the recorded session again, returning how long it took and whether it made the same strips"""
+        photobooth = self.__get_photobooth(recording)
+        photobooth.photo_taker = RecordedPhotos(recording.photos)
+        photobooth.face_cache = RecordedFaces([np.asarray(photo) for photo in recording.photos], recording.faces)
+        photobooth.printer.output_file_prefix = recording.name
+        replace_noise_bank(NoiseBank(recording.photos[0].size, keys=recording.get_noise_frames()))
+
+        self.__saved = []
+        photobooth.run(recording.seed)
+
+        digests = sorted(get_file_digest(path) for path in self.__saved)
+        expected = sorted(output["sha256"] for output in recording.outputs)
+
+        return {
+            "name": recording.name,
+            "seconds": photobooth.last_session_seconds,
+            "recorded_seconds": recording.timing["duration_ms"] / 1000,
+            "identical": digests == expected,
+        }
+
+    def __get_photobooth(self, recording: RecordedSession) -> Photobooth:
+        config = recording.config
+        key = tuple(sorted(config.items()))
+        if key in self.__photobooths:
+            return self.__photobooths[key]
+
+        printer = PhotoPrinter(
+            self.output_dir,
+            recording.name,
+            config["image_type"],
+            False,
+            unspooked_image_type=config["unspooked_image_type"],
+        )
+        printer.on_saved = self.__saved_strip
+
+        photobooth = Photobooth(
+            HeadlessDisplay(),
+            RecordedPhotos(recording.photos),
+            printer,
+            config["num_photos"],
+            config["border_size"],
+            0,
+            pipelined=config["pipelined"],
+            timing_log=self.timing_log,
+            layout=config["layout"],
+            stream_strips=config["stream_strips"],
+            pause_seconds=0,
+        )
+
+        # the ghosts and static are loaded now rather than in the first session
+        photobooth.wait_for_warm_up()
+
+        self.__photobooths[key] = photobooth
+        return photobooth
+
+    def __saved_strip(self, output_file_path: str):
+        self.__saved.append(output_file_path)
+
+
+def _find_recordings(paths: List[str]) -> List[str]:
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(glob.glob(os.path.join(path, "*.zip")))
+        elif os.path.exists(path):
+            found.append(path)
+
+    return found
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+# modules that take seconds to load, and should only be loaded once faces are
+# actually needed
+HEAVY_MODULES = ["dlib", "face_recognition"]
+
+DEFAULT_SAMPLE_IMAGE = "./resources/input/test-image.jpg"
+
+# run in a fresh interpreter, so that nothing is already imported. Prints how
+# long the import took and which of the heavy modules it loaded as json on the
+# last line
+_IMPORT_SCRIPT = """
+import json, runpy, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "script":
+    sys.argv = sys.argv[2:]
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    except SystemExit:
+        pass
+else:
+    __import__(sys.argv[2])
+elapsed = time.perf_counter() - start
+heavy = [name for name in json.loads(sys.argv[-1]) if name in sys.modules]
+print(json.dumps({"seconds": elapsed, "heavy_modules": heavy}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check how long the photobooth takes to start, and that dlib is only loaded when needed"
+    )
+    parser.add_argument(
+        "--max-import-seconds",
+        type=float,
+        help="how long an import (or photobomb.py --help) can take before the check fails",
+        default=3.0,
+    )
+    parser.add_argument(
+        "--sample-image",
+        help="the image used as the photos for the first session check. Skipped if it (or dlib) is not available",
+        default=DEFAULT_SAMPLE_IMAGE,
+    )
+    parser.add_argument(
+        "--num-photos",
+        type=int,
+        help="the number of photos taken in each session of the first session check",
+        default=2,
+    )
+
+    args = parser.parse_args()
+
+    failures = []
+    failures += check_import("photobomb.py --help", ["script", "photobomb.py", "--help"], args.max_import_seconds)
+    failures += check_import("import lib.photobooth", ["module", "lib.photobooth"], args.max_import_seconds)
+    failures += check_import("import lib.batch", ["module", "lib.batch"], args.max_import_seconds)
+
+    check_first_session(args.sample_image, args.num_photos)
+
+    if len(failures) > 0:
+        for failure in failures:
+            print(f"[FAIL] {failure}")
+        sys.exit(1)
+
+    print("all startup checks passed")
+
+
+def check_import(name: str, script_args: List[str], max_seconds: float) -> List[str]:
+    """time an import in a fresh interpreter, returning what went wrong (if anything)"""
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT] + script_args + [json.dumps(HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return [f"{name} failed: {result.stderr.strip()}"]
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"{name:<25} {report['seconds'] * 1000:>8.1f}ms  heavy modules loaded: {report['heavy_modules'] or 'none'}")
+
+    failures = []
+    if len(report["heavy_modules"]) > 0:
+        failures.append(f"{name} loaded {report['heavy_modules']}")
+    if report["seconds"] > max_seconds:
+        failures.append(f"{name} took {report['seconds']:.2f}s, more than {max_seconds}s")
+
+    return failures
+
+
+def check_first_session(sample_image_path: str, num_photos: int):
+    """
+    run two sessions straight after creating the photobooth, and compare how
+    long each stage took. The first session should not be much slower than
+    the second if the warm up worked
+    """
+    if not os.path.exists(sample_image_path):
+        print(f"skipping the first session check, {sample_image_path} does not exist")
+        return
+
+    try:
+        import face_recognition  # noqa: F401
+    except ImportError:
+        print("skipping the first session check, face_recognition is not installed")
+        return
+
+    from lib.display import HeadlessDisplay
+    from lib.photobooth import Photobooth, PhotoPrinter, RandomStaticPhoto
+    from lib.timing import TimingLog
+
+    output_dir = tempfile.mkdtemp(prefix="startup_check_")
+    timing_path = os.path.join(output_dir, "timings.jsonl")
+
+    start = time.perf_counter()
+    photobooth = Photobooth(
+        HeadlessDisplay(),
+        RandomStaticPhoto([sample_image_path]),
+        PhotoPrinter(output_dir, "startup_check", "png-fast", False),
+        num_photos,
+        5,
+        0,
+        timing_log=TimingLog(timing_path),
+    )
+    print(f"{'photobooth ready':<25} {(time.perf_counter() - start) * 1000:>8.1f}ms")
+
+    photobooth.run()
+    photobooth.run()
+
+    with open(timing_path) as f:
+        first, second = [json.loads(line) for line in f]
+
+    print(f"{'stage':<25} {'first':>10} {'second':>10}")
+    for name in ["session", "warm_up_wait", "detection", "composite", "save"]:
+        print(f"{name:<25} {_get_stage_ms(first, name):>8.1f}ms {_get_stage_ms(second, name):>8.1f}ms")
+
+
+def _get_stage_ms(record: dict, name: str) -> float:
+    if name == "session":
+        return record["duration_ms"]
+
+    return sum(s["duration_ms"] for s in record["spans"] if s["name"] == name)
+
+
+if __name__ == "__main__":
+    main()
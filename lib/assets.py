@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class AssetRegistry(object):
+    """
+    A process wide store of the image resources used by the effects.
+
+    Every resource is decoded once and kept converted to RGBA. Resized copies
+    (for example the tv static resized to the frame size) are kept in a LRU
+    that is bounded by the number of bytes the resized images take up.
+
+    The images handed out are shared, so they must not be changed. Make a copy
+    first if you need to draw on one.
+    """
+
+    def __init__(self, max_scaled_bytes: int = 256 * 1024 * 1024):
+        self.max_scaled_bytes = max_scaled_bytes
+
+        self.__lock = threading.RLock()
+        self.__images = {}
+        self.__directories = {}
+        self.__scaled_images = OrderedDict()
+        self.__scaled_bytes = 0
+
+        super().__init__()
+
+    def get_image(self, path: str) -> Image.Image:
+        path = os.path.normpath(path)
+
+        with self.__lock:
+            img = self.__images.get(path)
+            if img is None:
+                with Image.open(path) as opened:
+                    img = opened.convert("RGBA")
+                img.filename = path
+                self.__images[path] = img
+
+            return img
+
+    def get_images_in_directory(self, directory: str) -> List[Image.Image]:
+        directory = os.path.normpath(directory)
+
+        with self.__lock:
+            paths = self.__directories.get(directory)
+            if paths is None:
+                paths = [os.path.join(directory, file) for file in os.listdir(directory)]
+                self.__directories[directory] = paths
+
+            return [self.get_image(path) for path in paths]
+
+    def get_scaled_image(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        path = os.path.normpath(path)
+        key = (path, tuple(size))
+
+        with self.__lock:
+            if key in self.__scaled_images:
+                self.__scaled_images.move_to_end(key)
+                return self.__scaled_images[key]
+
+            img = self.get_image(path)
+            scaled = img if img.size == key[1] else img.resize(key[1])
+
+            self.__add_scaled(key, scaled)
+            return scaled
+
+    def get_scaled_array(self, path: str, size: Tuple[int, int]) -> np.array:
+        """
+        Same as `get_scaled_image`, but as a read only (height, width, 4)
+        array, so effects working on arrays don't pay for the conversion on
+        every frame
+        """
+        key = (os.path.normpath(path), tuple(size), "array")
+
+        with self.__lock:
+            if key in self.__scaled_images:
+                self.__scaled_images.move_to_end(key)
+                return self.__scaled_images[key]
+
+            scaled = np.array(self.get_scaled_image(path, size))
+            scaled.setflags(write=False)
+
+            self.__add_scaled(key, scaled)
+            return scaled
+
+    def warm(self, directories: List[str] = (), paths: List[str] = (), frame_size: Tuple[int, int] = None):
+        """
+        Decode the given resources ahead of time so the first photobooth
+        session doesn't pay for it. If a frame size is given, the single image
+        paths are also pre-scaled to it
+        """
+        for directory in directories:
+            self.get_images_in_directory(directory)
+
+        for path in paths:
+            self.get_image(path)
+            if frame_size is not None:
+                self.get_scaled_array(path, frame_size)
+
+    def __add_scaled(self, key, scaled):
+        self.__scaled_images[key] = scaled
+        self.__scaled_bytes += _size_in_bytes(scaled)
+
+        # drop the least recently used sizes until we are back under the
+        # limit, always keeping the one just added
+        while self.__scaled_bytes > self.max_scaled_bytes and len(self.__scaled_images) > 1:
+            _, evicted = self.__scaled_images.popitem(last=False)
+            self.__scaled_bytes -= _size_in_bytes(evicted)
+
+    def clear(self):
+        with self.__lock:
+            self.__images.clear()
+            self.__directories.clear()
+            self.__scaled_images.clear()
+            self.__scaled_bytes = 0
+
+
+def _size_in_bytes(scaled) -> int:
+    if isinstance(scaled, np.ndarray):
+        return scaled.nbytes
+
+    return scaled.width * scaled.height * len(scaled.getbands())
+
+
+_registry = AssetRegistry()
+
+
+def get_asset_registry() -> AssetRegistry:
+    return _registry
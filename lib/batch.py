@@ -0,0 +1,231 @@
+import glob
+import os
+import time
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from lib.detection import DetectionSettings, FaceMetadata, find_faces_from_array, warm_up_detection
+from lib.effect import (
+    FaceIdentifyEffect,
+    GhostEffect,
+    ImageEffect,
+    ImageProcessingContext,
+    SaturationEffect,
+    SketchyEyeEffect,
+    SwirlFaceEffect,
+    TvStaticEffect,
+    apply_effects,
+    warm_effect_assets,
+)
+from lib.face_cache import FaceCache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def create_effect(effect: str) -> ImageEffect:
+    """create the effect for the given photobomb.py effect name"""
+    if effect == "identify-face":
+        print("identify face effect added")
+        return FaceIdentifyEffect()
+    elif effect == "swirl":
+        print("swirl effect added")
+        return SwirlFaceEffect(1)
+    elif effect == "ghost":
+        print("ghost friend effect added")
+        return GhostEffect()
+    elif effect == "saturation":
+        print("saturation effect added")
+        return SaturationEffect(0.7)
+    elif effect == "eyes":
+        print("eye effect added")
+        return SketchyEyeEffect()
+    elif effect == "noise":
+        print("noise effect added")
+        return TvStaticEffect(500)
+
+    raise Exception(f"the effect {effect} is currently unsupported")
+
+
+def create_effect_chain(effects: List[str]) -> List[ImageEffect]:
+    image_processors = [create_effect(effect) for effect in effects]
+
+    if len(image_processors) < 1:
+        raise Exception("you must choose at least one type of image effect")
+
+    return image_processors
+
+
+def run_effect_chain(context: ImageProcessingContext, image_processors: List[ImageEffect]) -> Image.Image:
+    for p in image_processors:
+        print(f"applying effect: {p.__class__.__name__}")
+    apply_effects(context, image_processors)
+
+    return context.img
+
+
+def parse_effect_chain(chain: str) -> Tuple[str, List[str]]:
+    """
+    parse a chain in the form "name=effect,effect". If there is no name, the
+    effects joined together are used as the name
+    """
+    name, separator, effects = chain.partition("=")
+    if not separator:
+        effects = name
+        name = None
+
+    effect_names = [effect.strip() for effect in effects.split(",") if effect.strip()]
+    if name is None:
+        name = "-".join(effect_names)
+
+    return name, effect_names
+
+
+def find_input_files(inputs: List[str]) -> List[str]:
+    """expand the given files, directories and globs out to the image files to process"""
+    paths = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for root, _, files in os.walk(input_path):
+                paths.extend(os.path.join(root, file) for file in files)
+        else:
+            paths.extend(glob.glob(input_path, recursive=True))
+
+    seen = set()
+    result = []
+    for path in sorted(paths):
+        if path in seen or not os.path.isfile(path) or not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        seen.add(path)
+        result.append(path)
+
+    return result
+
+
+class BatchResult(object):
+    def __init__(self, input_path: str, output_paths: List[str], seconds: float, error: Optional[str] = None):
+        self.input_path = input_path
+        self.output_paths = output_paths
+        self.seconds = seconds
+        self.error = error
+        super().__init__()
+
+
+def run_batch(
+    input_paths: List[str],
+    chains: Dict[str, List[str]],
+    output_dir: str,
+    num_workers: int,
+    detection_settings: DetectionSettings = None,
+    face_cache_dir: str = None,
+) -> Iterator[BatchResult]:
+    """
+    Run every effect chain on every input image, spread out over a pool of
+    worker processes. Each worker loads dlib, the effect assets and the effect
+    chains once when it starts. Results are yielded as each image finishes, in
+    whatever order they finish in.
+
+    The outputs are laid out under output_dir in the same subdirectories the
+    inputs are in, relative to the directory they all share. If two inputs
+    would still be saved to the same files (e.g. img.jpg and img.png), a
+    ValueError is raised before any of them are processed
+    """
+    input_root = _get_input_root(input_paths)
+
+    inputs_by_output = {}
+    for input_path in input_paths:
+        output_name = _get_output_name(input_path, input_root)
+        if output_name in inputs_by_output:
+            raise ValueError(
+                f"{inputs_by_output[output_name]} and {input_path} would be saved to the same files in {output_dir}"
+            )
+        inputs_by_output[output_name] = input_path
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    with Pool(
+        num_workers,
+        initializer=_init_batch_worker,
+        initargs=(chains, output_dir, input_root, detection_settings, face_cache_dir),
+    ) as pool:
+        for result in pool.imap_unordered(_process_batch_image, input_paths):
+            yield result
+
+
+def _get_input_root(input_paths: List[str]) -> str:
+    """the deepest directory that all the inputs are in"""
+    if len(input_paths) == 0:
+        return ""
+
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in input_paths])
+
+
+def _get_output_name(input_path: str, input_root: str) -> str:
+    """the path of the input relative to the input root, without its extension"""
+    relative_path = os.path.relpath(os.path.abspath(input_path), input_root)
+    return os.path.splitext(relative_path)[0]
+
+
+_worker_state = None
+
+
+class _BatchWorkerState(object):
+    def __init__(self, chains, output_dir, input_root, detection_settings, face_cache_dir):
+        warm_effect_assets()
+        try:
+            warm_up_detection(detection_settings)
+        except ImportError as e:
+            print(f"[WARN]: couldnt load dlib to find faces: {e}")
+
+        self.chains = {name: create_effect_chain(effects) for name, effects in chains.items()}
+        self.output_dir = output_dir
+        self.input_root = input_root
+        self.detection_settings = detection_settings
+        self.face_cache = FaceCache(face_cache_dir) if face_cache_dir is not None else None
+
+        super().__init__()
+
+    def find_faces(self, img_data: np.array) -> List[FaceMetadata]:
+        if self.face_cache is not None:
+            return self.face_cache.find_faces(img_data, self.detection_settings)
+
+        return find_faces_from_array(img_data, self.detection_settings)
+
+
+def _init_batch_worker(chains, output_dir, input_root, detection_settings, face_cache_dir):
+    global _worker_state
+    _worker_state = _BatchWorkerState(chains, output_dir, input_root, detection_settings, face_cache_dir)
+
+
+def _process_batch_image(input_path: str) -> BatchResult:
+    start = time.perf_counter()
+    output_paths = []
+
+    try:
+        with Image.open(input_path) as opened:
+            img = opened.convert("RGB")
+
+        img_data = np.array(img)
+        faces = _worker_state.find_faces(img_data)
+
+        # inputs in subdirectories are saved to the same subdirectories of
+        # the output dir, so inputs with the same file name don't clash
+        output_name = _get_output_name(input_path, _worker_state.input_root)
+        os.makedirs(os.path.join(_worker_state.output_dir, os.path.dirname(output_name)), exist_ok=True)
+
+        for name, image_processors in _worker_state.chains.items():
+            # effects can draw straight onto the image, so every chain gets
+            # its own copy
+            context = ImageProcessingContext(None, img_data.copy(), faces)
+            result = run_effect_chain(context, image_processors)
+
+            output_path = os.path.join(_worker_state.output_dir, f"{output_name}-{name}.png")
+            result.save(output_path, "PNG")
+            output_paths.append(output_path)
+    except Exception as e:
+        return BatchResult(input_path, output_paths, time.perf_counter() - start, str(e))
+
+    return BatchResult(input_path, output_paths, time.perf_counter() - start)
@@ -0,0 +1,425 @@
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from lib.detection import DetectionSettings, FaceMetadata, find_faces_from_array
+from lib.effect import ImageEffect, ImageProcessingContext, apply_effect, fuse_effects
+from lib.timing import span
+
+BURST_FORMATS = ["gif", "mp4"]
+
+# marks the end of the frames coming from the capture thread
+_END_OF_BURST = object()
+
+# how many captured frames can be waiting to be spookified before the
+# capture waits for them
+_MAX_QUEUED_FRAMES = 4
+
+
+class FaceTracker(object):
+    """
+    Follows the faces found on a keyframe through the frames after it, using
+    optical flow on the facial landmarks. Each face moves by the median of how
+    far its landmarks moved, so a few landmarks that lose track don't drag the
+    face around, and any that are lost are moved along with the rest.
+
+    This is nowhere near as good as finding the faces again, but costs a few
+    milliseconds a frame instead of hundreds.
+    """
+
+    def __init__(self, window_size: int = 21, pyramid_levels: int = 3):
+        self.window_size = window_size
+        self.pyramid_levels = pyramid_levels
+        self.__gray: Optional[np.array] = None
+        self.__faces: List[FaceMetadata] = []
+        super().__init__()
+
+    def reset(self, gray: np.array, faces: List[FaceMetadata]):
+        """start tracking the faces found on a keyframe"""
+        self.__gray = gray
+        self.__faces = faces
+
+    def track(self, gray: np.array) -> List[FaceMetadata]:
+        """where the faces have moved to in the next frame"""
+        if self.__gray is None or len(self.__faces) == 0:
+            self.__gray = gray
+            return []
+
+        all_points = [_get_tracking_points(face) for face in self.__faces]
+        start_points = np.array([point for points in all_points for point in points], dtype=np.float32)
+
+        end_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.__gray,
+            gray,
+            start_points.reshape(-1, 1, 2),
+            None,
+            winSize=(self.window_size, self.window_size),
+            maxLevel=self.pyramid_levels,
+        )
+        end_points = end_points.reshape(-1, 2)
+        found = status.reshape(-1) == 1
+
+        height, width = gray.shape[:2]
+        faces = []
+        offset = 0
+        for face, points in zip(self.__faces, all_points):
+            face_slice = slice(offset, offset + len(points))
+            offset += len(points)
+            faces.append(
+                _move_face(face, start_points[face_slice], end_points[face_slice], found[face_slice], width, height)
+            )
+
+        self.__gray = gray
+        self.__faces = faces
+        return faces
+
+
+def _get_tracking_points(face: FaceMetadata) -> List[Tuple[float, float]]:
+    """the points followed for a face: its landmarks, or the corners and middle of its box if it has none"""
+    points = [point for feature_points in face.to_dict()["facial_features"].values() for point in feature_points]
+    if len(points) > 0:
+        return points
+
+    top, right, bottom, left = face.get_bounding_box()
+    return [(left, top), (right, top), (right, bottom), (left, bottom), ((left + right) / 2, (top + bottom) / 2)]
+
+
+def _move_face(
+    face: FaceMetadata, start: np.array, end: np.array, found: np.array, width: int, height: int
+) -> FaceMetadata:
+    if found.any():
+        shift = np.median(end[found] - start[found], axis=0)
+    else:
+        shift = np.zeros(2, dtype=np.float32)
+
+    # landmarks that were lost move with the rest of the face
+    moved = np.where(found[:, np.newaxis], end, start + shift)
+    moved[:, 0] = np.clip(moved[:, 0], 0, width - 1)
+    moved[:, 1] = np.clip(moved[:, 1], 0, height - 1)
+    moved = np.rint(moved).astype(int)
+
+    facial_features = {}
+    i = 0
+    for feature, points in face.to_dict()["facial_features"].items():
+        facial_features[feature] = [(int(x), int(y)) for x, y in moved[i : i + len(points)]]
+        i += len(points)
+
+    dx, dy = (int(round(v)) for v in shift)
+    top, right, bottom, left = face.get_bounding_box()
+    face_location = (
+        min(max(top + dy, 0), height - 1),
+        min(max(right + dx, 0), width - 1),
+        min(max(bottom + dy, 0), height - 1),
+        min(max(left + dx, 0), width - 1),
+    )
+
+    return FaceMetadata(face_location, facial_features)
+
+
+class AnimationWriter(object):
+    """Writes frames to an animation file one at a time, so the whole animation is never held in memory"""
+
+    def __init__(self, output_file_path: str, fps: float, max_size: int = None):
+        if fps <= 0:
+            raise ValueError("the fps must be positive")
+
+        self.output_file_path = output_file_path
+        self.fps = fps
+        self.max_size = max_size
+        self.frames_written = 0
+        super().__init__()
+
+    def write(self, frame: np.array):
+        """write an RGB or RGBA frame. Any alpha is dropped"""
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = frame[..., :3]
+
+        frame = _shrink(frame, self.max_size)
+        self._write(np.ascontiguousarray(frame))
+        self.frames_written += 1
+
+    def close(self):
+        raise NotImplementedError
+
+    def _write(self, frame: np.array):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class GifWriter(AnimationWriter):
+    """
+    Writes a looping gif. Each frame gets its own palette, since the ghosts
+    and static change the colours from frame to frame
+    """
+
+    def __init__(self, output_file_path: str, fps: float, max_size: int = None):
+        super().__init__(output_file_path, fps, max_size)
+        # gif frame durations are in hundredths of a second
+        self.__duration_ms = int(round(100 / fps)) * 10
+        self.__file = open(output_file_path, "wb")
+
+    def _write(self, frame: np.array):
+        # fast octree, the only quantizer that is quick enough to run on
+        # every frame
+        img = Image.fromarray(frame).quantize(256, method=2)
+
+        if self.frames_written == 0:
+            img.encoderinfo = {"loop": 0, "duration": self.__duration_ms}
+            for chunk in GifImagePlugin.getheader(img, None, img.encoderinfo)[0]:
+                self.__file.write(chunk)
+
+        for chunk in GifImagePlugin.getdata(img, duration=self.__duration_ms, include_color_table=True):
+            self.__file.write(chunk)
+
+    def close(self):
+        if self.__file.closed:
+            return
+
+        self.__file.write(b";")
+        self.__file.close()
+
+
+class Mp4Writer(AnimationWriter):
+    def __init__(self, output_file_path: str, fps: float, max_size: int = None):
+        super().__init__(output_file_path, fps, max_size)
+        self.__writer: Optional[cv2.VideoWriter] = None
+
+    def _write(self, frame: np.array):
+        # the encoder works on blocks, so keep the size even
+        height, width = frame.shape[:2]
+        frame = frame[: height - height % 2, : width - width % 2]
+
+        if self.__writer is None:
+            self.__writer = cv2.VideoWriter(
+                self.output_file_path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (frame.shape[1], frame.shape[0])
+            )
+            if not self.__writer.isOpened():
+                raise Exception(f"couldnt open {self.output_file_path} to write the video to")
+
+        self.__writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if self.__writer is not None:
+            self.__writer.release()
+            self.__writer = None
+
+
+def open_animation_writer(output_file_path: str, fps: float, max_size: int = None) -> AnimationWriter:
+    """a writer for the animation format given by the file's extension"""
+    extension = output_file_path.rsplit(".", 1)[-1].lower()
+    if extension == "gif":
+        return GifWriter(output_file_path, fps, max_size)
+    elif extension == "mp4":
+        return Mp4Writer(output_file_path, fps, max_size)
+
+    raise ValueError(f"unknown animation format {extension}, expected one of {BURST_FORMATS}")
+
+
+def _shrink(frame: np.array, max_size: Optional[int]) -> np.array:
+    height, width = frame.shape[:2]
+    if max_size is None or max(width, height) <= max_size:
+        return frame
+
+    scale = max_size / max(width, height)
+    return cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class BurstResult(object):
+    def __init__(self, output_file_path: str, num_frames: int, num_keyframes: int, seconds: float):
+        self.output_file_path = output_file_path
+        self.num_frames = num_frames
+        self.num_keyframes = num_keyframes
+        self.seconds = seconds
+        super().__init__()
+
+    def __repr__(self) -> str:
+        return (
+            f"BurstResult({self.output_file_path}, frames={self.num_frames}, "
+            f"keyframes={self.num_keyframes}, seconds={self.seconds:.1f})"
+        )
+
+
+class BurstRecorder(object):
+    """
+    Turns a burst of frames into a spooky animation.
+
+    Faces are only found properly on every keyframe_interval'th frame (the
+    keyframes), and are tracked with a FaceTracker on the frames in between.
+    The effects are picked once for the whole burst, and every frame gets
+    generators made with the same seed, so the ghosts stay where they are
+    instead of jumping around.
+
+    Frames are spookified as soon as they are taken while the rest of the
+    burst is still being captured, and are written to the animation straight
+    away. Frames bigger than max_size are shrunk when they are written, after
+    the effects are run, so that the ghosts are the same size as in the strips.
+    Only a few frames are kept waiting to be spookified: if the effects fall
+    behind, the next frames are taken late rather than piling up in memory.
+
+    find_faces is used on the keyframes. If it isn't set, faces are found with
+    the detection settings.
+    """
+
+    def __init__(
+        self,
+        num_frames: int = 30,
+        fps: float = 10,
+        keyframe_interval: int = 10,
+        image_format: str = "gif",
+        max_size: int = 480,
+        detection_settings: DetectionSettings = None,
+        find_faces: Callable[[np.array], List[FaceMetadata]] = None,
+    ):
+        if num_frames <= 0:
+            raise ValueError("a burst must have at least one frame")
+        if keyframe_interval <= 0:
+            raise ValueError("the keyframe interval must be positive")
+        if image_format not in BURST_FORMATS:
+            raise ValueError(f"unknown burst format {image_format}, expected one of {BURST_FORMATS}")
+
+        self.num_frames = num_frames
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+        self.image_format = image_format
+        self.max_size = max_size
+        self.detection_settings = detection_settings
+        self.find_faces = find_faces
+        super().__init__()
+
+    def record(
+        self,
+        frames: Iterable[Image.Image],
+        output_file_path: str,
+        effects: List[ImageEffect],
+        seed: int = None,
+        on_captured: Callable[[], None] = None,
+    ) -> BurstResult:
+        """
+        spookify the frames and write them to output_file_path. The frames are
+        read on a background thread as they are spookified, and on_captured is
+        called (from that thread) once the last one has been read
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+
+        start = time.perf_counter()
+
+        with span("burst", frames=self.num_frames, format=self.image_format) as attributes:
+            try:
+                with open_animation_writer(output_file_path, self.fps, self.max_size) as writer:
+                    num_keyframes = self.__write_frames(writer, frames, effects, seed, on_captured)
+            except BaseException:
+                # don't leave a half written animation behind
+                if os.path.exists(output_file_path):
+                    os.remove(output_file_path)
+                raise
+
+            attributes["keyframes"] = num_keyframes
+
+        return BurstResult(output_file_path, writer.frames_written, num_keyframes, time.perf_counter() - start)
+
+    def __write_frames(
+        self,
+        writer: AnimationWriter,
+        frames: Iterable[Image.Image],
+        effects: List[ImageEffect],
+        seed: int,
+        on_captured: Callable[[], None] = None,
+    ) -> int:
+        """spookify and write each frame, returning how many were keyframes"""
+        tracker = FaceTracker()
+        num_keyframes = 0
+        # the same effects are run on every frame, so they only need fusing once
+        effects = fuse_effects(effects)
+
+        for i, img in enumerate(self.__read_in_background(frames, on_captured)):
+            img_data = np.array(img.convert("RGB") if img.mode != "RGB" else img)
+            gray = cv2.cvtColor(img_data, cv2.COLOR_RGB2GRAY)
+
+            if i % self.keyframe_interval == 0:
+                with span("burst.keyframe", frame=i):
+                    faces = self.__find_faces(img_data)
+                tracker.reset(gray, faces)
+                num_keyframes += 1
+            else:
+                with span("burst.track", frame=i):
+                    faces = tracker.track(gray)
+
+            with span("burst.effects", frame=i):
+                context = ImageProcessingContext(
+                    None, img_data, faces, rng=random.Random(seed), np_rng=np.random.default_rng(seed)
+                )
+                for effect in effects:
+                    apply_effect(context, effect)
+
+            with span("burst.write", frame=i):
+                writer.write(context.img_data)
+
+        return num_keyframes
+
+    def __find_faces(self, img_data: np.array) -> List[FaceMetadata]:
+        if self.find_faces is not None:
+            return self.find_faces(img_data)
+
+        return find_faces_from_array(img_data, self.detection_settings)
+
+    def __read_in_background(self, frames: Iterable[Image.Image], on_captured: Callable[[], None] = None):
+        """
+        read the frames on another thread, so the next one is taken on time
+        while this one is being spookified. Once _MAX_QUEUED_FRAMES are
+        waiting, the next frame isn't taken until one of them is picked up
+        """
+        frame_queue = queue.Queue(maxsize=_MAX_QUEUED_FRAMES)
+        stopped = threading.Event()
+
+        def put(item) -> bool:
+            # give up if nobody is going to take the frames any more, e.g.
+            # writing the animation failed
+            while not stopped.is_set():
+                try:
+                    frame_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+
+            return False
+
+        def read():
+            try:
+                with span("burst.capture"):
+                    for img in frames:
+                        if not put(img):
+                            break
+            except Exception as e:
+                put(e)
+            finally:
+                put(_END_OF_BURST)
+
+            if on_captured is not None:
+                on_captured()
+
+        # run in a copy of our context so the capture is timed in this session
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(read,), daemon=True)
+        thread.start()
+
+        try:
+            while (item := frame_queue.get()) is not _END_OF_BURST:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            thread.join()
@@ -0,0 +1,306 @@
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.encoding import EncoderProfile, PngRowWriter
+
+
+class StripLayout(object):
+    """Where each photo goes on the printed page"""
+
+    def __init__(self, name: str):
+        self.name = name
+        super().__init__()
+
+    def get_positions(
+        self, num_photos: int, photo_width: int, photo_height: int, border_size: int
+    ) -> Tuple[int, int, List[Tuple[int, int]]]:
+        """
+        the (width, height) of the canvas and the (x, y) of the top left
+        corner of each photo on it. A photo can be placed more than once, so
+        there can be more positions than photos; position i holds photo
+        i % num_photos
+        """
+        raise NotImplementedError
+
+
+class VerticalStripLayout(StripLayout):
+    """the classic photobooth strip: one photo under another"""
+
+    def __init__(self):
+        super().__init__("strip")
+
+    def get_positions(self, num_photos: int, photo_width: int, photo_height: int, border_size: int):
+        return _get_grid_positions(1, num_photos, photo_width, photo_height, border_size)
+
+
+class GridLayout(StripLayout):
+    """the photos in rows of two, so four photos make a 2x2 grid"""
+
+    def __init__(self):
+        super().__init__("grid")
+
+    def get_positions(self, num_photos: int, photo_width: int, photo_height: int, border_size: int):
+        columns = min(num_photos, 2)
+        rows = math.ceil(num_photos / columns)
+        width, height, positions = _get_grid_positions(columns, rows, photo_width, photo_height, border_size)
+        # with an odd number of photos the last cell is left empty
+        return width, height, positions[:num_photos]
+
+
+class TwoUpLayout(StripLayout):
+    """
+    two copies of the vertical strip side by side, for printing on 4x6 paper
+    and cutting down the middle so there is a strip for everyone
+    """
+
+    def __init__(self):
+        super().__init__("4x6")
+
+    def get_positions(self, num_photos: int, photo_width: int, photo_height: int, border_size: int):
+        width, height, positions = _get_grid_positions(2, num_photos, photo_width, photo_height, border_size)
+        # go down the first strip and then the second, so position i holds
+        # photo i % num_photos
+        positions = positions[0::2] + positions[1::2]
+        return width, height, positions
+
+
+def _get_grid_positions(
+    columns: int, rows: int, photo_width: int, photo_height: int, border_size: int
+) -> Tuple[int, int, List[Tuple[int, int]]]:
+    width = (photo_width * columns) + ((columns + 1) * border_size)
+    height = (photo_height * rows) + ((rows + 1) * border_size)
+    positions = [
+        (
+            (column * photo_width) + ((column + 1) * border_size),
+            (row * photo_height) + ((row + 1) * border_size),
+        )
+        for row in range(rows)
+        for column in range(columns)
+    ]
+    return width, height, positions
+
+
+LAYOUTS: Dict[str, StripLayout] = {
+    layout.name: layout for layout in [VerticalStripLayout(), GridLayout(), TwoUpLayout()]
+}
+
+
+class StripCompositor(object):
+    """
+    Puts the photos of a session onto a white canvas, following a layout.
+
+    Canvases handed back with `release` are kept and reused whenever the
+    layout, number of photos and their size are the same, so the photos are
+    just copied over the last session's ones. A canvas that is still in use
+    (e.g. by another session being printed) is never handed out twice.
+    """
+
+    def __init__(self, layout: str = "strip", border_size: int = 5, background: int = 255):
+        if layout not in LAYOUTS:
+            raise ValueError(f"unknown layout {layout}, expected one of {sorted(LAYOUTS)}")
+
+        self.layout = LAYOUTS[layout]
+        self.border_size = border_size
+        self.background = background
+        self.__free_canvases: Dict[tuple, List[np.array]] = {}
+        # the key of every canvas that has been handed out, by its id
+        self.__canvas_keys: Dict[int, tuple] = {}
+        self.__lock = threading.Lock()
+        super().__init__()
+
+    def get_size(self, num_photos: int, photo_width: int, photo_height: int) -> Tuple[int, int]:
+        width, height, _ = self.layout.get_positions(num_photos, photo_width, photo_height, self.border_size)
+        return width, height
+
+    def compose(self, photos: List[np.array], canvas_name: str = "final") -> np.array:
+        """
+        copy the photos onto the canvas. The photos must all be the same size.
+        The canvas has an alpha channel only if one of the photos does
+        """
+        if len(photos) == 0:
+            raise ValueError("there must be at least one photo to compose")
+
+        photo_height, photo_width = photos[0].shape[:2]
+        for photo in photos:
+            if photo.shape[:2] != (photo_height, photo_width):
+                raise ValueError(
+                    f"the photos are not all the same size: {photo.shape[:2]} vs {(photo_height, photo_width)}"
+                )
+
+        channels = max([3] + [_get_channels(photo) for photo in photos])
+        width, height, positions = self.layout.get_positions(len(photos), photo_width, photo_height, self.border_size)
+
+        key = (canvas_name, self.layout.name, len(photos), photo_width, photo_height, channels)
+        with self.__lock:
+            free_canvases = self.__free_canvases.get(key)
+            canvas = free_canvases.pop() if free_canvases else None
+
+        if canvas is None:
+            # the borders never change, so they are only filled in once
+            canvas = np.full((height, width, channels), self.background, dtype=np.uint8)
+
+        with self.__lock:
+            self.__canvas_keys[id(canvas)] = key
+
+        for i, (x, y) in enumerate(positions):
+            photo = photos[i % len(photos)]
+            region = canvas[y : y + photo_height, x : x + photo_width]
+            _copy_photo(region, photo)
+
+        return canvas
+
+    def release(self, canvas: np.array):
+        """hand a canvas back once it has been saved, so it can be reused"""
+        with self.__lock:
+            key = self.__canvas_keys.pop(id(canvas), None)
+            if key is not None:
+                self.__free_canvases.setdefault(key, []).append(canvas)
+
+    def clear(self):
+        with self.__lock:
+            self.__free_canvases.clear()
+
+
+class StripBandWriter(object):
+    """
+    Writes a strip straight to disk as its photos are finished, rather than
+    putting them all on a canvas first.
+
+    The strip is written a band of rows at a time. Each band is one row of
+    the layout: once every photo in it has been added, it is drawn onto a
+    single band sized buffer and encoded, and the photos are let go. Photos
+    can be added in any order, but ones whose band is waiting on an earlier
+    photo are held until it arrives, so photos should be added in order to
+    keep only one in memory.
+
+    Since the band buffer and the file header are created with the first
+    photo, the strip always has an alpha channel if the format can store it.
+    """
+
+    def __init__(
+        self,
+        output_file_path: str,
+        encoder: EncoderProfile,
+        layout: StripLayout,
+        num_photos: int,
+        border_size: int = 5,
+        background: int = 255,
+    ):
+        if not encoder.can_stream():
+            raise ValueError(f"{encoder.name} images can't be written a band at a time")
+
+        self.output_file_path = output_file_path
+        self.encoder = encoder
+        self.layout = layout
+        self.num_photos = num_photos
+        self.border_size = border_size
+        self.background = background
+
+        self.__lock = threading.Lock()
+        self.__photos: Dict[int, np.array] = {}
+        self.__writer: Optional[PngRowWriter] = None
+        self.__band: Optional[np.array] = None
+        # the (top, [(photo index, x)]) of each row of the layout that is still to be written
+        self.__rows: List[Tuple[int, List[Tuple[int, int]]]] = []
+        self.__photo_size: Optional[Tuple[int, int]] = None
+        super().__init__()
+
+    def add_photo(self, index: int, photo: np.array):
+        """add the photo at `index` in the session, writing any bands that are now finished"""
+        with self.__lock:
+            if self.__writer is None:
+                self.__open(photo)
+
+            if photo.shape[:2] != self.__photo_size:
+                raise ValueError(f"the photos are not all the same size: {photo.shape[:2]} vs {self.__photo_size}")
+
+            self.__photos[index] = photo
+            self.__write_finished_rows()
+
+    def close(self):
+        """write the bottom border and finish the file. Every photo must have been added"""
+        with self.__lock:
+            if self.__writer is None or len(self.__rows) > 0:
+                raise ValueError(f"not every photo was added to {self.output_file_path}")
+
+            self.__write_border(self.__writer.height)
+            self.__writer.close()
+            self.__photos.clear()
+            self.__band = None
+
+    def abort(self):
+        """give up on the strip, removing anything written so far"""
+        with self.__lock:
+            if self.__writer is not None:
+                self.__writer.abort()
+            self.__photos.clear()
+            self.__band = None
+
+    def __open(self, photo: np.array):
+        photo_height, photo_width = photo.shape[:2]
+        width, height, positions = self.layout.get_positions(
+            self.num_photos, photo_width, photo_height, self.border_size
+        )
+
+        rows: Dict[int, List[Tuple[int, int]]] = {}
+        for i, (x, y) in enumerate(positions):
+            rows.setdefault(y, []).append((i % self.num_photos, x))
+
+        channels = 4 if self.encoder.supports_alpha else 3
+        self.__photo_size = (photo_height, photo_width)
+        self.__rows = sorted(rows.items())
+        self.__max_band_photos = max(len(placements) for placements in rows.values())
+        # the borders are the same in every band, so they are only filled in once
+        self.__band = np.full((photo_height, width, channels), self.background, dtype=np.uint8)
+        self.__writer = self.encoder.open_row_writer(self.output_file_path, width, height, channels)
+
+    def __write_finished_rows(self):
+        photo_height, photo_width = self.__photo_size
+        while len(self.__rows) > 0:
+            top, placements = self.__rows[0]
+            if any(index not in self.__photos for index, _ in placements):
+                return
+
+            self.__write_border(top)
+            if len(placements) < self.__max_band_photos:
+                # the last band of a grid can have an empty cell, which must
+                # not show the photo from the band before
+                self.__band[...] = self.background
+            for index, x in placements:
+                _copy_photo(self.__band[:, x : x + photo_width], self.__photos[index])
+            self.__writer.write_rows(self.__band)
+            self.__rows.pop(0)
+
+            # let go of the photos no later band needs
+            still_needed = {index for _, later in self.__rows for index, _ in later}
+            for index, _ in placements:
+                if index not in still_needed:
+                    self.__photos.pop(index, None)
+
+    def __write_border(self, bottom: int):
+        """write background rows from the last row written up to (not including) the row `bottom`"""
+        rows = bottom - self.__writer.rows_written
+        if rows > 0:
+            self.__writer.write_rows(np.full((rows,) + self.__band.shape[1:], self.background, dtype=np.uint8))
+
+
+def _get_channels(photo: np.array) -> int:
+    return 1 if photo.ndim == 2 else photo.shape[2]
+
+
+def _copy_photo(region: np.array, photo: np.array):
+    photo_channels = _get_channels(photo)
+    if photo.ndim == 2:
+        photo = photo[..., np.newaxis]
+
+    if photo_channels == 1:
+        region[..., :3] = photo
+    else:
+        region[..., :photo_channels] = photo
+
+    # photos without an alpha channel are fully opaque
+    if region.shape[2] == 4 and photo_channels < 4:
+        region[..., 3] = 255
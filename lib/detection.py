@@ -1,9 +1,12 @@
+import threading
+from multiprocessing import Pool, resource_tracker, shared_memory
 from typing import List
 
-import face_recognition
 import numpy as np
 from PIL import Image
 
+from lib.timing import span
+
 
 class FaceMetadata(object):
     def __init__(self, face_location, facial_features):
@@ -35,33 +38,238 @@ class FaceMetadata(object):
 
         return self.__facial_features[facial_feature]
 
+    def scale(self, scale: float) -> "FaceMetadata":
+        """the same face on a copy of the image resized by scale"""
+        return FaceMetadata(
+            _scale_box(self.__face_location, scale),
+            {
+                feature: [(round(x * scale), round(y * scale)) for (x, y) in points]
+                for feature, points in self.__facial_features.items()
+            },
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "face_location": list(self.__face_location),
+            "facial_features": {
+                feature: [list(point) for point in points] for feature, points in self.__facial_features.items()
+            },
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "FaceMetadata":
+        return FaceMetadata(
+            tuple(data["face_location"]),
+            {
+                feature: [tuple(point) for point in points]
+                for feature, points in data["facial_features"].items()
+            },
+        )
+
+
+class DetectionSettings(object):
+    """
+    Settings for how faces are found.
+
+    max_detection_size: if set, faces are found on a copy of the image that is
+                        shrunk so its longest side is at most this many pixels.
+                        The results are scaled back up to the original image
+    upsample_times:     how many times dlib upsamples the image looking for
+                        smaller faces
+    model:              the dlib face detection model, "hog" or "cnn"
+    """
+
+    def __init__(self, max_detection_size: int = None, upsample_times: int = 1, model: str = "hog"):
+        if max_detection_size is not None and max_detection_size <= 0:
+            raise ValueError("the max detection size must be positive")
+
+        self.max_detection_size = max_detection_size
+        self.upsample_times = upsample_times
+        self.model = model
+
+        super().__init__()
+
+    def __repr__(self) -> str:
+        return (
+            f"DetectionSettings(max_detection_size={self.max_detection_size}, "
+            f"upsample_times={self.upsample_times}, model={self.model!r})"
+        )
+
 
-def find_faces_from_image(img: Image.Image) -> [(int, int, int, int)]:
+def find_faces_from_image(img: Image.Image, settings: DetectionSettings = None) -> List[FaceMetadata]:
     img_data = np.array(img)
-    return find_faces_from_array(img_data)
+    return find_faces_from_array(img_data, settings)
 
 
-def find_faces_from_array(img_data: np.array) -> List[FaceMetadata]:
-    faces = face_recognition.face_locations(img_data)
+def find_faces_from_array(img_data: np.array, settings: DetectionSettings = None) -> List[FaceMetadata]:
+    if settings is None:
+        settings = DetectionSettings()
 
-    result = []
+    height, width = img_data.shape[:2]
+
+    with span("detection", width=width, height=height, detection_size=settings.max_detection_size) as attributes:
+        result = _find_faces(img_data, settings)
+        attributes["faces"] = len(result)
+
+    return result
+
+
+def warm_up_detection(settings: DetectionSettings = None):
+    """
+    load dlib and its models, and find faces on a blank frame, so that the
+    first real frame doesn't have to wait for it
+    """
+    if settings is None:
+        settings = DetectionSettings()
+
+    with span("detection.warm_up", model=settings.model):
+        import face_recognition
+
+        face_recognition.face_locations(np.zeros((64, 64, 3), dtype=np.uint8), model=settings.model)
 
+
+def _find_faces(img_data: np.array, settings: DetectionSettings) -> List[FaceMetadata]:
+    # dlib is only loaded once faces are actually needed, so anything that
+    # just works with FaceMetadata doesn't need it installed
+    import face_recognition
+
+    height, width = img_data.shape[:2]
+
+    # shrink the image down if it is bigger than we need to find faces on
+    scale = 1.0
+    detection_data = img_data
+    if settings.max_detection_size is not None and max(width, height) > settings.max_detection_size:
+        scale = settings.max_detection_size / max(width, height)
+        detection_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        detection_data = np.asarray(Image.fromarray(img_data).resize(detection_size, Image.BILINEAR, reducing_gap=2.0))
+
+    faces = face_recognition.face_locations(
+        detection_data, number_of_times_to_upsample=settings.upsample_times, model=settings.model
+    )
+
+    if len(faces) == 0:
+        return []
+
+    face_locations = []
     for face in faces:
-        top, right, bottom, left = face
-        print(f"A face is located @ {top}, {left}, {bottom}, {right}")
+        top, right, bottom, left = _scale_box(face, 1 / scale)
 
         # expand out face locations
         top -= 10
         top = max(0, top)
         bottom += 15
-        bottom = min(len(img_data), bottom)
+        bottom = min(height, bottom)
 
-        features = face_recognition.face_landmarks(
-            img_data, [(top, right, bottom, left)]
-        )
+        face_locations.append((top, right, bottom, left))
 
-        if len(features) != 1:
-            raise Exception(f"unexpected number of faces found: {len(features)}")
-        result.append(FaceMetadata((top, right, bottom, left), features[0]))
+    print(f"Found {len(face_locations)} face(s) @ {face_locations}")
+
+    # find the features of all the faces in one go, using the same image the
+    # faces were found on
+    all_features = face_recognition.face_landmarks(
+        detection_data, [_scale_box(location, scale) for location in face_locations]
+    )
+
+    if len(all_features) != len(face_locations):
+        raise Exception(f"unexpected number of faces found: {len(all_features)}")
+
+    result = []
+    for face_location, features in zip(face_locations, all_features):
+        if scale != 1.0:
+            features = {
+                feature: [(round(x / scale), round(y / scale)) for (x, y) in points]
+                for feature, points in features.items()
+            }
+
+        result.append(FaceMetadata(face_location, features))
 
     return result
+
+
+def _scale_box(box: (int, int, int, int), scale: float) -> (int, int, int, int):
+    if scale == 1.0:
+        return box
+
+    return tuple(round(value * scale) for value in box)
+
+
+class DetectionPool(object):
+    """
+    A pool of worker processes for finding faces in several frames at once.
+
+    The pool is meant to be started once and reused. Each worker loads dlib
+    when it starts, and frames are handed to the workers through shared memory
+    blocks that are kept between calls, so the pixels are never pickled.
+    Results always come back in the same order as the frames passed in.
+    """
+
+    def __init__(self, num_workers: int, settings: DetectionSettings = None):
+        if num_workers <= 0:
+            raise ValueError("there must be at least one detection worker")
+
+        self.num_workers = num_workers
+        self.settings = settings
+
+        # the workers need to share our resource tracker, otherwise each of
+        # them cleans up the shared frames it has seen when it exits
+        resource_tracker.ensure_running()
+        self.__pool = Pool(num_workers, initializer=_init_detection_worker, initargs=(settings,))
+        self.__buffers: List[shared_memory.SharedMemory] = []
+        self.__lock = threading.Lock()
+
+        super().__init__()
+
+    def find_faces(self, frames: List[np.array]) -> List[List[FaceMetadata]]:
+        with self.__lock:
+            tasks = []
+            for i, frame in enumerate(frames):
+                buffer = self.__get_buffer(i, frame.nbytes)
+                np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=buffer.buf), frame)
+                tasks.append((buffer.name, frame.shape, frame.dtype.str, self.settings))
+
+            with span("detection.pool", frames=len(frames), workers=self.num_workers) as attributes:
+                result = self.__pool.map(_find_faces_in_shared_frame, tasks, chunksize=1)
+                attributes["faces"] = sum(len(faces) for faces in result)
+
+            return result
+
+    def close(self):
+        with self.__lock:
+            self.__pool.close()
+            self.__pool.join()
+
+            for buffer in self.__buffers:
+                buffer.close()
+                buffer.unlink()
+            self.__buffers = []
+
+    def __get_buffer(self, index: int, size: int) -> shared_memory.SharedMemory:
+        if index < len(self.__buffers) and self.__buffers[index].size >= size:
+            return self.__buffers[index]
+
+        buffer = shared_memory.SharedMemory(create=True, size=size)
+        if index < len(self.__buffers):
+            self.__buffers[index].close()
+            self.__buffers[index].unlink()
+            self.__buffers[index] = buffer
+        else:
+            self.__buffers.append(buffer)
+
+        return buffer
+
+
+def _init_detection_worker(settings: DetectionSettings):
+    warm_up_detection(settings)
+
+
+def _find_faces_in_shared_frame(task) -> List[FaceMetadata]:
+    name, shape, dtype, settings = task
+
+    buffer = shared_memory.SharedMemory(name=name)
+    try:
+        img_data = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer.buf)
+        faces = find_faces_from_array(img_data, settings)
+        del img_data
+        return faces
+    finally:
+        buffer.close()
@@ -1,18 +1,74 @@
+import functools
+import queue
 import time
-import cv2
 from multiprocessing import Process, Queue
 
+import cv2
+import numpy as np
+
+from lib.frame_bus import FrameBus, SharedCamera
+
+# how long the preview waits for a camera frame before showing the last one
+# again, so the text keeps up even if the camera stalls
+_FRAME_TIMEOUT_SECONDS = 0.5
+
+
+def _display_loop(camera_number: int, request_queue: Queue, frame_bus_description=None, preview_options: dict = None):
+    if frame_bus_description is not None:
+        # someone else owns the camera, read its frames off the bus instead
+        frame_bus = FrameBus.attach(frame_bus_description)
+        last_seq = -1
+        last_frame = None
+        stalled = False
+
+        def read():
+            nonlocal last_seq, last_frame, stalled
+            try:
+                last_seq = frame_bus.wait_for_frame(last_seq, timeout=_FRAME_TIMEOUT_SECONDS)
+            except TimeoutError as e:
+                # the camera has stalled (or is being restarted). Keep showing
+                # the last frame, so the text still changes, and try again
+                if not stalled:
+                    print(f"[WARN]: no camera frame for the preview, showing the last one until there is: {e}")
+                stalled = True
+                return last_frame is not None, last_frame
+
+            stalled = False
+            latest = frame_bus.latest_frame()
+            if latest is not None:
+                last_frame = latest[2]
+            return last_frame is not None, last_frame
+
+    else:
+        my_cam = cv2.VideoCapture(camera_number)
+        read = my_cam.read
+
+    # the preview is created here rather than passed in, since the effects
+    # can't be sent to another process
+    preview = None
+    if preview_options is not None:
+        from lib.preview import SpookyPreview
+
+        preview = SpookyPreview(**preview_options)
 
-def _display_loop(camera_number: int, request_queue: Queue):
-    my_cam = cv2.VideoCapture(camera_number)
     current_text = None
     while True:
-        ret_val, img = my_cam.read()
-
-        new_text = None
+        # reading blocks until the camera has a new frame, so the preview runs
+        # at the camera frame rate
+        ret_val, img = read()
+        if not ret_val:
+            continue
+
+        frame_start = time.perf_counter()
+
+        # handle every request that came in since the last frame, only the
+        # last one matters
+        while True:
+            try:
+                req = request_queue.get_nowait()
+            except queue.Empty:
+                break
 
-        if not request_queue.empty():
-            req = request_queue.get_nowait()
             if req:
                 type = req.get("type")
                 if type == "clear":
@@ -22,18 +78,69 @@ def _display_loop(camera_number: int, request_queue: Queue):
 
         img = cv2.flip(img, 1)
 
+        effect_seconds = 0.0
+        if preview is not None:
+            effect_start = time.perf_counter()
+            img = preview.render(img)
+            effect_seconds = time.perf_counter() - effect_start
+
         if current_text:
-            _draw_main_text(img, current_text.get("text"))
-            _draw_sub_text(img, current_text.get("subtext"))
+            height, width = img.shape[:2]
+            overlay = _get_text_overlay(current_text.get("text"), current_text.get("subtext"), width, height)
+            _blend_overlay(img, overlay)
 
         cv2.imshow("my webcam", img)
 
+        if preview is not None:
+            preview.frame_done(time.perf_counter() - frame_start, effect_seconds)
+
         # for some reason this line needs to be here or this doesn't work. I don't know why,
         # but I do know it won't work otherwise!
         if cv2.waitKey(1) == 27:
             break  # esc to quit
 
-        time.sleep(0.01)
+
+class _TextOverlay(object):
+    """
+    Some text, drawn once. Only the pixels the text covers are kept (as flat
+    indices into the frame), along with their colour and alpha. Fully opaque
+    pixels are copied straight over, the anti-aliased edges are blended
+    """
+
+    def __init__(self, canvas: np.array):
+        alpha = canvas[..., 3].reshape(-1)
+        bgr = canvas[..., :3].reshape(-1, 3)
+
+        opaque = alpha == 255
+        self.opaque_indices = np.flatnonzero(opaque)
+        self.opaque_bgr = bgr[opaque]
+
+        edge = (alpha > 0) & ~opaque
+        self.edge_indices = np.flatnonzero(edge)
+        edge_alpha = alpha[edge].astype(np.uint16)[:, np.newaxis]
+        self.edge_premultiplied_bgr = bgr[edge].astype(np.uint16) * edge_alpha
+        self.edge_inverse_alpha = 255 - edge_alpha
+
+        super().__init__()
+
+
+@functools.lru_cache(maxsize=32)
+def _get_text_overlay(text: str, subtext: str, width: int, height: int) -> _TextOverlay:
+    canvas = np.zeros((height, width, 4), dtype=np.uint8)
+    if text:
+        _draw_main_text(canvas, text)
+    if subtext:
+        _draw_sub_text(canvas, subtext)
+
+    return _TextOverlay(canvas)
+
+
+def _blend_overlay(img: np.array, overlay: _TextOverlay):
+    pixels = img.reshape(-1, 3)
+
+    edge = pixels[overlay.edge_indices].astype(np.uint16)
+    pixels[overlay.edge_indices] = (edge * overlay.edge_inverse_alpha + overlay.edge_premultiplied_bgr) // 255
+    pixels[overlay.opaque_indices] = overlay.opaque_bgr
 
 
 def _draw_main_text(img, text="Die!"):
@@ -47,7 +154,7 @@ def _draw_main_text(img, text="Die!"):
         fontScale=font_scale,
         thickness=thickness,
     )
-    while text_width >= width:
+    while text_width >= width and font_scale > 1:
         font_scale -= 1
         (text_width, text_height), _ = cv2.getTextSize(
             text,
@@ -73,7 +180,7 @@ def _draw_text(img, text, text_location, font_scale, thickness):
         org=text_location,
         fontFace=cv2.FONT_HERSHEY_COMPLEX,
         fontScale=font_scale,
-        color=[0, 0, 0],
+        color=[0, 0, 0, 255],
         lineType=cv2.LINE_AA,
         thickness=thickness,
     )
@@ -83,19 +190,32 @@ def _draw_text(img, text, text_location, font_scale, thickness):
         org=text_location,
         fontFace=cv2.FONT_HERSHEY_COMPLEX,
         fontScale=font_scale,
-        color=[255, 255, 255],
+        color=[255, 255, 255, 255],
         lineType=cv2.LINE_AA,
         thickness=(thickness - 2),
     )
 
 
 class PhotoboothDisplay:
-    def __init__(self, camera_to_use) -> "PhotoboothDisplay":
+    """
+    Shows the camera preview, with text on top of it, in its own process.
+
+    If preview_options is given, lightweight effects are run on the preview
+    too. They are passed to lib.preview.SpookyPreview, e.g.
+    {"target_fps": 15, "detection_interval": 5}
+    """
+
+    def __init__(
+        self, camera_to_use, shared_camera: SharedCamera = None, preview_options: dict = None
+    ) -> "PhotoboothDisplay":
 
         self.request_queue = Queue()
 
+        frame_bus_description = shared_camera.description if shared_camera is not None else None
         Process(
-            target=_display_loop, args=(camera_to_use, self.request_queue), daemon=True
+            target=_display_loop,
+            args=(camera_to_use, self.request_queue, frame_bus_description, preview_options),
+            daemon=True,
         ).start()
 
     def put_text(self, text, subtext="") -> None:
@@ -103,3 +223,13 @@ class PhotoboothDisplay:
 
     def clear_text(self) -> None:
         self.request_queue.put({"type": "clear"})
+
+
+class HeadlessDisplay(object):
+    """stands in for PhotoboothDisplay where there is no camera or window, e.g. in the benchmarks"""
+
+    def put_text(self, text: str, subtext: str = "") -> None:
+        pass
+
+    def clear_text(self) -> None:
+        pass
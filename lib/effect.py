@@ -1,28 +1,159 @@
+import functools
 import math
-import os
 import random
 from abc import abstractmethod
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
+from PIL import Image, ImageDraw, ImageFilter
+from lib.assets import get_asset_registry
 from lib.detection import FaceMetadata
-from typing import List
+from lib.noise import get_noise_bank, noise_to_alpha
+from lib.pointwise import PointwiseProgram
+from lib.timing import span
+from typing import List, Tuple, Union
+
+DEFAULT_GHOST_IMAGE_PATH = "./resources/ghosts/"
+DEFAULT_TV_STATIC_IMAGE_PATH = "./resources/tv_static.jpg"
+
+
+# ImageFilter.BLUR uses a 5x5 kernel, so the blurred mask reaches 2 pixels
+# past the edge of each ghost. PIL also leaves a 2 pixel border of a filtered
+# image untouched, so we pad by double that to get the same result as blurring
+# the whole image
+_GHOST_MASK_BLUR_PADDING = 4
+
+# how much of the tv static shows through on top of the image
+_TV_STATIC_BLEND_AMOUNT = 0.3
 
 
 class IllegalStateException(Exception):
     pass
 
 
+def warm_effect_assets(frame_size: Tuple[int, int] = None):
+    """
+    Load all of the default effect resources into the asset registry, so the
+    first effects created don't have to
+    """
+    get_asset_registry().warm(
+        directories=[DEFAULT_GHOST_IMAGE_PATH],
+        paths=[DEFAULT_TV_STATIC_IMAGE_PATH],
+        frame_size=frame_size,
+    )
+
+    # start filling the tv static noise for the frame size as well
+    if frame_size is not None:
+        get_noise_bank(frame_size)
+
+
 class ImageProcessingContext(object):
-    def __init__(self, img: Image.Image, img_data: np.array, faces: List[FaceMetadata]):
-        self.img = img
-        self.img_data = img_data
+    """
+    The image being processed, and the faces found in it.
+
+    The image is owned as a single array (`img_data`), and a PIL image (`img`)
+    is only created from it when an effect asks for one. Whichever of the two
+    was last changed is the source of truth, and the other is only recreated
+    from it when it is next asked for, so a chain of effects only pays for a
+    conversion when it switches between PIL and array effects.
+
+    Effects that change `img` or `img_data` in place must return it, so that
+    `set_result` knows which one changed.
+
+    Effects pick things at random with `rng` and `np_rng` rather than the
+    shared generators, so an image can be spookified the same way again by
+    passing generators made with the same seed. Unseeded ones are made if
+    they aren't given.
+    """
+
+    def __init__(
+        self,
+        img: Image.Image,
+        img_data: np.array,
+        faces: List[FaceMetadata],
+        rng: random.Random = None,
+        np_rng: np.random.Generator = None,
+    ):
+        self.__img = img
+        self.__img_data = img_data
+        self.__img_stale = img is None
+        self.__img_data_stale = img_data is None
+        self.__filename = getattr(img, "filename", None)
         self.faces = faces
+        self.rng = rng if rng is not None else random.Random()
+        self.np_rng = np_rng if np_rng is not None else np.random.default_rng()
         super().__init__()
 
+    @property
+    def img(self) -> Image.Image:
+        if self.__img_stale:
+            self.__img = Image.fromarray(self.__img_data)
+            self.__img_stale = False
+
+        return self.__img
+
+    @img.setter
+    def img(self, img: Image.Image):
+        # effects that work on arrays return them, so older code doing
+        # `context.img = effect.process_image(context)` still works
+        if isinstance(img, np.ndarray):
+            self.img_data = img
+            return
+
+        self.__img = img
+        self.__img_stale = False
+        self.__img_data_stale = True
+
+    @property
+    def img_data(self) -> np.array:
+        if self.__img_data_stale:
+            self.__img_data = np.array(self.__img)
+            self.__img_data_stale = False
+
+        return self.__img_data
+
+    @img_data.setter
+    def img_data(self, img_data: np.array):
+        self.__img_data = img_data
+        self.__img_data_stale = False
+        self.__img_stale = True
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """the (width, height) of the image, without converting it"""
+        if self.__img_stale:
+            return self.__img_data.shape[1], self.__img_data.shape[0]
+
+        return self.__img.size
+
+    def rgba_data(self) -> np.array:
+        """
+        the image as an RGBA array. The conversion only happens once, after
+        that the RGBA array is the image
+        """
+        img_data = self.img_data
+        if img_data.ndim == 3 and img_data.shape[2] == 4:
+            return img_data
+
+        if img_data.ndim == 3 and img_data.shape[2] == 3:
+            rgba = np.empty(img_data.shape[:2] + (4,), dtype=np.uint8)
+            rgba[..., :3] = img_data
+            rgba[..., 3] = 255
+        else:
+            rgba = np.array(self.img.convert("RGBA"))
+
+        self.img_data = rgba
+        return rgba
+
+    def set_result(self, result):
+        """update the image with what an effect returned, either a PIL image or an array"""
+        if isinstance(result, np.ndarray):
+            self.img_data = result
+        else:
+            self.img = result
+
     def filename(self):
-        if hasattr(self.img, "filename"):
-            return self.img.filename
+        if self.__filename is not None:
+            return self.__filename
 
         return "Unknown"
 
@@ -32,72 +163,148 @@ class ImageEffect(object):
         super().__init__()
 
     @abstractmethod
-    def process_image(self, context: ImageProcessingContext) -> Image.Image:
+    def process_image(self, context: ImageProcessingContext) -> Union[Image.Image, np.array]:
+        """
+        run the effect on the image in the context. Effects can work on and
+        return either `context.img` or `context.img_data`
+        """
         raise NotImplementedError
 
 
+class PointwiseEffect(ImageEffect):
+    """
+    An effect where each pixel only depends on the same pixel of the image
+    (and of other images the same size), so it can be written as a step of a
+    PointwiseProgram. Pointwise effects next to each other in a chain are
+    fused by `apply_effects` into a single pass over the image.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def process_image(self, context: ImageProcessingContext) -> np.array:
+        program = PointwiseProgram(context.img_data)
+        self.add_to_program(program)
+        return program.run()
+
+    @abstractmethod
+    def add_to_program(self, program: PointwiseProgram):
+        raise NotImplementedError
+
+
+class FusedPointwiseEffect(ImageEffect):
+    """several pointwise effects, run one after another in a single pass"""
+
+    def __init__(self, effects: List[PointwiseEffect]):
+        self.effects = effects
+        super().__init__()
+
+    def process_image(self, context: ImageProcessingContext) -> np.array:
+        program = PointwiseProgram(context.img_data)
+        for effect in self.effects:
+            effect.add_to_program(program)
+        return program.run()
+
+
+def fuse_effects(effects: List[ImageEffect]) -> List[ImageEffect]:
+    """the same chain of effects, with every run of pointwise effects next to each other fused into one"""
+    fused = []
+    run = []
+    for effect in effects + [None]:
+        if isinstance(effect, PointwiseEffect):
+            run.append(effect)
+            continue
+
+        if len(run) == 1:
+            fused.append(run[0])
+        elif len(run) > 1:
+            fused.append(FusedPointwiseEffect(run))
+        run = []
+
+        if effect is not None:
+            fused.append(effect)
+
+    return fused
+
+
+def apply_effect(context: ImageProcessingContext, effect: ImageEffect):
+    """run the effect on the context, timing it as a stage of the current session"""
+    width, height = context.size
+    attributes = {"width": width, "height": height, "faces": len(context.faces)}
+    if isinstance(effect, FusedPointwiseEffect):
+        attributes["effects"] = [e.__class__.__name__ for e in effect.effects]
+
+    with span(f"effect.{effect.__class__.__name__}", **attributes):
+        context.set_result(effect.process_image(context))
+
+
+def apply_effects(context: ImageProcessingContext, effects: List[ImageEffect]):
+    """run a chain of effects on the context, fusing the pointwise effects next to each other"""
+    for effect in fuse_effects(effects):
+        apply_effect(context, effect)
+
+
 class GhostEffect(ImageEffect):
-    def __init__(self, num_ghosts: int = 2, ghost_image_paths="./resources/ghosts/"):
-        self.__ghost_images = []
+    def __init__(self, num_ghosts: int = 2, ghost_image_paths=DEFAULT_GHOST_IMAGE_PATH):
+        self.__ghost_images = get_asset_registry().get_images_in_directory(ghost_image_paths)
         self._num_ghosts = num_ghosts
 
-        max_ghost_width = 0
-        for file in os.listdir(ghost_image_paths):
-            full_path = os.path.join(ghost_image_paths, file)
-            img = Image.open(full_path)
-            max_ghost_width = max(max_ghost_width, img.width)
-            self.__ghost_images.append(img)
-
         if len(self.__ghost_images) == 0:
             raise IllegalStateException(f"no images found in the path {ghost_image_paths}")
 
-        self.__max_ghost_width = max_ghost_width
+        self.__max_ghost_width = max(img.width for img in self.__ghost_images)
 
         super().__init__()
 
     def process_image(self, context: ImageProcessingContext):
         """
         for this, we need to:
-            1. Create an all blank image the size of the passed in image
-            2. Paste onto it all the ghost images we want
-            3. Create a mask that is all blank, white where we want the image
-            4. Composite ghost sheet onto OG image with mask
+            1. Pick where each ghost goes
+            2. For the area around each ghost, create a blank image and paste
+               the ghost onto it
+            3. Create a mask from the ghost alpha, set where we want the image
+            4. Composite the ghost area onto OG image with mask
             5. ...
             6. profit?
         """
-        img = context.img
-
-        transparent_img = img.convert("RGBA")
+        width, height = context.size
 
-        all_ghost_image = Image.new("RGBA", img.size, (255, 255, 255, 0))
+        ghost_locations = self.__get_ghost_locations(context.size, context.rng)
 
-        for (ghost_image, left, top) in self.__get_ghost_locations(img):
-            right = left + ghost_image.width
-            bottom = top + ghost_image.height
+        # the ghosts are see through, so the image needs an alpha channel
+        rgba_data = context.rgba_data()
 
-            # create the base ghost image
-            all_ghost_image.paste(ghost_image, (left, top, right, bottom))
+        # only the area around each ghost needs to be touched. The region is
+        # padded so that the blurred edge of the mask is included as well
+        for (ghost_image, left, top) in ghost_locations:
+            region_left = max(0, left - _GHOST_MASK_BLUR_PADDING)
+            region_top = max(0, top - _GHOST_MASK_BLUR_PADDING)
+            region_right = min(width, left + ghost_image.width + _GHOST_MASK_BLUR_PADDING)
+            region_bottom = min(height, top + ghost_image.height + _GHOST_MASK_BLUR_PADDING)
 
-        # # Create mask that has the same setup
-        ghost_mask = Image.new("L", img.size, 0)
+            # create the base ghost image for this region. Any neighbouring
+            # ghosts that overlap the padded region are pasted too
+            ghost_sheet = Image.new(
+                "RGBA", (region_right - region_left, region_bottom - region_top), (255, 255, 255, 0)
+            )
+            for (other_ghost, other_left, other_top) in ghost_locations:
+                ghost_sheet.paste(other_ghost, (other_left - region_left, other_top - region_top))
 
-        for x in range(0, ghost_mask.width):
-            for y in range(0, ghost_mask.height):
-                r, g, b, a = all_ghost_image.getpixel((x, y))
+            # Create mask straight from the ghost sheet alpha channel. An alpha
+            # of 0 means the pixel is transparent, which we use to create an
+            # image mask only where the ghost pixels are located
+            alpha = np.asarray(ghost_sheet.getchannel("A"))
+            ghost_mask = Image.fromarray(np.where(alpha > 0, 150, 0).astype(np.uint8))
 
-                # 'a' is the alpha value of the combinaton of all ghosts images at point x,y
-                # An alpha of 0 means the pixel is transparent, which we use to create an image
-                # mask only where the ghost pixels are located
-                if a == 0:
-                    continue
+            blur_mask = ghost_mask.filter(ImageFilter.BLUR)
 
-                ghost_mask.putpixel((x, y), 150)
+            region_data = rgba_data[region_top:region_bottom, region_left:region_right]
+            composited = Image.composite(ghost_sheet, Image.fromarray(region_data), blur_mask)
+            region_data[...] = np.asarray(composited)
 
-        blur_mask = ghost_mask.filter(ImageFilter.BLUR)
+        return rgba_data
 
-        return Image.composite(all_ghost_image, transparent_img, blur_mask)
-
-    def __get_ghost_locations(self, img: Image.Image) -> [(Image.Image, int, int)]:
+    def __get_ghost_locations(self, img_size: Tuple[int, int], rng: random.Random) -> [(Image.Image, int, int)]:
         """
         Get all locations to put a ghost image
 
@@ -105,7 +312,8 @@ class GhostEffect(ImageEffect):
         image, and gives their top+left x,y coordinates
 
         Parameters:
-        img (Image.Image): The image we want to add ghosts too
+        img_size ((int, int)): The (width, height) of the image we want to add ghosts too
+        rng (random.Random): Where the ghosts and their locations are picked from
 
         Returns:
         [(Image.Image, int, int)]: list of ghosts including the (x,y)
@@ -114,19 +322,21 @@ class GhostEffect(ImageEffect):
                                    on the original image
         """
 
+        img_width, _ = img_size
+
         # use the max ghost image width and the number of images to determine
         # how many ghosts to place
         num_ghosts_to_place = min(
             len(self.__ghost_images),
             self._num_ghosts,  # we dont want to overload the image with ghosts
-            math.floor(img.width / self.__max_ghost_width),
+            math.floor(img_width / self.__max_ghost_width),
         )
 
         result = []
         chosen_ghosts = set()
         for i in range(num_ghosts_to_place):
             while True:
-                ghost_index = random.randint(0, len(self.__ghost_images) - 1)
+                ghost_index = rng.randint(0, len(self.__ghost_images) - 1)
 
                 if str(ghost_index) not in chosen_ghosts:
                     chosen_ghosts.add(str(ghost_index))
@@ -141,11 +351,11 @@ class GhostEffect(ImageEffect):
             # |           image           |
             # | ghost range | ghost range |
             # | x           |       x     |
-            min_ghost_x = int((img.width / num_ghosts_to_place) * i)
-            max_ghost_x = int(((img.width / num_ghosts_to_place) * (i + 1) - 1) - ghost.width)
+            min_ghost_x = int((img_width / num_ghosts_to_place) * i)
+            max_ghost_x = int(((img_width / num_ghosts_to_place) * (i + 1) - 1) - ghost.width)
 
-            left = random.randint(min_ghost_x, max_ghost_x)
-            top = random.randint(10, 30)
+            left = rng.randint(min_ghost_x, max_ghost_x)
+            top = rng.randint(10, 30)
             result.append((ghost, left, top))
 
         return result
@@ -175,134 +385,187 @@ class FaceIdentifyEffect(ImageEffect):
         return img
 
 
-class SaturationEffect(ImageEffect):
+class SaturationEffect(PointwiseEffect):
     def __init__(self, saturation_percentage):
         self.__saturation_percentage = saturation_percentage
         super().__init__()
 
-    def process_image(self, context: ImageProcessingContext) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(context.img)
-        return enhancer.enhance(self.__saturation_percentage)
+    def add_to_program(self, program: PointwiseProgram):
+        # the same as ImageEnhance.Contrast
+        program.contrast(self.__saturation_percentage)
 
 
-class TvStaticEffect(ImageEffect):
+class TvStaticEffect(PointwiseEffect):
     """Gives a colour tv static like effect, something real spooky"""
 
-    def __init__(self, sigma, static_tv_image_path="./resources/tv_static.jpg"):
+    def __init__(self, sigma, static_tv_image_path=DEFAULT_TV_STATIC_IMAGE_PATH):
         self.__sigma = sigma
-        self._tv_static_image: Image = Image.open(static_tv_image_path)
+        self.__static_tv_image_path = static_tv_image_path
         super().__init__()
 
-    def process_image(self, context: ImageProcessingContext) -> Image.Image:
-        img = context.img
-        static_img = Image.effect_noise(self._tv_static_image.size, self.__sigma)
-
-        self._tv_static_image.putalpha(static_img)
-
-        resized = self._tv_static_image.resize(img.size)
-
-        # we also need to convert the original image to RGBA if it is not already
-        rgba_img = img.convert("RGBA")
+    def add_to_program(self, program: PointwiseProgram):
+        static_data = get_asset_registry().get_scaled_array(self.__static_tv_image_path, program.size)
+        noise = noise_to_alpha(get_noise_bank(program.size).get_frame(), self.__sigma)
 
-        return Image.blend(rgba_img, resized, 0.3)
+        # blend the static onto the image. The static colours are mixed with
+        # the image colours, and the noise (which is the static alpha) is
+        # mixed with the image alpha
+        program.blend_rgb(static_data, _TV_STATIC_BLEND_AMOUNT)
+        program.blend_alpha(noise, _TV_STATIC_BLEND_AMOUNT)
 
 
 class SwirlFaceEffect(ImageEffect):
-    def __init__(self, swirl_strength=5):
+    def __init__(self, swirl_strength=5, jitter=True):
         self.__swirl_strength = swirl_strength
+        self.__jitter = jitter
         super().__init__()
 
     def process_image(self, context: ImageProcessingContext) -> Image.Image:
-        img = context.img
+        img_data = context.img_data
 
         for face in context.faces:
             top, right, bottom, left = face.get_bounding_box()
-
-            # create a new image based on the current face
-            face = Image.fromarray(context.img_data[top:bottom, left:right])
+            face_data = img_data[top:bottom, left:right]
 
             # swirl the face
-            processed_face = self.__swirl_rect(face, self.__swirl_strength)
+            processed_face = self.__swirl_rect(face_data, self.__swirl_strength, context.np_rng)
             # add some alpha to the swirled image to make it less opaque
             processed_face.putalpha(100)
             # add a little bit of blur so that it is not so perfectly swirled
             processed_face = processed_face.filter(ImageFilter.GaussianBlur(2))
 
-            # merge the face with the original image
-            img.paste(processed_face, (left, top, right, bottom))
+            # merge the face with the original image. The alpha is only kept
+            # if the image has an alpha channel
+            processed_data = np.asarray(processed_face)
+            face_data[...] = processed_data[..., : face_data.shape[2]]
 
-        return img
+        return img_data
 
-    def __swirl_rect(self, img: Image.Image, swirl_strength: int) -> Image.Image:
-        # create a copy so that the orignal is not changed
-        # not necessarily needed, but does avoid weird side effects
-        to_swirl = img.copy()
-        ellipse_mask = Image.new("L", to_swirl.size, 0)
+    def __swirl_rect(self, face_data: np.array, swirl_strength: int, np_rng: np.random.Generator) -> Image.Image:
+        height, width = face_data.shape[:2]
+        ellipse_mask = Image.new("L", (width, height), 0)
 
-        left = 0
-        top = 0
-        bottom = to_swirl.height - 1
-        right = to_swirl.width - 1
+        swirl_map = _get_swirl_map(width, height, swirl_strength)
 
-        semimajor_axis = (bottom - top) / 2
-        semiminor_axis = (right - left) / 2
+        if self.__jitter:
+            # each pixel gets twisted by a slightly different amount (98% to
+            # 102% of the full twist) so the swirl doesn't look too perfect
+            jitter = np_rng.integers(98, 103, size=swirl_map.twist.shape) / 100
+            source_x, source_y = swirl_map.source_coordinates(jitter)
+        else:
+            source_x, source_y = swirl_map.source_x, swirl_map.source_y
 
-        centerx = int(right / 2)
-        centery = int(bottom / 2)
-
-        for x in range(left, right):
-            for y in range(top, bottom):
-                # 1) convert to u,v space
-                u = x - centerx
-                v = y - centery
-
-                # if w are at the center point of the swirl, do nothing
-                if u == 0 and v == 0:
-                    continue
-
-                # 2) get the distance from pixel to the center and the angle
-                # c = sqrt(u^2 + v^2)
-                # thanks pythagoreous
-                c = math.sqrt(math.pow(u, 2) + math.pow(v, 2))
-                theta_radians = math.atan2(v, u)
-                a = semiminor_axis  # horizontal axis
-                b = semimajor_axis  # vertical axis
-                # https://math.stackexchange.com/questions/432902/how-to-get-the-radius-of-an-ellipse-at-a-specific-angle-by-knowing-its-semi-majo
-                ellipse_radius = (a * b) / math.sqrt(
-                    (a * a) * (np.sin(theta_radians) * np.sin(theta_radians))
-                    + (b * b) * (np.cos(theta_radians) * np.cos(theta_radians))
-                )
+        # only the pixels inside the swirl ellipse get updated, everything
+        # else keeps its original value. This is done on a copy so that the
+        # original is not changed while it is being sampled from
+        swirled_data = np.array(face_data)
+        swirled_data[swirl_map.inside] = _bilinear_sample(face_data, source_x, source_y)
+        to_swirl = Image.fromarray(swirled_data)
 
-                # 3) figure out if we should apply the swirl
-                swirl_amount = 1 - (c / ellipse_radius)
-                if swirl_amount <= 0:
-                    continue
+        swirl_copy = to_swirl.copy()
+        swirl_copy = swirl_copy.filter(ImageFilter.GaussianBlur(2))
 
-                # 3) find the angle to move the current pixel to. For pixels
-                # closer to the centre, we want them to be more manipulated
-                # (which is what the swirl amount is for), further pixels from
-                # the centre should be not swirled as much
-                twist_angle = ((random.randint(98, 102) / 100) * swirl_strength) * swirl_amount * math.pi * 2
+        mask_blur = ellipse_mask.filter(ImageFilter.GaussianBlur(2))
 
-                # 4) add the angle to twist to the current angle where the
-                # pixel is located from centre
-                theta_radians += twist_angle
+        return Image.composite(to_swirl, swirl_copy, mask_blur)
 
-                # 5) convert back to standard x,y coordinates
-                new_x = math.cos(theta_radians) * c
-                new_y = math.sin(theta_radians) * c
 
-                # 6) update the current x,y pixel to have the RGB values of
-                # the new calculated pixel based on the above math
-                new_pixel = img.getpixel((new_x, new_y))
-                to_swirl.putpixel((x, y), new_pixel)
+class _SwirlMap(object):
+    """
+    The inverse mapping for swirling a face of a given size and strength.
 
-        swirl_copy = to_swirl.copy()
-        swirl_copy = swirl_copy.filter(ImageFilter.GaussianBlur(2))
+    For every pixel inside the swirl ellipse, this holds where that pixel
+    currently sits relative to the centre (angle + distance), how far it should
+    be twisted, and the resulting source coordinates to sample from.
+    """
 
-        mask_blur = ellipse_mask.filter(ImageFilter.GaussianBlur(2))
+    def __init__(self, width: int, height: int, swirl_strength: float):
+        left = 0
+        top = 0
+        bottom = height - 1
+        right = width - 1
 
-        return Image.composite(to_swirl, swirl_copy, mask_blur)
+        semimajor_axis = (bottom - top) / 2
+        semiminor_axis = (right - left) / 2
+
+        self.centerx = int(right / 2)
+        self.centery = int(bottom / 2)
+
+        # 1) convert to u,v space
+        y, x = np.mgrid[top:bottom, left:right]
+        u = (x - self.centerx).astype(np.float64)
+        v = (y - self.centery).astype(np.float64)
+
+        # 2) get the distance from pixel to the center and the angle
+        c = np.hypot(u, v)
+        theta_radians = np.arctan2(v, u)
+        a = semiminor_axis  # horizontal axis
+        b = semimajor_axis  # vertical axis
+        # https://math.stackexchange.com/questions/432902/how-to-get-the-radius-of-an-ellipse-at-a-specific-angle-by-knowing-its-semi-majo
+        sin_theta = np.sin(theta_radians)
+        cos_theta = np.cos(theta_radians)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ellipse_radius = (a * b) / np.sqrt((a * a) * sin_theta * sin_theta + (b * b) * cos_theta * cos_theta)
+            swirl_amount = 1 - (c / ellipse_radius)
+
+        # 3) figure out which pixels we should apply the swirl to. The center
+        # point of the swirl is left alone
+        inside = np.zeros((height, width), dtype=bool)
+        inside[top:bottom, left:right] = (swirl_amount > 0) & (c > 0)
+        selected = inside[top:bottom, left:right]
+
+        self.inside = inside
+        self.theta = theta_radians[selected]
+        self.radius = c[selected]
+
+        # 4) find the angle to twist each pixel by. Pixels closer to the
+        # centre are manipulated more than the ones further out
+        self.twist = swirl_strength * swirl_amount[selected] * math.pi * 2
+
+        self.source_x, self.source_y = self.source_coordinates()
+
+    def source_coordinates(self, jitter: np.array = None) -> (np.array, np.array):
+        twist = self.twist if jitter is None else self.twist * jitter
+
+        # 5) add the angle to twist to the current angle where the pixel is
+        # located from centre, and convert back to standard x,y coordinates
+        theta_radians = self.theta + twist
+        source_x = np.cos(theta_radians) * self.radius + self.centerx
+        source_y = np.sin(theta_radians) * self.radius + self.centery
+        return source_x, source_y
+
+
+@functools.lru_cache(maxsize=32)
+def _get_swirl_map(width: int, height: int, swirl_strength: float) -> _SwirlMap:
+    return _SwirlMap(width, height, swirl_strength)
+
+
+def _bilinear_sample(img_data: np.array, x: np.array, y: np.array) -> np.array:
+    """
+    Sample the image at the given (fractional) x,y coordinates, blending the
+    four surrounding pixels together
+    """
+    height, width = img_data.shape[:2]
+
+    x = np.clip(x, 0, width - 1)
+    y = np.clip(y, 0, height - 1)
+
+    x0 = np.floor(x).astype(np.intp)
+    y0 = np.floor(y).astype(np.intp)
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+
+    wx = x - x0
+    wy = y - y0
+    if img_data.ndim == 3:
+        wx = wx[:, np.newaxis]
+        wy = wy[:, np.newaxis]
+
+    top = img_data[y0, x0] * (1 - wx) + img_data[y0, x1] * wx
+    bottom = img_data[y1, x0] * (1 - wx) + img_data[y1, x1] * wx
+    result = top * (1 - wy) + bottom * wy
+
+    return np.rint(result).astype(img_data.dtype)
 
 
 class SketchyEyeEffect(ImageEffect):
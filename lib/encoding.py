@@ -0,0 +1,235 @@
+import os
+import struct
+import zlib
+from typing import Dict
+
+import numpy as np
+from PIL import Image
+
+# PNG row filters, see https://www.w3.org/TR/png/#9Filter-types
+_PNG_FILTER_NONE = 0
+_PNG_FILTER_SUB = 1
+_PNG_FILTER_UP = 2
+_PNG_FILTER_PAETH = 4
+
+# how much compressed data is collected before it is written as an IDAT chunk
+_PNG_CHUNK_SIZE = 256 * 1024
+
+# how many rows are filtered at once
+_PNG_FILTER_ROWS = 64
+
+
+class EncoderProfile(object):
+    """
+    How to write an image to disk: the PIL format, the file extension and the
+    options passed to the encoder.
+
+    Unless keep_alpha is set, the alpha channel is dropped when every pixel is
+    opaque (which the photo strips always are), since it only makes the file
+    bigger and slower to write. Formats that can't store alpha always drop it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        image_format: str,
+        extension: str,
+        save_options: dict = None,
+        supports_alpha: bool = True,
+        keep_alpha: bool = False,
+    ):
+        self.name = name
+        self.image_format = image_format
+        self.extension = extension
+        self.save_options = save_options or {}
+        self.supports_alpha = supports_alpha
+        self.keep_alpha = keep_alpha
+        super().__init__()
+
+    def prepare(self, img: Image.Image) -> Image.Image:
+        if img.mode not in ("RGBA", "LA"):
+            return img
+
+        if self.supports_alpha and self.keep_alpha:
+            return img
+
+        if self.supports_alpha and img.getchannel("A").getextrema() != (255, 255):
+            # some pixels are see through, so the alpha is needed after all
+            return img
+
+        return img.convert("RGB" if img.mode == "RGBA" else "L")
+
+    def save(self, img: Image.Image, output_file_path: str):
+        self.prepare(img).save(output_file_path, self.image_format, **self.save_options)
+
+    def can_stream(self) -> bool:
+        """whether images can be written a band of rows at a time with `open_row_writer`"""
+        return self.image_format == "PNG"
+
+    def open_row_writer(self, output_file_path: str, width: int, height: int, channels: int) -> "PngRowWriter":
+        if not self.can_stream():
+            raise ValueError(f"{self.name} images can't be written a band of rows at a time")
+
+        return PngRowWriter(output_file_path, width, height, channels, self.save_options.get("compress_level", 6))
+
+    def __repr__(self) -> str:
+        return f"EncoderProfile({self.name}, {self.image_format}, {self.save_options})"
+
+
+ENCODER_PROFILES: Dict[str, EncoderProfile] = {
+    profile.name: profile
+    for profile in [
+        # zlib level 6 is PILs default, and close to the smallest files for
+        # much less time than 9
+        EncoderProfile("png", "PNG", "png", {"compress_level": 6}),
+        EncoderProfile("png-fast", "PNG", "png", {"compress_level": 1}),
+        EncoderProfile("jpeg", "JPEG", "jpg", {"quality": 95, "subsampling": 0}, supports_alpha=False),
+        EncoderProfile("webp", "WEBP", "webp", {"lossless": True, "method": 0}),
+        EncoderProfile("webp-lossy", "WEBP", "webp", {"quality": 90, "method": 4}),
+    ]
+}
+
+# file extensions that can be used in place of a profile name
+_EXTENSION_ALIASES = {
+    "jpg": "jpeg",
+}
+
+
+def get_encoder_profile(name: str) -> EncoderProfile:
+    """get an encoder profile by its name or file extension (e.g. "png-fast", "jpg")"""
+    name = name.lower().lstrip(".")
+    name = _EXTENSION_ALIASES.get(name, name)
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"unknown image type {name}, expected one of {sorted(ENCODER_PROFILES)}")
+
+    return ENCODER_PROFILES[name]
+
+
+class PngRowWriter(object):
+    """
+    Writes a PNG a band of rows at a time, so the whole image never has to be
+    in memory. Only the last row written and the zlib state are kept between
+    bands.
+
+    Each row is filtered with whichever of none, sub, up and paeth gives the
+    smallest sum of absolute differences, the same heuristic libpng uses.
+    """
+
+    def __init__(self, output_file_path: str, width: int, height: int, channels: int, compress_level: int = 6):
+        if channels not in (3, 4):
+            raise ValueError("only RGB and RGBA images can be written")
+
+        self.output_file_path = output_file_path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_written = 0
+
+        self.__compressor = zlib.compressobj(compress_level)
+        self.__pending = []
+        self.__pending_size = 0
+        self.__previous_row = np.zeros(width * channels, dtype=np.uint8)
+
+        self.__file = open(output_file_path, "wb")
+        self.__file.write(b"\x89PNG\r\n\x1a\n")
+        color_type = 6 if channels == 4 else 2
+        self.__write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+        super().__init__()
+
+    def write_rows(self, rows: np.array):
+        """write a (num rows, width, channels) band of rows"""
+        if rows.shape[1:] != (self.width, self.channels):
+            raise ValueError(f"expected rows of {(self.width, self.channels)}, got {rows.shape[1:]}")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"the image is only {self.height} rows high")
+        # filtering makes several copies of the rows, so it is done a few rows
+        # at a time to keep them small
+        for start in range(0, len(rows), _PNG_FILTER_ROWS):
+            self.__write_filtered(rows[start : start + _PNG_FILTER_ROWS])
+
+    def __write_filtered(self, rows: np.array):
+        raw = np.ascontiguousarray(rows).reshape(len(rows), -1)
+
+        # the filters work on bytes, and wrap around
+        sub = raw.copy()
+        sub[:, self.channels :] -= raw[:, : -self.channels]
+        above = np.empty_like(raw)
+        above[0] = self.__previous_row
+        above[1:] = raw[:-1]
+        up = raw - above
+        paeth = raw - _get_paeth_predictions(raw, above, self.channels)
+
+        candidates = [(_PNG_FILTER_NONE, raw), (_PNG_FILTER_SUB, sub), (_PNG_FILTER_UP, up), (_PNG_FILTER_PAETH, paeth)]
+        scores = np.stack([_get_filter_score(filtered) for _, filtered in candidates])
+        best = np.argmin(scores, axis=0)
+
+        filtered = np.empty((len(rows), raw.shape[1] + 1), dtype=np.uint8)
+        for i, (filter_type, candidate) in enumerate(candidates):
+            chosen = best == i
+            filtered[chosen, 0] = filter_type
+            filtered[chosen, 1:] = candidate[chosen]
+
+        self.__add_data(self.__compressor.compress(filtered.tobytes()))
+        self.__previous_row = raw[-1].copy()
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self.__file.closed:
+            return
+
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"only {self.rows_written} of {self.height} rows were written")
+
+            self.__add_data(self.__compressor.flush())
+            self.__flush_data()
+            self.__write_chunk(b"IEND", b"")
+        finally:
+            self.__file.close()
+
+    def abort(self):
+        """stop writing, and remove the half written file"""
+        self.__file.close()
+        if os.path.exists(self.output_file_path):
+            os.remove(self.output_file_path)
+
+    def __add_data(self, data: bytes):
+        self.__pending.append(data)
+        self.__pending_size += len(data)
+        if self.__pending_size >= _PNG_CHUNK_SIZE:
+            self.__flush_data()
+
+    def __flush_data(self):
+        if self.__pending_size > 0:
+            self.__write_chunk(b"IDAT", b"".join(self.__pending))
+        self.__pending = []
+        self.__pending_size = 0
+
+    def __write_chunk(self, chunk_type: bytes, data: bytes):
+        self.__file.write(struct.pack(">I", len(data)))
+        self.__file.write(chunk_type)
+        self.__file.write(data)
+        self.__file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def _get_paeth_predictions(raw: np.array, above: np.array, bytes_per_pixel: int) -> np.array:
+    """for each byte, whichever of the byte to the left, above or above left is closest to left + above - above left"""
+    left = np.zeros_like(raw)
+    left[:, bytes_per_pixel:] = raw[:, :-bytes_per_pixel]
+    above_left = np.zeros_like(raw)
+    above_left[:, bytes_per_pixel:] = above[:, :-bytes_per_pixel]
+
+    a = left.astype(np.int16)
+    b = above.astype(np.int16)
+    c = above_left.astype(np.int16)
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+
+    return np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, above, above_left))
+
+
+def _get_filter_score(filtered: np.array) -> np.array:
+    """the sum of each row's bytes as signed differences, the smaller the better it compresses"""
+    return np.abs(filtered.view(np.int8).astype(np.int16)).sum(axis=1)
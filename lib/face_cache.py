@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from lib.detection import DetectionSettings, FaceMetadata, find_faces_from_array
+
+DEFAULT_FACE_CACHE_DIR = "./.face_cache"
+
+# how many entries are added before the cache directory is looked at again,
+# to pick up entries added by other processes
+_RESCAN_PUTS = 256
+
+# once the cache is over max_bytes, entries are removed until it's down to
+# this much of it, so the next few puts don't go straight back over
+_EVICT_TO_FRACTION = 0.9
+
+
+class FaceCache(object):
+    """
+    An on disk cache of the faces found in an image.
+
+    Entries are keyed by a hash of the decoded pixels and the detection
+    settings, so the same photo gives a hit no matter what file it was loaded
+    from. Each entry is a small json file, and the least recently used entries
+    are removed once the cache is bigger than max_bytes, until it is back down
+    to _EVICT_TO_FRACTION of it.
+
+    The size of the cache is kept track of as entries are added, and the
+    directory is only listed when that goes over max_bytes (or every
+    _RESCAN_PUTS entries, since other processes can share the cache).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_FACE_CACHE_DIR, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.__total_bytes = self.__scan()[1]
+        self.__puts_since_scan = 0
+
+        super().__init__()
+
+    def find_faces(self, img_data: np.array, settings: DetectionSettings = None) -> List[FaceMetadata]:
+        """find the faces in the image, only running detection if they aren't already cached"""
+        key = self.get_key(img_data, settings)
+
+        faces = self.get(key)
+        if faces is None:
+            faces = find_faces_from_array(img_data, settings)
+            self.put(key, faces)
+
+        return faces
+
+    def get_key(self, img_data: np.array, settings: DetectionSettings = None) -> str:
+        if settings is None:
+            settings = DetectionSettings()
+
+        digest = hashlib.sha256()
+        digest.update(repr(settings).encode())
+        digest.update(f"{img_data.shape}{img_data.dtype.str}".encode())
+        digest.update(np.ascontiguousarray(img_data).data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[FaceMetadata]]:
+        path = self.__get_path(key)
+
+        with self.__lock:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+
+            # mark the entry as recently used
+            os.utime(path)
+
+        print(f"Found {len(data)} cached face(s) for {key[:12]}")
+        return [FaceMetadata.from_dict(face) for face in data]
+
+    def put(self, key: str, faces: List[FaceMetadata]):
+        path = self.__get_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with self.__lock:
+            with open(temp_path, "w") as f:
+                json.dump([face.to_dict() for face in faces], f)
+
+            try:
+                self.__total_bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            self.__total_bytes += os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+
+            self.__puts_since_scan += 1
+            if self.__total_bytes > self.max_bytes or self.__puts_since_scan >= _RESCAN_PUTS:
+                self.__evict()
+
+    def clear(self):
+        """remove every entry. Nothing else in cache_dir is touched"""
+        with self.__lock:
+            for (_, _, path) in self.__scan()[0]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            self.__total_bytes = self.__scan()[1]
+            self.__puts_since_scan = 0
+
+    def __get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def __scan(self) -> (List[tuple], int):
+        """the (mtime, size, path) of every entry, and their total size"""
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # another process evicted it first
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+        return entries, total_bytes
+
+    def __evict(self):
+        entries, total_bytes = self.__scan()
+        if total_bytes > self.max_bytes:
+            target_bytes = self.max_bytes * _EVICT_TO_FRACTION
+        else:
+            target_bytes = self.max_bytes
+
+        entries.sort()
+        for (_, size, path) in entries:
+            if total_bytes <= target_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+        self.__total_bytes = total_bytes
+        self.__puts_since_scan = 0
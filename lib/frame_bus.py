@@ -0,0 +1,196 @@
+import time
+from multiprocessing import Event, Process, Queue, resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# header layout (all int64): row 0 is (latest sequence number, latest slot),
+# row i + 1 is (sequence number, timestamp in ns) of the frame in slot i. A
+# slot sequence number of -1 means the slot is being written to
+_HEADER_COLUMNS = 2
+_WRITING = -1
+
+# how long the capture process waits after the camera fails to give a frame,
+# doubling for each failure in a row
+_MIN_BACKOFF_SECONDS = 0.01
+_MAX_BACKOFF_SECONDS = 1.0
+
+
+class FrameBus(object):
+    """
+    A ring of camera frames in shared memory, written by one process and read
+    by any number of others.
+
+    Every frame gets an increasing sequence number and the time it was
+    captured, so readers can tell whether a frame is newer than one they have
+    already seen. Readers get a view straight into the shared memory, which is
+    only valid until the writer comes back around the ring to that slot.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple[int, ...], num_slots: int, owner: bool):
+        self.shape = tuple(shape)
+        self.num_slots = num_slots
+        self.__shm = shm
+        self.__owner = owner
+
+        header_size = (num_slots + 1) * _HEADER_COLUMNS * 8
+        self.__header = np.ndarray((num_slots + 1, _HEADER_COLUMNS), dtype=np.int64, buffer=shm.buf)
+        self.__frames = np.ndarray((num_slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=header_size)
+
+        super().__init__()
+
+    @staticmethod
+    def create(shape: Tuple[int, ...], num_slots: int = 4) -> "FrameBus":
+        header_size = (num_slots + 1) * _HEADER_COLUMNS * 8
+        frame_size = int(np.prod(shape))
+        shm = shared_memory.SharedMemory(create=True, size=header_size + frame_size * num_slots)
+
+        bus = FrameBus(shm, shape, num_slots, owner=True)
+        bus.__header[:] = 0
+        bus.__header[0, 0] = _WRITING
+        return bus
+
+    @staticmethod
+    def attach(description: Tuple[str, Tuple[int, ...], int]) -> "FrameBus":
+        """attach to a bus created in another process, using its `describe()`"""
+        name, shape, num_slots = description
+        return FrameBus(shared_memory.SharedMemory(name=name), shape, num_slots, owner=False)
+
+    def describe(self) -> Tuple[str, Tuple[int, ...], int]:
+        return self.__shm.name, self.shape, self.num_slots
+
+    def write(self, frame: np.array):
+        latest_seq = int(self.__header[0, 0])
+        seq = 0 if latest_seq == _WRITING else latest_seq + 1
+        slot = seq % self.num_slots
+
+        self.__header[slot + 1, 0] = _WRITING
+        self.__frames[slot] = frame
+        self.__header[slot + 1] = (seq, time.monotonic_ns())
+        self.__header[0] = (seq, slot)
+
+    def latest_sequence(self) -> int:
+        """the sequence number of the newest frame, or -1 if there isn't one yet"""
+        return int(self.__header[0, 0])
+
+    def latest_frame(self) -> Optional[Tuple[int, int, np.array]]:
+        """
+        the (sequence number, capture time in monotonic ns, frame view) of the
+        newest frame, or None if nothing has been written yet. The view is not
+        copied
+        """
+        seq, slot = (int(v) for v in self.__header[0])
+        if seq == _WRITING:
+            return None
+
+        return seq, int(self.__header[slot + 1, 1]), self.__frames[slot]
+
+    def copy_frame(self, seq: int) -> Optional[np.array]:
+        """
+        copy the frame with the given sequence number out of the ring. Returns
+        None if it has already been overwritten
+        """
+        slot = seq % self.num_slots
+        if int(self.__header[slot + 1, 0]) != seq:
+            return None
+
+        frame = np.array(self.__frames[slot])
+
+        # if the writer started on the slot while we were copying, the copy
+        # could be half of one frame and half of another
+        if int(self.__header[slot + 1, 0]) != seq:
+            return None
+
+        return frame
+
+    def wait_for_frame(self, after_seq: int, timeout: float = 5.0, poll_seconds: float = 0.002) -> int:
+        """wait for a frame newer than after_seq, returning its sequence number"""
+        end = time.monotonic() + timeout
+        while (seq := self.latest_sequence()) <= after_seq:
+            if time.monotonic() > end:
+                raise TimeoutError(f"no new camera frame after {timeout} seconds")
+            time.sleep(poll_seconds)
+
+        return seq
+
+    def close(self):
+        # drop the numpy views first, shared memory can't be closed while
+        # anything still points into it
+        self.__header = None
+        self.__frames = None
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+
+def _capture_loop(camera_number: int, num_slots: int, description_queue: Queue, stop: Event):
+    cam = cv2.VideoCapture(camera_number)
+    success, frame = cam.read()
+    if not success:
+        description_queue.put(None)
+        return
+
+    bus = FrameBus.create(frame.shape, num_slots)
+    description_queue.put(bus.describe())
+
+    try:
+        backoff_seconds = 0
+        while not stop.is_set():
+            if success:
+                bus.write(frame)
+            else:
+                # nothing is written until the camera comes back, so readers
+                # keep the last good frame, and we back off so a camera that
+                # is gone doesn't spin this process
+                if backoff_seconds == 0:
+                    print("[WARN]: failed to read a frame from the camera")
+                backoff_seconds = min(max(backoff_seconds * 2, _MIN_BACKOFF_SECONDS), _MAX_BACKOFF_SECONDS)
+                stop.wait(backoff_seconds)
+
+            success, frame = cam.read()
+            if success:
+                backoff_seconds = 0
+    finally:
+        cam.release()
+        bus.close()
+
+
+class SharedCamera(object):
+    """
+    Owns the only open handle to the camera. A background process reads from
+    the camera as fast as it can and writes every frame onto a FrameBus, which
+    the preview and the photo taker can both read from
+    """
+
+    def __init__(self, camera_number: int, num_slots: int = 4, startup_timeout: float = 10.0):
+        # any process reading the bus needs to share our resource tracker,
+        # otherwise it cleans up the shared memory when it exits
+        resource_tracker.ensure_running()
+
+        description_queue = Queue()
+        self.__stop = Event()
+        self.__process = Process(
+            target=_capture_loop,
+            args=(camera_number, num_slots, description_queue, self.__stop),
+            daemon=True,
+        )
+        self.__process.start()
+
+        description = description_queue.get(timeout=startup_timeout)
+        if description is None:
+            raise Exception(f"couldnt read from the camera {camera_number} :(")
+
+        self.description = description
+        self.bus = FrameBus.attach(description)
+
+        super().__init__()
+
+    def get_frame_size(self) -> Tuple[int, int]:
+        height, width = self.bus.shape[:2]
+        return width, height
+
+    def close(self):
+        self.__stop.set()
+        self.__process.join(timeout=5)
+        self.bus.close()
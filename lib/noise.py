@@ -0,0 +1,175 @@
+import contextvars
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+
+class NoiseBank(object):
+    """
+    A ring of pre-generated noise frames for a single output size.
+
+    A background thread keeps the ring topped up, so taking a frame is
+    normally just a queue pop. Frames hold standard normal noise, which can be
+    turned into noise with any sigma using `noise_to_alpha`.
+
+    Frames are handed out in the order they were generated, so for a given
+    seed the sequence of frames is always the same. Each frame is generated
+    from its own (seed, index) key, so any frame can be generated again on its
+    own. If keys are given, only the frames with those keys are generated (in
+    that order), e.g. to replay the frames taken by a recorded session, and
+    taking a frame once they have all been taken raises an exception.
+
+    Once a bank is stopped (e.g. because it was evicted by `get_noise_bank`)
+    nothing tops it up any more, so anyone still holding it gets the frames
+    left in the ring, and then frames generated as they ask for them.
+    """
+
+    def __init__(
+        self, size: Tuple[int, int], num_frames: int = 4, seed: int = None, keys: Iterable[Tuple[int, int]] = None
+    ):
+        if num_frames <= 0:
+            raise ValueError("there must be at least one noise frame in the bank")
+
+        self.size = tuple(size)
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        if keys is None:
+            keys = ((self.seed, index) for index in itertools.count())
+        self.__keys = iter(keys)
+        self.__keys_lock = threading.Lock()
+        self.__frames = queue.Queue(maxsize=num_frames)
+        self.__stopped = threading.Event()
+
+        self.__worker = threading.Thread(target=self.__refill, daemon=True)
+        self.__worker.start()
+
+        super().__init__()
+
+    def get_frame(self) -> np.array:
+        """get the next (height, width) noise frame, waiting for one to be generated if needed"""
+        while True:
+            try:
+                # the wait is in steps, so a bank stopped while we are waiting
+                # is noticed
+                item = self.__frames.get(block=not self.__stopped.is_set(), timeout=0.5)
+                break
+            except queue.Empty:
+                if self.__stopped.is_set():
+                    item = self.__take_next()
+                    break
+
+        if item is None:
+            # leave the end marker for anyone else waiting
+            self.__frames.put(None)
+            raise Exception("the noise bank has run out of frames")
+
+        key, frame = item
+        taken = _taken_frames.get()
+        if taken is not None:
+            taken.append(key)
+
+        return frame
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __take_next(self):
+        """generate the next (key, frame), or None once there are no keys left"""
+        with self.__keys_lock:
+            key = next(self.__keys, None)
+
+        return (key, generate_noise_frame(self.size, key)) if key is not None else None
+
+    def __refill(self):
+        while not self.__stopped.is_set():
+            item = self.__take_next()
+
+            while not self.__stopped.is_set():
+                try:
+                    self.__frames.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+            if item is None:
+                return
+
+
+def generate_noise_frame(size: Tuple[int, int], key: Tuple[int, int]) -> np.array:
+    """the (height, width) standard normal noise frame with the given (seed, index) key"""
+    width, height = size
+    return np.random.default_rng(list(key)).standard_normal((height, width), dtype=np.float32)
+
+
+# the keys of the frames taken in the current context, if they are being recorded
+_taken_frames = contextvars.ContextVar("taken_noise_frames", default=None)
+
+
+@contextmanager
+def recording_noise_frames() -> Iterator[List[Tuple[int, int]]]:
+    """
+    record the (seed, index) key of every noise frame taken in the block, and
+    in copies of its context (e.g. work handed off to other threads), in the
+    order they were taken
+    """
+    taken = []
+    token = _taken_frames.set(taken)
+    try:
+        yield taken
+    finally:
+        _taken_frames.reset(token)
+
+
+def noise_to_alpha(frame: np.array, sigma: float) -> np.array:
+    """
+    Convert a standard normal noise frame into gaussian noise centered on 128,
+    the same as `Image.effect_noise` gives
+    """
+    # a single saturating multiply-add, rather than numpy making float copies
+    # of the frame for each step
+    return cv2.addWeighted(frame, float(sigma), frame, 0.0, 128.0, dtype=cv2.CV_8U)
+
+
+_banks = OrderedDict()
+_banks_lock = threading.Lock()
+_MAX_BANKS = 2
+
+
+def get_noise_bank(size: Tuple[int, int]) -> NoiseBank:
+    """
+    Get the shared noise bank for the given (width, height). Only the most
+    recently used sizes are kept around, since each bank holds several full
+    size frames
+    """
+    size = tuple(size)
+
+    with _banks_lock:
+        bank = _banks.get(size)
+        if bank is None:
+            bank = NoiseBank(size)
+            _banks[size] = bank
+
+        _banks.move_to_end(size)
+        while len(_banks) > _MAX_BANKS:
+            _, evicted = _banks.popitem(last=False)
+            evicted.stop()
+
+        return bank
+
+
+def replace_noise_bank(bank: NoiseBank):
+    """use the given bank for its size from now on, e.g. one replaying the frames a session took"""
+    with _banks_lock:
+        previous = _banks.pop(bank.size, None)
+        if previous is not None and previous is not bank:
+            previous.stop()
+
+        _banks[bank.size] = bank
+        while len(_banks) > _MAX_BANKS:
+            _, evicted = _banks.popitem(last=False)
+            evicted.stop()
@@ -1,17 +1,39 @@
+import asyncio
+import contextvars
+import inspect
+import math
 import os
 import random
+import secrets
+import threading
 import time
-from typing import List, Tuple
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
 from abc import abstractmethod
 from datetime import datetime, timedelta
 import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from lib.detection import find_faces_from_array
+from lib.burst import BurstRecorder, BurstResult
+from lib.compositor import StripBandWriter, StripCompositor, StripLayout
+from lib.detection import (
+    DetectionPool,
+    DetectionSettings,
+    FaceMetadata,
+    find_faces_from_array,
+    warm_up_detection,
+)
 from lib.display import PhotoboothDisplay
+from lib.encoding import EncoderProfile, get_encoder_profile
+from lib.face_cache import FaceCache
+from lib.frame_bus import SharedCamera
+from lib.noise import recording_noise_frames
+from lib.printing import PrintJob, PrintSpooler
+from lib.recording import SessionRecorder, SessionRecording
 from lib.effect import (
     GhostEffect,
     ImageEffect,
@@ -20,7 +42,16 @@ from lib.effect import (
     SketchyEyeEffect,
     SwirlFaceEffect,
     TvStaticEffect,
+    apply_effects,
+    warm_effect_assets,
 )
+from lib.timing import TimingLog, span, timed_session
+
+# the seed the effects of the current session are run with, if it is seeded
+_session_seed = contextvars.ContextVar("session_seed", default=None)
+
+# the recording of the current session, if it is being recorded
+_session_recording = contextvars.ContextVar("session_recording", default=None)
 
 
 class PhotoTaker(object):
@@ -31,6 +62,26 @@ class PhotoTaker(object):
     def take_photo(self) -> Image.Image:
         raise NotImplementedError
 
+    def get_frame_size(self) -> Optional[Tuple[int, int]]:
+        """the (width, height) of the photos that will be taken, if known ahead of time"""
+        return None
+
+    def take_burst(self, num_frames: int, fps: float) -> Iterator[Image.Image]:
+        """
+        take num_frames photos, fps a second, yielding each one as soon as it
+        is taken. If a frame is taken late, the ones after it are not rushed
+        to catch up
+        """
+        interval = 1 / fps
+        next_frame_at = time.perf_counter()
+        for _ in range(num_frames):
+            delay = next_frame_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame_at = max(next_frame_at + interval, time.perf_counter())
+
+            yield self.take_photo()
+
 
 class WebCamPhotoTaker(PhotoTaker):
     def __init__(self, camera_to_use: int):
@@ -50,6 +101,40 @@ class WebCamPhotoTaker(PhotoTaker):
 
         return Image.fromarray(img)
 
+    def get_frame_size(self) -> Optional[Tuple[int, int]]:
+        width = int(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width <= 0 or height <= 0:
+            return None
+
+        return width, height
+
+
+class SharedCameraPhotoTaker(PhotoTaker):
+    """Takes photos from a SharedCamera, so the camera can be shared with the display"""
+
+    def __init__(self, shared_camera: SharedCamera):
+        self.shared_camera = shared_camera
+        super().__init__()
+
+    def take_photo(self) -> Image.Image:
+        bus = self.shared_camera.bus
+
+        # only use a frame captured after we were asked for a photo, so that
+        # guests get the moment they were told to smile
+        seq = bus.latest_sequence()
+        data = None
+        while data is None:
+            seq = bus.wait_for_frame(seq)
+            data = bus.copy_frame(seq)
+
+        img = cv2.cvtColor(data, cv2.COLOR_BGR2RGB)
+
+        return Image.fromarray(img)
+
+    def get_frame_size(self) -> Optional[Tuple[int, int]]:
+        return self.shared_camera.get_frame_size()
+
 
 class RandomStaticPhoto(PhotoTaker):
     def __init__(self, file_paths: List[str]):
@@ -64,39 +149,174 @@ class RandomStaticPhoto(PhotoTaker):
         return Image.open(self.file_paths[index])
 
 
+class RecordedPhotos(PhotoTaker):
+    """Hands out the photos of a recorded session, in the order they were taken"""
+
+    def __init__(self, photos: List[Image.Image]):
+        if len(photos) <= 0:
+            raise ValueError("there must be at least one recorded photo")
+
+        self.photos = photos
+        self.__next = 0
+        super().__init__()
+
+    def take_photo(self) -> Image.Image:
+        if self.__next >= len(self.photos):
+            raise Exception("all the recorded photos have already been taken")
+
+        img = self.photos[self.__next]
+        self.__next += 1
+        return img
+
+    def get_frame_size(self) -> Optional[Tuple[int, int]]:
+        return self.photos[0].size
+
+
 class PhotoPrinter(object):
+    """
+    Saves the finished strips and prints them.
+
+    image_type is the name of an encoder profile (see lib/encoding.py), e.g.
+    "png", "png-fast", "jpeg" or "webp". The unspooked copy is only kept for
+    the archive, so it can use a different (e.g. cheaper) profile by passing
+    unspooked_image_type.
+
+    If on_saved is set, it is called with the path of every strip once it has
+    been written.
+    """
+
     def __init__(
         self,
         output_dir: str,
         output_file_prefix: str,
         image_type: str,
         should_print: bool,
+        spooler: PrintSpooler = None,
+        unspooked_image_type: str = None,
     ):
         self.output_dir = output_dir
         self.output_file_prefix = output_file_prefix
         self.image_type = image_type
         self.should_print = should_print
+        self.spooler = spooler
+        self.encoder = get_encoder_profile(image_type)
+        self.unspooked_encoder = get_encoder_profile(unspooked_image_type or image_type)
+        self.on_saved: Optional[Callable[[str], None]] = None
+
+        # encoding spends most of its time outside the GIL, so the two strips
+        # can be written at the same time
+        self.__executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="photo-printer")
         super().__init__()
 
-    def __get_output_file_path(self, now, prefix="") -> str:
+    def __get_output_file_path(self, now, prefix="", encoder: EncoderProfile = None, extension: str = None) -> str:
+        extension = extension or (encoder or self.encoder).extension
         curr_time = now.strftime("%d_%m_%Y-%H_%M_%S")
         output_file_name = f"{prefix}{self.output_file_prefix}_{curr_time}"
-        return f"{self.output_dir}/{output_file_name}.{self.image_type}"
+        return f"{self.output_dir}/{output_file_name}.{extension}"
 
-    def save_unspooked(self, now, img: Image.Image):
-        self.save(img, self.__get_output_file_path(now, prefix="unspooked_"))
+    def get_burst_path(self, now, extension: str) -> str:
+        """where the animation of a burst taken at `now` is saved"""
+        return self.__get_output_file_path(now, prefix="burst_", extension=extension)
+
+    def can_stream(self) -> bool:
+        """whether both strips can be written a band at a time, with `open_strip_writers`"""
+        return self.encoder.can_stream() and self.unspooked_encoder.can_stream()
+
+    def open_strip_writers(
+        self, now, layout: StripLayout, num_photos: int, border_size: int
+    ) -> Tuple[StripBandWriter, StripBandWriter]:
+        """
+        writers that save the final and unspooked strips as their photos are
+        finished. Once every photo has been added, finish them with
+        `finish_strip_writers`
+        """
+        output_file_path = self.__get_output_file_path(now)
+        unspooked_file_path = self.__get_output_file_path(now, prefix="unspooked_", encoder=self.unspooked_encoder)
+        print(f"Writing the image to {output_file_path} as the photos are finished")
 
-    def save(self, img: Image.Image, output_file_path):
+        return (
+            StripBandWriter(output_file_path, self.encoder, layout, num_photos, border_size),
+            StripBandWriter(unspooked_file_path, self.unspooked_encoder, layout, num_photos, border_size),
+        )
+
+    def finish_strip_writers(self, writers: Tuple[StripBandWriter, StripBandWriter]) -> Optional[PrintJob]:
+        """finish writing the (final, unspooked) strips from `open_strip_writers`, and print the final one"""
+        final_writer, unspooked_writer = writers
+        with span("stream.close"):
+            final_writer.close()
+            unspooked_writer.close()
+
+        for writer in writers:
+            self.__saved(writer.output_file_path)
+
+        return self.__print(final_writer.output_file_path)
+
+    def save_unspooked(self, now, img: Image.Image):
+        self.save(
+            img,
+            self.__get_output_file_path(now, prefix="unspooked_", encoder=self.unspooked_encoder),
+            self.unspooked_encoder,
+        )
+
+    def save(self, img: Image.Image, output_file_path, encoder: EncoderProfile = None):
+        encoder = encoder or self.encoder
         print(f"Saving the image to {output_file_path}")
-        img.save(output_file_path, self.image_type.upper(), quality=95)
+        with span("save", path=output_file_path, width=img.width, height=img.height, encoder=encoder.name):
+            encoder.save(img, output_file_path)
+        self.__saved(output_file_path)
 
-    def save_and_print(self, now, img: Image.Image):
+    def save_and_print(self, now, img: Image.Image) -> Optional[PrintJob]:
+        """
+        save the image and print it. If there is a spooler the image is only
+        queued to be printed, and the job is returned so it can be followed
+        """
         output_file_path = self.__get_output_file_path(now)
         self.save(img, output_file_path)
+        return self.__print(output_file_path)
+
+    def save_all_and_print(self, now, img: Image.Image, unspooked_img: Image.Image) -> Optional[PrintJob]:
+        """
+        save the final and unspooked strips at the same time, printing the
+        final one as soon as it has been written
+        """
+        # the saves are run in copies of our context so their timings are
+        # recorded in the current session. The print copy goes first so it
+        # gets a thread straight away
+        output_file_path = self.__get_output_file_path(now)
+        print_future = self.__executor.submit(contextvars.copy_context().run, self.save, img, output_file_path)
+        unspooked_future = self.__executor.submit(
+            contextvars.copy_context().run, self.save_unspooked, now, unspooked_img
+        )
 
-        if self.should_print:
+        try:
+            print_future.result()
+        finally:
+            # wait for the unspooked copy even if the print copy failed, so
+            # nothing is left half written
+            unspooked_error = unspooked_future.exception()
+
+        job = self.__print(output_file_path)
+
+        if unspooked_error is not None:
+            raise unspooked_error
+
+        return job
+
+    def __saved(self, output_file_path: str):
+        if self.on_saved is not None:
+            self.on_saved(output_file_path)
+
+    def __print(self, output_file_path: str) -> Optional[PrintJob]:
+        if self.should_print and self.spooler is not None:
+            with span("print.queue") as attributes:
+                job = self.spooler.submit(output_file_path)
+                attributes["queued_jobs"] = len(self.spooler.get_active_jobs())
+            return job
+        elif self.should_print:
             print("Attempting to print the image")
-            result = os.system(f"lpr {output_file_path}")
+            with span("print") as attributes:
+                result = os.system(f"lpr {output_file_path}")
+                attributes["result"] = result
             if result == 0:
                 print("Printing was successfull")
             else:
@@ -104,6 +324,15 @@ class PhotoPrinter(object):
         else:
             print("Not printing!")
 
+        return None
+
+
+class PhotoboothState(object):
+    IDLE = "idle"
+    CAPTURING = "capturing"
+    PROCESSING = "processing"
+    PRINTING = "printing"
+
 
 class Photobooth(object):
     def __init__(
@@ -114,9 +343,21 @@ class Photobooth(object):
         num_photos: int,
         image_border_size: int,
         photo_delay_seconds: float,
+        detection_settings: DetectionSettings = None,
+        detection_pool: DetectionPool = None,
+        pipelined: bool = False,
+        face_cache: FaceCache = None,
+        timing_log: TimingLog = None,
+        layout: str = "strip",
+        burst_recorder: BurstRecorder = None,
+        stream_strips: bool = False,
+        session_recorder: SessionRecorder = None,
+        pause_seconds: float = 0.5,
     ):
         if num_photos <= 0:
             raise ValueError("there must be at least one picture to be taken")
+        if burst_recorder is not None and session_recorder is not None:
+            raise ValueError("bursts can't be recorded")
 
         self.display = display
         self.photo_taker = photo_taker
@@ -124,9 +365,89 @@ class Photobooth(object):
         self.num_photos = num_photos
         self.image_border_size = image_border_size
         self.photo_delay_seconds = photo_delay_seconds
+        self.detection_settings = detection_settings
+        self.detection_pool = detection_pool
+        self.pipelined = pipelined
+        self.face_cache = face_cache
+        self.timing_log = timing_log
+        self.compositor = StripCompositor(layout, image_border_size)
+        self.burst_recorder = burst_recorder
+
+        # writing the strips a band at a time keeps only the photo being
+        # worked on in memory, rather than every photo and two whole strips
+        if stream_strips and not printer.can_stream():
+            print(f"[WARN]: {printer.image_type} strips can't be written a band at a time, not streaming them")
+            stream_strips = False
+        self.stream_strips = stream_strips
+        self.session_recorder = session_recorder
+        # how long "Cheese!" is shown for, and the pause after each photo
+        self.pause_seconds = pause_seconds
         self.is_running = False
+        self.state = PhotoboothState.IDLE
+        self.sessions_completed = 0
+        self.last_session_seconds: Optional[float] = None
+
+        # load all the ghosts, the static and dlib in the background, so the
+        # preview and prompt show up straight away but the first guests still
+        # don't have to wait for them
+        self.__warm_up_thread = threading.Thread(target=self.__warm_up, daemon=True)
+        self.__warm_up_thread.start()
+
+        if printer.spooler is not None and printer.spooler.on_status is None:
+            printer.spooler.on_status = self.__on_print_status
+        if printer.on_saved is None:
+            printer.on_saved = self.__on_saved
+
+        # the keyframes of a burst are found the same way as the faces in the
+        # photos, using the detection pool if there is one
+        if burst_recorder is not None and burst_recorder.find_faces is None:
+            burst_recorder.find_faces = lambda img_data: self.__find_faces([img_data])[0]
+
+    def __warm_up(self):
+        start = time.perf_counter()
+        warm_effect_assets(self.photo_taker.get_frame_size())
+
+        # the detection pool workers warm themselves up when they start
+        if self.detection_pool is None:
+            try:
+                warm_up_detection(self.detection_settings)
+            except ImportError as e:
+                print(f"[WARN]: couldnt load dlib to find faces: {e}")
+
+        print(f"Warmed up in {time.perf_counter() - start:.1f}s")
+
+    def wait_for_warm_up(self, timeout: float = None):
+        """wait for the background warm up started when the photobooth was created"""
+        if not self.__warm_up_thread.is_alive():
+            return
+
+        with span("warm_up_wait"):
+            self.__warm_up_thread.join(timeout)
 
-    def run(self):
+    def show_ready(self, status: str = None):
+        """
+        show the prompt to start a session. The subtext is the given status, or
+        what the printer is up to if there isn't one
+        """
+        if status is None:
+            status = self.printer.spooler.describe() if self.printer.spooler is not None else ""
+        self.display.clear_text()
+        self.display.put_text("Press ENTER to get SPOOKED!", status)
+
+    def __on_print_status(self, job: PrintJob):
+        # while a session is running the display is busy with the countdown,
+        # the status is shown again once it is done
+        if not self.is_running:
+            self.show_ready()
+
+    def __on_saved(self, output_file_path: str):
+        # the strips are saved in copies of the session's context, so this
+        # finds the session they belong to
+        recording = _session_recording.get()
+        if recording is not None:
+            recording.add_output(output_file_path)
+
+    def run(self, seed: int = None):
         """
         run:
             to create a photobooth image, we need to:
@@ -139,70 +460,260 @@ class Photobooth(object):
             4) print the resulting image
             5) ...
             6) profit?
+
+        If a seed is given, the effects are seeded with it (see `session`),
+        e.g. to replay a recorded session
+        """
+
+        if not self.__start():
+            return
+
+        try:
+            if self.burst_recorder is not None:
+                with self.session(burst=True):
+                    for text, sub_text, seconds in self.__countdown("get ready to move!", "Move!"):
+                        self.display.put_text(text, sub_text)
+                        time.sleep(seconds)
+
+                    self.__show_burst_done(self.record_burst())
+                return
+
+            with self.session(seed, streamed=self.stream_strips):
+                if self.stream_strips:
+                    # 1+2+3) take the pictures, spookifying each one in the
+                    # background and writing it straight into the strips
+                    with span("capture_and_stream"):
+                        job = self.__capture_and_stream()
+                    self.__wait_for_printing(job)
+                    return
+
+                if self.pipelined:
+                    # 1+2) take the pictures, spookifying each one in the
+                    # background while the countdown for the next one runs
+                    with span("capture_and_process"):
+                        spooked_images = self.__take_and_process_pictures()
+                else:
+                    # 1) take the pictures!
+                    with span("capture"):
+                        imgs = self.capture()
+
+                    # 2) spookify them
+                    self.state = PhotoboothState.PROCESSING
+                    self.display.put_text("Detecting ghosts...")
+                    spooked_images = self.process_photos(imgs)
+
+                # 3) put them together and print them
+                self.__composite_and_print(spooked_images)
+        finally:
+            self.__stop()
+
+    async def run_async(self, executor: Executor):
+        """
+        run the same session as `run`, but from an asyncio event loop. The
+        countdown and photos are taken on the loop, and the spookifying,
+        compositing and printing is run in the executor, so the loop is free
+        to handle other things while the session runs
         """
+        if not self.__start():
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def run_in_executor(fn, *args):
+            # run in a copy of our context so that the timings are recorded
+            # in this session
+            return loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
 
+        try:
+            if self.burst_recorder is not None:
+                with self.session(burst=True):
+                    for text, sub_text, seconds in self.__countdown("get ready to move!", "Move!"):
+                        self.display.put_text(text, sub_text)
+                        await asyncio.sleep(seconds)
+
+                    self.__show_burst_done(await run_in_executor(self.record_burst))
+                return
+
+            with self.session(streamed=self.stream_strips):
+                if self.stream_strips:
+                    with span("capture_and_stream"), self.__open_strip_writers() as writers:
+                        futures = []
+
+                        async def on_photo_taken(img: Image.Image):
+                            # only one photo is worked on at a time, however
+                            # quickly they are taken
+                            if len(futures) > 0:
+                                await futures[-1]
+                            futures.append(run_in_executor(self.__process_and_write_photo, len(futures), img, writers))
+
+                        await self.capture_async(on_photo_taken, keep_photos=False)
+
+                        self.state = PhotoboothState.PROCESSING
+                        self.display.put_text("Detecting ghosts...")
+                        await asyncio.gather(*futures)
+                        job = await run_in_executor(self.__finish_strips, writers)
+
+                    await run_in_executor(self.__wait_for_printing, job)
+                    return
+
+                if self.pipelined:
+                    with span("capture_and_process"):
+                        futures = []
+                        await self.capture_async(
+                            lambda img: futures.append(run_in_executor(self.process_photo, img, len(futures)))
+                        )
+
+                        self.state = PhotoboothState.PROCESSING
+                        self.display.put_text("Detecting ghosts...")
+                        spooked_images = await asyncio.gather(*futures)
+                else:
+                    with span("capture"):
+                        imgs = await self.capture_async()
+
+                    self.state = PhotoboothState.PROCESSING
+                    self.display.put_text("Detecting ghosts...")
+                    spooked_images = await run_in_executor(self.process_photos, imgs)
+
+                await run_in_executor(self.__composite_and_print, spooked_images)
+        finally:
+            self.__stop()
+
+    def get_state(self) -> dict:
+        """what the photobooth is up to right now"""
+        return {
+            "state": self.state,
+            "sessions_completed": self.sessions_completed,
+            "last_session_seconds": self.last_session_seconds,
+            "print_status": self.printer.spooler.describe() if self.printer.spooler is not None else "",
+        }
+
+    def __start(self) -> bool:
         if self.is_running:
             print("[WARN]: The photobooth workflow is already running! Ignoring...")
             print("")
-            return
+            return False
 
         self.is_running = True
-        try:
+        return True
 
-            # 1) take the pictures!
-            imgs = self.__take_pictures()
-
-            self.display.put_text("Detecting ghosts...")
+    def __stop(self):
+        self.state = PhotoboothState.IDLE
+        self.is_running = False
 
-            # 2) process images
-            # 2a) convert images to image processing context
-            (
-                image_width,
-                image_height,
-                processing_contexts,
-            ) = self.__setup_images_for_processing(imgs)
+    @contextmanager
+    def session(self, seed: int = None, **attributes):
+        """
+        time the session run in the block and write it to the timing log. Any
+        exception is logged rather than raised, so the booth keeps going.
 
-            # setup the final image
-            result_width = image_width + (2 * self.image_border_size)
-            result_height = (image_height * self.num_photos) + ((self.num_photos + 1) * self.image_border_size)
-            print(f"final image size: {result_width}x{result_height}")
-            unspooked_image = Image.new("RGBA", (result_width, result_height), (255, 255, 255, 255))
-            final_image = Image.new("RGBA", (result_width, result_height), (255, 255, 255, 255))
+        If a seed is given, or there is a session recorder, the effects run on
+        each photo are seeded from it, so the session can be run again exactly
+        """
+        recording: Optional[SessionRecording] = None
+        if self.session_recorder is not None:
+            if seed is None:
+                seed = secrets.randbits(32)
+            recording = self.session_recorder.start(seed, self.__get_recording_config())
+
+        seed_token = _session_seed.set(seed)
+        recording_token = _session_recording.set(recording)
+        try:
+            with timed_session("photobooth") as session:
+                session.attributes["num_photos"] = self.num_photos
+                session.attributes["pipelined"] = self.pipelined
+                if seed is not None:
+                    session.attributes["seed"] = seed
+                session.attributes.update(attributes)
+
+                try:
+                    yield session
+                    session.attributes["success"] = True
+                except Exception as e:
+                    session.attributes["success"] = False
+                    print(f"An exception occurred running the photobooth: {e}")
+                    traceback.print_exc()
+        finally:
+            _session_recording.reset(recording_token)
+            _session_seed.reset(seed_token)
+
+        if self.timing_log is not None:
+            self.timing_log.write(session)
+
+        if recording is not None:
+            recording.finish(session.to_record())
+
+        self.sessions_completed += 1
+        self.last_session_seconds = session.duration_seconds
+
+        print(f"Photobooth workflow done in {session.duration_seconds:.1f}s")
+
+    def __get_recording_config(self) -> dict:
+        """how the photobooth was set up, so a recorded session can be replayed the same way"""
+        return {
+            "num_photos": self.num_photos,
+            "border_size": self.image_border_size,
+            "layout": self.compositor.layout.name,
+            "pipelined": self.pipelined,
+            "stream_strips": self.stream_strips,
+            "image_type": self.printer.encoder.name,
+            "unspooked_image_type": self.printer.unspooked_encoder.name,
+        }
+
+    def composite(self, spooked_images: List[Tuple[np.array, np.array]]) -> Tuple[np.array, np.array]:
+        """
+        put the spookified and unspooked photos onto their own canvases,
+        returning (final, unspooked). The canvases belong to the compositor
+        until they are handed to `print_strip`
+        """
+        image_height, image_width = spooked_images[0][0].shape[:2]
+        with span("composite", width=image_width, height=image_height, layout=self.compositor.layout.name):
+            # 2c) copy each image onto the final images
+            unspooked_canvas = self.compositor.compose([unspooked for unspooked, _ in spooked_images], "unspooked")
+            final_canvas = self.compositor.compose([spooked for _, spooked in spooked_images], "final")
+            print(f"final image size: {final_canvas.shape[1]}x{final_canvas.shape[0]}")
 
-            # 2b) for each image:
-            #   - determine which spooky effects to run
-            #   - spookify them
-            #   - add to the final image
-            count = 0
-            for context in processing_contexts:
-                x = self.image_border_size
-                y = (count * image_height) + ((count + 1) * self.image_border_size)
+        return final_canvas, unspooked_canvas
 
-                unspooked_image.paste(context.img, (x, y))
+    def print_strip(self, final_canvas: np.array, unspooked_canvas: np.array) -> Optional[PrintJob]:
+        """save both strips and print the final one, then hand the canvases back to the compositor"""
+        try:
+            # 3) print images!
+            print("Printing the resulting image")
+            now = datetime.now()
+            return self.printer.save_all_and_print(
+                now, Image.fromarray(final_canvas), Image.fromarray(unspooked_canvas)
+            )
+        finally:
+            self.compositor.release(final_canvas)
+            self.compositor.release(unspooked_canvas)
 
-                effects = self.__determine_effects_to_run()
+    def __composite_and_print(self, spooked_images: List[Tuple[np.array, np.array]]):
+        self.state = PhotoboothState.PRINTING
+        final_canvas, unspooked_canvas = self.composite(spooked_images)
 
-                print(f"running effects {[e.__class__.__name__ for e in effects]} on {context.filename()}")
-                for effect in effects:
-                    context.img = effect.process_image(context)
+        self.display.clear_text()
+        self.display.put_text("Printing your pictures!")
 
-                print(f"putting image of size {context.img.size} into: {x},{y}")
+        job = self.print_strip(final_canvas, unspooked_canvas)
+        self.__wait_for_printing(job)
 
-                final_image.paste(context.img, (x, y))
-                count += 1
+    def __wait_for_printing(self, job: Optional[PrintJob]):
+        self.display.clear_text()
 
-            self.display.clear_text()
-            self.display.put_text("Printing your pictures!")
+        if job is not None:
+            # the spooler prints in the background, so the next guests can
+            # start as soon as the job is queued
+            print(f"Queued {job.file_path} to be printed")
+            self.display.put_text("All done!", self.printer.spooler.describe())
+            return
 
-            # 3) print images!
-            print("Printing the resulting image")
-            now = datetime.now()
-            self.printer.save_unspooked(now, unspooked_image)
-            self.printer.save_and_print(now, final_image)
-            print("Printing complete!")
+        print("Printing complete!")
 
-            self.display.clear_text()
+        if not self.printer.should_print:
+            self.display.put_text("All done!")
+            return
 
+        with span("printing_wait"):
             end_time = datetime.now() + timedelta(seconds=60)
 
             while (now := datetime.now()) < end_time:
@@ -213,79 +724,306 @@ class Photobooth(object):
                 self.display.put_text(text)
                 time.sleep(1)
 
-            self.display.clear_text()
-            self.display.put_text("All done!")
+        self.display.clear_text()
+        self.display.put_text("All done!")
 
-        except Exception as e:
-            print(f"An exception occurred running the photobooth: {e}")
-            traceback.print_exc()
+    def __countdown(self, sub_text: str, final_text: str) -> Iterator[Tuple[str, str, float]]:
+        """the (text, subtext, seconds to show it for) to show while counting down to a photo"""
+        # count down the seconds until the photo, then say cheese
+        for seconds_gone in range(math.ceil(self.photo_delay_seconds)):
+            yield str(int(self.photo_delay_seconds - seconds_gone)), sub_text, 1
 
-        self.is_running = False
+        yield final_text, sub_text, self.pause_seconds
 
-        print("Photobooth workflow done")
+    def __photo_countdown(self, photo_num: int) -> Iterator[Tuple[str, str, float]]:
+        return self.__countdown(f"photo {photo_num}/{self.num_photos}", "Die!" if photo_num == 3 else "Cheese!")
 
-    def __take_pictures(self) -> List[Image.Image]:
+    def capture(
+        self, on_photo_taken: Callable[[Image.Image], None] = None, keep_photos: bool = True
+    ) -> List[Image.Image]:
         """
-        take_pictures
-
         take pictures that will be processed. The number of pictures to be taken is passed in as a
-        parameter
+        parameter. If on_photo_taken is given, it is called with each picture as soon as it is taken.
+        Unless keep_photos is set, the pictures are only handed to on_photo_taken, and not returned
         """
+        self.state = PhotoboothState.CAPTURING
         self.display.clear_text()
         imgs = []
 
         for i in range(self.num_photos):
+            photo_num = i + 1
+            print(f"taking photo {photo_num}/{self.num_photos} in {self.photo_delay_seconds} seconds")
+
+            for text, sub_text, seconds in self.__photo_countdown(photo_num):
+                self.display.put_text(text, sub_text)
+                time.sleep(seconds)
+
+            self.display.clear_text()
+            with span("capture.photo", photo=photo_num):
+                img = self.photo_taker.take_photo()
+            if keep_photos:
+                imgs.append(img)
+            print("photo taken")
+            if on_photo_taken is not None:
+                on_photo_taken(img)
+            time.sleep(self.pause_seconds)
 
-            # loop from number of seconds down to 0 sleeping in between
-            # display the number going down
-            # at 0, take picture, maybe do a flash thing on the pic
-            start_time = datetime.now()
+        print("all photos taken!")
+        return imgs
+
+    async def capture_async(
+        self, on_photo_taken: Callable[[Image.Image], Optional[Awaitable]] = None, keep_photos: bool = True
+    ) -> List[Image.Image]:
+        """
+        the same as `capture`, but waiting on the event loop instead of
+        sleeping. on_photo_taken can be a coroutine function, in which case it
+        is waited for before the next countdown starts
+        """
+        self.state = PhotoboothState.CAPTURING
+        self.display.clear_text()
+        imgs = []
+
+        loop = asyncio.get_running_loop()
+        for i in range(self.num_photos):
             photo_num = i + 1
-            sub_text = f"photo {photo_num}/{self.num_photos}"
-            print(f"taking {sub_text} in {self.photo_delay_seconds} seconds")
-
-            while (datetime.now() - start_time).seconds < self.photo_delay_seconds:
-                time_left = int(self.photo_delay_seconds - (datetime.now() - start_time).seconds)
-                self.display.put_text(str(time_left), sub_text)
-                # print(f"time left: {time_left}")
-                # update image :D
-                time.sleep(1)
+            print(f"taking photo {photo_num}/{self.num_photos} in {self.photo_delay_seconds} seconds")
 
-            if photo_num == 3:
-                self.display.put_text("Die!", sub_text)
-            else:
-                self.display.put_text("Cheese!", sub_text)
+            for text, sub_text, seconds in self.__photo_countdown(photo_num):
+                self.display.put_text(text, sub_text)
+                await asyncio.sleep(seconds)
 
-            time.sleep(0.5)
             self.display.clear_text()
-            img = self.photo_taker.take_photo()
-            imgs.append(img)
+            with span("capture.photo", photo=photo_num):
+                # waiting for a fresh camera frame blocks, so it is done off
+                # the loop
+                img = await loop.run_in_executor(None, self.photo_taker.take_photo)
+            if keep_photos:
+                imgs.append(img)
             print("photo taken")
-            time.sleep(0.5)
+            if on_photo_taken is not None and inspect.isawaitable(result := on_photo_taken(img)):
+                await result
+            await asyncio.sleep(self.pause_seconds)
 
         print("all photos taken!")
         return imgs
 
-    def __setup_images_for_processing(self, imgs: List[Image.Image]) -> Tuple[int, int, List[ImageProcessingContext]]:
+    def record_burst(self) -> BurstResult:
+        """
+        take a burst of frames and save them as a spooky animation. The frames
+        are spookified while the burst is still being taken
+        """
+        self.wait_for_warm_up()
+
+        with span("effect_selection") as attributes:
+            effects = self.__determine_effects_to_run(random.Random())
+            attributes["effects"] = [e.__class__.__name__ for e in effects]
+
+        recorder = self.burst_recorder
+        output_file_path = self.printer.get_burst_path(datetime.now(), recorder.image_format)
+        print(f"recording {recorder.num_frames} frames with effects {[e.__class__.__name__ for e in effects]}")
+
+        self.state = PhotoboothState.CAPTURING
+        result = recorder.record(
+            self.photo_taker.take_burst(recorder.num_frames, recorder.fps),
+            output_file_path,
+            effects,
+            on_captured=self.__on_burst_captured,
+        )
+
+        print(f"Saved the burst to {output_file_path}: {result}")
+        return result
+
+    def __on_burst_captured(self):
+        self.state = PhotoboothState.PROCESSING
+        self.display.clear_text()
+        self.display.put_text("Detecting ghosts...")
+
+    def __show_burst_done(self, result: BurstResult):
+        self.display.clear_text()
+        self.display.put_text("All done!", os.path.basename(result.output_file_path))
+
+    def process_photos(self, imgs: List[Image.Image]) -> List[Tuple[np.array, np.array]]:
+        """
+        find the faces in all the photos at once, then spookify each of them.
+        Returns the image data of each photo before and after
+        """
+        # 2a) convert images to image processing context
+        processing_contexts = self.__setup_images_for_processing(imgs)
+
+        # 2b) for each image:
+        #   - determine which spooky effects to run
+        #   - spookify them
+        return [self.__spookify(context, index) for index, context in enumerate(processing_contexts)]
+
+    def process_photo(self, img: Image.Image, index: int = 0) -> Tuple[np.array, np.array]:
+        """find the faces in a single photo (the index'th of the session) and spookify it"""
+        self.wait_for_warm_up()
+
+        img_data = np.array(img)
+        faces = self.__find_faces([img_data])[0]
+        return self.__spookify(ImageProcessingContext(img, img_data, faces), index)
+
+    def __setup_images_for_processing(self, imgs: List[Image.Image]) -> List[ImageProcessingContext]:
+        self.wait_for_warm_up()
+
         prev_img = None
 
-        contexts = []
         for img in imgs:
             if prev_img is not None and img.size != prev_img.size:
                 raise ValueError(f"the image {img.filename} is not the same size as {prev_img.filename}")
 
-            contexts.append(self.__create_context_from_image(img))
-
             prev_img = img
 
-        return prev_img.width, prev_img.height, contexts
+        all_img_data = [np.array(img) for img in imgs]
+        all_faces = self.__find_faces(all_img_data)
+        return [
+            ImageProcessingContext(img, img_data, faces) for img, img_data, faces in zip(imgs, all_img_data, all_faces)
+        ]
 
-    def __create_context_from_image(self, img: Image) -> ImageProcessingContext:
-        img_data = np.array(img)
-        faces = find_faces_from_array(img_data)
-        return ImageProcessingContext(img, img_data, faces)
+    def __find_faces(self, all_img_data: List[np.array]) -> List[List[FaceMetadata]]:
+        """
+        find the faces in each of the images. Cached faces are used where
+        possible, and the rest are found using the detection pool (all at the
+        same time) if there is one
+        """
+        all_faces = [None] * len(all_img_data)
+
+        settings = self.detection_settings
+        if self.detection_pool is not None:
+            settings = self.detection_pool.settings
+
+        keys = []
+        if self.face_cache is not None:
+            keys = [self.face_cache.get_key(img_data, settings) for img_data in all_img_data]
+            all_faces = [self.face_cache.get(key) for key in keys]
+
+        missing = [i for i, faces in enumerate(all_faces) if faces is None]
+        if self.detection_pool is not None:
+            found = self.detection_pool.find_faces([all_img_data[i] for i in missing])
+        else:
+            found = [find_faces_from_array(all_img_data[i], self.detection_settings) for i in missing]
+
+        for i, faces in zip(missing, found):
+            all_faces[i] = faces
+            if self.face_cache is not None:
+                self.face_cache.put(keys[i], faces)
+
+        return all_faces
 
-    def __determine_effects_to_run(self) -> List[ImageEffect]:
+    def __take_and_process_pictures(self) -> List[Tuple[np.array, np.array]]:
+        """
+        take all the pictures, handing each one off to a background worker to
+        find faces and spookify it as soon as it is taken. Photos are processed
+        one at a time in the order they were taken
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            futures = []
+            # the processing is run in a copy of our context so that its
+            # timings are recorded in this session
+            self.capture(
+                lambda img: futures.append(
+                    executor.submit(contextvars.copy_context().run, self.process_photo, img, len(futures))
+                )
+            )
+
+            self.state = PhotoboothState.PROCESSING
+            self.display.put_text("Detecting ghosts...")
+            return [future.result() for future in futures]
+
+    def __capture_and_stream(self) -> Optional[PrintJob]:
+        """
+        take all the pictures, handing each one off to a background worker to
+        spookify it and write it into both strips as soon as it is taken. If
+        the last photo is still being worked on when the next one is taken,
+        the next countdown waits for it, so at most two photos are ever held
+        """
+        with self.__open_strip_writers() as writers:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                futures = []
+
+                def on_photo_taken(img: Image.Image):
+                    # only one photo is worked on at a time, however quickly
+                    # they are taken
+                    if len(futures) > 0:
+                        futures[-1].result()
+
+                    # the processing is run in a copy of our context so that
+                    # its timings are recorded in this session
+                    futures.append(
+                        executor.submit(
+                            contextvars.copy_context().run, self.__process_and_write_photo, len(futures), img, writers
+                        )
+                    )
+
+                self.capture(on_photo_taken, keep_photos=False)
+
+                self.state = PhotoboothState.PROCESSING
+                self.display.put_text("Detecting ghosts...")
+                for future in futures:
+                    future.result()
+
+            return self.__finish_strips(writers)
+
+    @contextmanager
+    def __open_strip_writers(self) -> Iterator[Tuple[StripBandWriter, StripBandWriter]]:
+        """the (final, unspooked) strip writers, removing the half written strips if anything goes wrong"""
+        writers = self.printer.open_strip_writers(
+            datetime.now(), self.compositor.layout, self.num_photos, self.image_border_size
+        )
+        try:
+            yield writers
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+
+    def __process_and_write_photo(self, index: int, img: Image.Image, writers: Tuple[StripBandWriter, StripBandWriter]):
+        final_writer, unspooked_writer = writers
+        unspooked, spooked = self.process_photo(img, index)
+
+        with span("stream.write", photo=index + 1):
+            final_writer.add_photo(index, spooked)
+            unspooked_writer.add_photo(index, unspooked)
+
+    def __finish_strips(self, writers: Tuple[StripBandWriter, StripBandWriter]) -> Optional[PrintJob]:
+        self.state = PhotoboothState.PRINTING
+        self.display.clear_text()
+        self.display.put_text("Printing your pictures!")
+        return self.printer.finish_strip_writers(writers)
+
+    def __spookify(self, context: ImageProcessingContext, index: int) -> Tuple[np.array, np.array]:
+        """
+        run a random set of effects on the index'th image of the session.
+        Returns the image data before and after the effects were run
+        """
+        # some effects draw straight onto the image, so keep a copy of how it
+        # looked before
+        unspooked = np.array(context.img_data)
+
+        # each photo gets its own generators, seeded from the session, so the
+        # effects are the same however the photos are processed and whatever
+        # else is using the shared generators at the time
+        seed = _session_seed.get()
+        if seed is not None:
+            context.rng = random.Random(seed + index)
+            context.np_rng = np.random.default_rng(seed + index)
+
+        with span("effect_selection") as attributes:
+            effects = self.__determine_effects_to_run(context.rng)
+            attributes["effects"] = [e.__class__.__name__ for e in effects]
+
+        print(f"running effects {[e.__class__.__name__ for e in effects]} on {context.filename()}")
+        with recording_noise_frames() as noise_frames:
+            # the noise frames are filled in as the effects take them
+            recording = _session_recording.get()
+            if recording is not None:
+                recording.add_photo(index, unspooked, context.faces, noise_frames)
+
+            apply_effects(context, effects)
+
+        return unspooked, context.img_data
+
+    def __determine_effects_to_run(self, rng: random.Random) -> List[ImageEffect]:
         all_effects = [
             GhostEffect(2),
             GhostEffect(1),
@@ -302,8 +1040,8 @@ class Photobooth(object):
         selected_effects = []
         selected_classes = set()
 
-        while len(selected_effects) < 4 and random.randint(0, 100) < chance_for_next_effect:
-            index = random.randint(0, len(all_effects) - 1)
+        while len(selected_effects) < 4 and rng.randint(0, 100) < chance_for_next_effect:
+            index = rng.randint(0, len(all_effects) - 1)
             selected = all_effects[index]
             print(f"selected effect {selected.__class__.__name__}")
             if selected.__class__ in selected_classes:
@@ -323,14 +1061,14 @@ class Photobooth(object):
             chance_for_next_effect = chance_for_next_effect * (2 / 3)
 
         # run tv static effect at the end, maybe
-        if random.randint(0, 100) < 25:
-            sigma_value = random.randint(500, 1000)
+        if rng.randint(0, 100) < 25:
+            sigma_value = rng.randint(500, 1000)
             print(f"selected effect TvStaticEffect with value {sigma_value}")
             selected_effects.append(TvStaticEffect(sigma_value))
 
         # run saturation effect at the end, maybe
-        if random.randint(0, 100) < 40:
-            saturation_effect = random.uniform(0.4, 0.9)
+        if rng.randint(0, 100) < 40:
+            saturation_effect = rng.uniform(0.4, 0.9)
             print(f"selected effect SaturationEffect with value {saturation_effect}")
 
             selected_effects.append(SaturationEffect(saturation_effect))
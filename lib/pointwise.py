@@ -0,0 +1,114 @@
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+# the weights PIL uses to turn RGB into L (ITU-R 601-2 luma)
+_LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+class PointwiseProgram(object):
+    """
+    A chain of per-pixel effects, fused into a single pass over the image.
+
+    Every channel of the result is kept as a weighted sum of channels of the
+    image and of other images the same size, plus an offset. Adding an effect
+    only changes the weights, so the pixels are worked out (and rounded) just
+    once, in `run`, with one saturating multiply-add per channel and no float
+    copies of the frame.
+
+    Since the result is only rounded once, it can be a level or so off from
+    running the effects one after another.
+    """
+
+    def __init__(self, img_data: np.array):
+        if img_data.ndim == 2:
+            img_data = cv2.cvtColor(img_data, cv2.COLOR_GRAY2RGB)
+
+        self.height, self.width = img_data.shape[:2]
+
+        planes = list(cv2.split(img_data))
+        self.__terms: List[List[Tuple[np.array, float]]] = [[(plane, 1.0)] for plane in planes]
+        self.__offsets = [0.0] * len(planes)
+        self.__has_alpha = len(planes) == 4
+        if not self.__has_alpha:
+            # no alpha is the same as fully opaque
+            self.__terms.append([])
+            self.__offsets.append(255.0)
+
+        self.__plane_means: Dict[int, float] = {}
+        super().__init__()
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def blend_rgb(self, source: np.array, amount: float):
+        """blend the colours towards the colours of an RGB(A) source, the same as `Image.blend`"""
+        planes = cv2.split(source)
+        for channel in range(3):
+            self.__blend_channel(channel, planes[channel], amount)
+
+    def blend_alpha(self, source: np.array, amount: float):
+        """blend the alpha towards a single channel source. The result always has an alpha channel"""
+        self.__blend_channel(3, source, amount)
+        self.__has_alpha = True
+
+    def contrast(self, factor: float):
+        """the same as `ImageEnhance.Contrast(img).enhance(factor)`: scale the colours about the mean luma"""
+        mean = int(self.get_mean_luma() + 0.5)
+        for channel in range(3):
+            self.__scale_channel(channel, factor, (1 - factor) * mean)
+
+    def get_mean_luma(self) -> float:
+        """the mean L (as PIL would convert to it) of the image as it would be after `run`"""
+        luma = 0.0
+        for channel, weight in enumerate(_LUMA_WEIGHTS):
+            mean = self.__offsets[channel]
+            for plane, plane_weight in self.__terms[channel]:
+                mean += plane_weight * self.__get_plane_mean(plane)
+            luma += weight * mean
+
+        return luma
+
+    def run(self) -> np.array:
+        """work out the pixels, as an RGBA array if there is alpha, otherwise RGB"""
+        shape = (self.height, self.width)
+        channels = 4 if self.__has_alpha else 3
+        planes = [_weighted_sum(self.__terms[c], self.__offsets[c], shape) for c in range(channels)]
+        return cv2.merge(planes)
+
+    def __blend_channel(self, channel: int, source: np.array, amount: float):
+        self.__scale_channel(channel, 1 - amount, 0.0)
+        self.__terms[channel].append((source, amount))
+
+    def __scale_channel(self, channel: int, factor: float, offset: float):
+        self.__terms[channel] = [(plane, weight * factor) for plane, weight in self.__terms[channel]]
+        self.__offsets[channel] = self.__offsets[channel] * factor + offset
+
+    def __get_plane_mean(self, plane: np.array) -> float:
+        key = id(plane)
+        if key not in self.__plane_means:
+            self.__plane_means[key] = cv2.mean(plane)[0]
+
+        return self.__plane_means[key]
+
+
+def _weighted_sum(terms: List[Tuple[np.array, float]], offset: float, shape: Tuple[int, int]) -> np.array:
+    # planes that cancelled out don't need reading
+    terms = [(plane, weight) for plane, weight in terms if weight != 0.0]
+
+    if len(terms) == 0:
+        return np.full(shape, min(max(round(offset), 0), 255), dtype=np.uint8)
+    elif len(terms) == 1:
+        plane, weight = terms[0]
+        return cv2.addWeighted(plane, weight, plane, 0.0, offset)
+    elif len(terms) == 2:
+        (a, a_weight), (b, b_weight) = terms
+        return cv2.addWeighted(a, a_weight, b, b_weight, offset)
+
+    # more than two sources is rare enough to not be worth being clever about
+    result = np.full(shape, offset, dtype=np.float32)
+    for plane, weight in terms:
+        result += plane.astype(np.float32) * weight
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
@@ -0,0 +1,241 @@
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from lib.detection import DetectionSettings, FaceMetadata, find_faces_from_array
+from lib.effect import (
+    GhostEffect,
+    ImageEffect,
+    ImageProcessingContext,
+    SaturationEffect,
+    SketchyEyeEffect,
+    TvStaticEffect,
+    apply_effect,
+)
+
+
+def get_default_preview_effects() -> List[ImageEffect]:
+    """the effects cheap enough to run on every frame, most important first"""
+    return [SketchyEyeEffect(), GhostEffect(2), SaturationEffect(0.6), TvStaticEffect(800)]
+
+
+class FrameBudgetScheduler(object):
+    """
+    Picks which effects can be run on a frame without going over the frame
+    budget (1 / target_fps).
+
+    How long each effect takes is measured on every frame it runs on, as is
+    the time spent on the rest of the frame (reading it, drawing the text and
+    showing it). Effects are taken in the order given, and any that wouldn't
+    fit in what is left of the budget are dropped. If fewer effects would be
+    dropped by running them on a smaller copy of the frame, the frame is
+    degraded to the first of `scales` that keeps the most.
+
+    Effects that have been dropped are forgotten about every retry_seconds,
+    so they are tried again in case the frames got cheaper.
+    """
+
+    def __init__(
+        self,
+        target_fps: float = 15,
+        scales: Tuple[float, ...] = (1.0, 0.5),
+        smoothing: float = 0.2,
+        retry_seconds: float = 10,
+    ):
+        if target_fps <= 0:
+            raise ValueError("the target fps must be positive")
+        if len(scales) == 0:
+            raise ValueError("there must be at least one scale")
+
+        self.target_fps = target_fps
+        self.frame_budget = 1 / target_fps
+        self.scales = scales
+        self.smoothing = smoothing
+        self.retry_seconds = retry_seconds
+
+        # seconds per (effect name, scale)
+        self.__costs: Dict[Tuple[str, float], float] = {}
+        self.__overhead = 0.0
+        self.__last_retry = time.perf_counter()
+        self.__frame_times: List[float] = []
+        super().__init__()
+
+    def plan(self, names: List[str]) -> Tuple[List[str], float]:
+        """the (names of the effects to run, scale to run them at) for the next frame"""
+        now = time.perf_counter()
+        if now - self.__last_retry >= self.retry_seconds:
+            self.__last_retry = now
+            self.__costs = {key: cost for key, cost in self.__costs.items() if cost <= self.__get_remaining()}
+
+        best_names, best_scale = None, self.scales[0]
+        for scale in self.scales:
+            selected = self.__select(names, scale)
+            if best_names is None or len(selected) > len(best_names):
+                best_names, best_scale = selected, scale
+            if len(selected) == len(names):
+                break
+
+        return best_names, best_scale
+
+    def record_effect(self, name: str, scale: float, seconds: float):
+        key = (name, scale)
+        self.__costs[key] = _smooth(self.__costs.get(key), seconds, self.smoothing)
+
+    def record_frame(self, seconds: float, effect_seconds: float):
+        """record how long the whole frame took, and how much of that was the effects"""
+        self.__overhead = _smooth(self.__overhead, max(0.0, seconds - effect_seconds), self.smoothing)
+        self.__frame_times.append(time.perf_counter())
+
+    def get_fps(self) -> float:
+        """the frames shown a second since the last call"""
+        frame_times = self.__frame_times
+        self.__frame_times = frame_times[-1:]
+        if len(frame_times) < 2:
+            return 0.0
+
+        return (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+    def __get_remaining(self) -> float:
+        return self.frame_budget - self.__overhead
+
+    def __select(self, names: List[str], scale: float) -> List[str]:
+        remaining = self.__get_remaining()
+        selected = []
+        for name in names:
+            # effects that haven't been timed yet are given a go
+            cost = self.__costs.get((name, scale), 0.0)
+            if cost > remaining:
+                continue
+
+            selected.append(name)
+            remaining -= cost
+
+        return selected
+
+
+def _smooth(previous: Optional[float], value: float, smoothing: float) -> float:
+    if previous is None:
+        return value
+
+    return previous + (value - previous) * smoothing
+
+
+class SpookyPreview(object):
+    """
+    Runs effects on the live preview, within a frame budget.
+
+    Faces are found on a background thread every detection_interval frames,
+    and the last faces found are used on the frames in between (and while the
+    next ones are being found). The effects are run on the current frame with
+    the faces from the last detection to finish, which was run on an older
+    frame, so they lag a little behind the guests.
+
+    The ghosts are moved every ghost_seconds, rather than every frame.
+    """
+
+    def __init__(
+        self,
+        effects: List[ImageEffect] = None,
+        target_fps: float = 15,
+        detection_interval: int = 5,
+        detection_settings: DetectionSettings = None,
+        ghost_seconds: float = 3,
+        report_seconds: float = 10,
+    ):
+        if detection_interval <= 0:
+            raise ValueError("the detection interval must be positive")
+
+        self.effects = effects if effects is not None else get_default_preview_effects()
+        self.detection_interval = detection_interval
+        self.detection_settings = detection_settings or DetectionSettings(320)
+        self.ghost_seconds = ghost_seconds
+        self.report_seconds = report_seconds
+        self.scheduler = FrameBudgetScheduler(target_fps)
+
+        self.__names = [f"{i}:{effect.__class__.__name__}" for i, effect in enumerate(self.effects)]
+        self.__faces: List[FaceMetadata] = []
+        self.__detection: Optional[Future] = None
+        self.__detection_executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="preview-detection"
+        )
+        self.__frame_num = 0
+        self.__last_report = time.perf_counter()
+        self.__last_plan: Tuple[List[str], float] = ([], 1.0)
+        super().__init__()
+
+    def render(self, frame: np.array) -> np.array:
+        """run the effects that fit in the budget on a BGR frame, returning the BGR result"""
+        self.__update_faces(frame)
+
+        names, scale = self.scheduler.plan(self.__names)
+        self.__last_plan = (names, scale)
+        if len(names) == 0:
+            return frame
+
+        height, width = frame.shape[:2]
+        faces = self.__faces
+        if scale != 1.0:
+            frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            faces = [face.scale(scale) for face in faces]
+
+        # the same seed until it is time to move the ghosts
+        rng = random.Random(int(time.time() / self.ghost_seconds))
+
+        context = ImageProcessingContext(None, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), faces, rng=rng)
+        for name in names:
+            start = time.perf_counter()
+            apply_effect(context, self.effects[self.__names.index(name)])
+            self.scheduler.record_effect(name, scale, time.perf_counter() - start)
+
+        result = cv2.cvtColor(context.img_data[..., :3], cv2.COLOR_RGB2BGR)
+        if scale != 1.0:
+            result = cv2.resize(result, (width, height), interpolation=cv2.INTER_LINEAR)
+
+        return result
+
+    def frame_done(self, seconds: float, effect_seconds: float):
+        """record how long the frame took to show, and report the fps every now and again"""
+        self.scheduler.record_frame(seconds, effect_seconds)
+
+        now = time.perf_counter()
+        if now - self.__last_report >= self.report_seconds:
+            self.__last_report = now
+            print(self.describe())
+
+    def describe(self) -> str:
+        names, scale = self.__last_plan
+        dropped = [name for name in self.__names if name not in names]
+        return (
+            f"preview: {self.scheduler.get_fps():.1f} fps (target {self.scheduler.target_fps}), "
+            f"effects {[name.split(':', 1)[1] for name in names]} at {scale}x, "
+            f"dropped {[name.split(':', 1)[1] for name in dropped]}, {len(self.__faces)} face(s)"
+        )
+
+    def close(self):
+        if self.__detection_executor is not None:
+            self.__detection_executor.shutdown(wait=False)
+            self.__detection_executor = None
+
+    def __update_faces(self, frame: np.array):
+        if self.__detection is not None and self.__detection.done():
+            try:
+                self.__faces = self.__detection.result()
+            except ImportError as e:
+                print(f"[WARN]: couldnt load dlib, the preview won't find faces: {e}")
+                self.close()
+            except Exception as e:
+                print(f"[WARN]: couldnt find faces on the preview: {e}")
+            self.__detection = None
+
+        if self.__frame_num % self.detection_interval == 0 and self.__detection is None:
+            if self.__detection_executor is not None:
+                img_data = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                self.__detection = self.__detection_executor.submit(
+                    find_faces_from_array, img_data, self.detection_settings
+                )
+
+        self.__frame_num += 1
@@ -0,0 +1,205 @@
+import queue
+import re
+import shlex
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+# `lp` prints the id of the job it created, e.g.
+# "request id is photobooth_printer-12 (1 file(s))"
+_REQUEST_ID_PATTERN = re.compile(r"request id is (\S+)")
+
+
+class PrintJob(object):
+    QUEUED = "queued"
+    SENDING = "sending"
+    PRINTING = "printing"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.status = PrintJob.QUEUED
+        self.system_job_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.queued_at = time.time()
+        self.finished_at: Optional[float] = None
+        super().__init__()
+
+    def is_finished(self) -> bool:
+        return self.status in (PrintJob.DONE, PrintJob.FAILED)
+
+    def __repr__(self) -> str:
+        return f"PrintJob({self.file_path}, status={self.status}, id={self.system_job_id})"
+
+
+class PrintSpooler(object):
+    """
+    Sends files to the printer in the background.
+
+    Jobs are sent one at a time from a queue. After a job is sent, the print
+    system is polled (with `lpstat`) until the job is no longer listed, at
+    which point it is done. A job counts towards max_queued_jobs from when it
+    is submitted until it is done, so `submit` blocks while that many strips
+    are waiting to be sent or still waiting in the print system. Every time a
+    job changes status, on_status is called with it.
+
+    The print and status commands can be swapped out, e.g. for
+    tools/fake_printer.py when there is no printer attached.
+    """
+
+    def __init__(
+        self,
+        print_command: str = "lp",
+        status_command: str = "lpstat -o",
+        max_queued_jobs: int = 4,
+        poll_seconds: float = 2.0,
+        on_status: Callable[[PrintJob], None] = None,
+    ):
+        if max_queued_jobs <= 0:
+            raise ValueError("there must be room for at least one print job")
+
+        self.print_command = shlex.split(print_command)
+        self.status_command = shlex.split(status_command)
+        self.max_queued_jobs = max_queued_jobs
+        self.poll_seconds = poll_seconds
+        self.on_status = on_status
+
+        self.__queue = queue.Queue()
+        self.__jobs: List[PrintJob] = []
+        self.__lock = threading.Lock()
+        self.__job_finished = threading.Condition(self.__lock)
+        self.__stopped = threading.Event()
+
+        self.__worker = threading.Thread(target=self.__run, daemon=True)
+        self.__worker.start()
+
+        super().__init__()
+
+    def submit(self, file_path: str, timeout: float = None) -> PrintJob:
+        """
+        queue the file to be printed, first waiting for one of the jobs to be
+        done if max_queued_jobs are still going. Raises queue.Full if none are
+        done within the timeout
+        """
+        job = PrintJob(file_path)
+        with self.__job_finished:
+            if not self.__job_finished.wait_for(
+                lambda: len([j for j in self.__jobs if not j.is_finished()]) < self.max_queued_jobs, timeout
+            ):
+                raise queue.Full(f"{self.max_queued_jobs} print jobs are still going")
+
+            # only the jobs still going are needed from here on
+            self.__jobs = [j for j in self.__jobs if not j.is_finished()]
+            self.__jobs.append(job)
+
+        self.__queue.put(job)
+        self.__notify(job)
+        return job
+
+    def get_active_jobs(self) -> List[PrintJob]:
+        with self.__lock:
+            return [job for job in self.__jobs if not job.is_finished()]
+
+    def describe(self) -> str:
+        """a short description of what the printer is up to, for showing to guests"""
+        with self.__lock:
+            active = [job for job in self.__jobs if not job.is_finished()]
+            last = self.__jobs[-1] if self.__jobs else None
+
+        if len(active) > 0:
+            return f"printing {len(active)} strip{'s' if len(active) > 1 else ''}..."
+        if last is not None and last.status == PrintJob.FAILED:
+            return "the last print failed :("
+
+        return ""
+
+    def stop(self):
+        self.__stopped.set()
+        self.__worker.join(timeout=self.poll_seconds * 2)
+
+    def __run(self):
+        next_poll = time.monotonic()
+        while not self.__stopped.is_set():
+            timeout = max(0.0, next_poll - time.monotonic())
+            try:
+                job = self.__queue.get(timeout=timeout)
+                self.__send(job)
+            except queue.Empty:
+                pass
+
+            if time.monotonic() >= next_poll:
+                self.__poll()
+                next_poll = time.monotonic() + self.poll_seconds
+
+    def __send(self, job: PrintJob):
+        self.__set_status(job, PrintJob.SENDING)
+
+        print(f"Sending {job.file_path} to the printer")
+        try:
+            result = subprocess.run(
+                self.print_command + [job.file_path], capture_output=True, text=True, timeout=30
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            job.error = str(e)
+            self.__set_status(job, PrintJob.FAILED)
+            return
+
+        if result.returncode != 0:
+            job.error = result.stderr.strip() or f"exit code {result.returncode}"
+            print(f"Printing failed :( {job.error}")
+            self.__set_status(job, PrintJob.FAILED)
+            return
+
+        match = _REQUEST_ID_PATTERN.search(result.stdout)
+        if match is None:
+            # without a job id there is no way to follow it, so trust that
+            # the print system has it
+            self.__set_status(job, PrintJob.DONE)
+            return
+
+        job.system_job_id = match.group(1)
+        self.__set_status(job, PrintJob.PRINTING)
+
+    def __poll(self):
+        printing = [job for job in self.get_active_jobs() if job.status == PrintJob.PRINTING]
+        if len(printing) == 0:
+            return
+
+        try:
+            result = subprocess.run(self.status_command, capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"[WARN]: couldnt get the print status: {e}")
+            return
+
+        if result.returncode != 0:
+            print(f"[WARN]: couldnt get the print status: {result.stderr.strip()}")
+            return
+
+        # lpstat lists the jobs that haven't finished yet, one per line
+        # starting with the job id
+        pending = {line.split()[0] for line in result.stdout.splitlines() if line.strip()}
+        for job in printing:
+            if job.system_job_id not in pending:
+                self.__set_status(job, PrintJob.DONE)
+
+    def __set_status(self, job: PrintJob, status: str):
+        job.status = status
+        if job.is_finished():
+            job.finished_at = time.time()
+            print(f"Print job {job.system_job_id or job.file_path} is {status}")
+
+            with self.__job_finished:
+                self.__job_finished.notify_all()
+
+        self.__notify(job)
+
+    def __notify(self, job: PrintJob):
+        if self.on_status is None:
+            return
+
+        try:
+            self.on_status(job)
+        except Exception as e:
+            print(f"[WARN]: print status callback failed: {e}")
@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from lib.detection import DetectionSettings, FaceMetadata
+
+DEFAULT_RECORDING_DIR = "./recordings"
+
+_SESSION_FILE_NAME = "session.json"
+# 2: the effects use generators made for each photo, rather than reseeding the shared ones
+_RECORDING_VERSION = 2
+
+
+class SessionRecording(object):
+    """
+    Everything needed to run a single session again: the photos as they were
+    taken, the faces found in each of them, the seed the effects were run
+    with and the noise frames the effects took. The digests of the strips the
+    session saved are kept too, so a replay can check it made exactly the
+    same ones.
+
+    Photos are encoded on the recorder's worker as soon as they are added, so
+    only the (compressed) files are held until the session is finished.
+    """
+
+    def __init__(self, recorder: "SessionRecorder", seed: int, config: dict):
+        self.recorder = recorder
+        self.seed = seed
+        self.config = config
+        self.started_at = datetime.now()
+
+        self.__photos: Dict[int, Tuple[Future, List[FaceMetadata], List[Tuple[int, int]]]] = {}
+        self.__outputs: List[str] = []
+        self.__lock = threading.Lock()
+
+        super().__init__()
+
+    def add_photo(
+        self, index: int, img_data: np.array, faces: List[FaceMetadata], noise_frames: List[Tuple[int, int]]
+    ):
+        """
+        add a photo as it was taken, before any effects were run on it, with
+        the keys of the noise frames its effects took. The array must not be
+        changed after, but the keys can still be added to until the session
+        is finished
+        """
+        future = self.recorder.submit(_encode_photo, img_data, self.recorder.compress_level)
+        with self.__lock:
+            self.__photos[index] = (future, faces, noise_frames)
+
+    def add_output(self, output_file_path: str):
+        """add a strip that the session saved"""
+        with self.__lock:
+            self.__outputs.append(output_file_path)
+
+    def finish(self, timing: dict) -> Future:
+        """write the recording in the background, returning the future of its path"""
+        return self.recorder.submit(self.__write, timing)
+
+    def __write(self, timing: dict) -> Optional[str]:
+        with self.__lock:
+            photos = sorted(self.__photos.items())
+            outputs = list(self.__outputs)
+
+        file_name = f"session_{self.started_at:%Y%m%d-%H%M%S}_{self.seed:08x}.zip"
+        path = os.path.join(self.recorder.output_dir, file_name)
+
+        try:
+            data = {
+                "version": _RECORDING_VERSION,
+                "seed": self.seed,
+                "config": self.config,
+                "photos": [
+                    {
+                        "file": f"photo_{index + 1}.png",
+                        "faces": [face.to_dict() for face in faces],
+                        "noise_frames": [list(key) for key in noise_frames],
+                    }
+                    for index, (_, faces, noise_frames) in photos
+                ],
+                "outputs": [
+                    {"name": os.path.basename(output), "sha256": get_file_digest(output)} for output in outputs
+                ],
+                "timing": timing,
+            }
+
+            # write to a temp file first so a replay never sees half a recording
+            temp_path = f"{path}.tmp"
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as archive:
+                archive.writestr(_SESSION_FILE_NAME, json.dumps(data, indent=2))
+                for index, (future, _, _) in photos:
+                    archive.writestr(f"photo_{index + 1}.png", future.result())
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"[WARN]: couldnt record the session to {path}: {e}")
+            return None
+
+        print(f"Recorded the session to {path}")
+        return path
+
+
+class SessionRecorder(object):
+    """
+    Records each session into its own zip archive in output_dir, so it can be
+    replayed later with `benchmarks/replay_sessions.py`.
+
+    The photos are stored as png files, written with compress_level (1 is
+    fast enough to keep up with the photos being taken), next to a
+    session.json with everything else. All the encoding and writing is done
+    on a single background worker, so recording adds very little to a session.
+    """
+
+    def __init__(self, output_dir: str = DEFAULT_RECORDING_DIR, compress_level: int = 1):
+        self.output_dir = output_dir
+        self.compress_level = compress_level
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-recorder")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        super().__init__()
+
+    def start(self, seed: int, config: dict) -> SessionRecording:
+        return SessionRecording(self, seed, config)
+
+    def submit(self, fn, *args) -> Future:
+        return self.__executor.submit(fn, *args)
+
+    def close(self):
+        """wait for every recording to be written"""
+        self.__executor.shutdown()
+
+
+class RecordedSession(object):
+    """A session loaded back from its recording. noise_frames has the keys taken by each photo"""
+
+    def __init__(
+        self,
+        path: str,
+        seed: int,
+        config: dict,
+        photos: List[Image.Image],
+        faces: List[List[FaceMetadata]],
+        noise_frames: List[List[Tuple[int, int]]],
+        outputs: List[dict],
+        timing: dict,
+    ):
+        self.path = path
+        self.seed = seed
+        self.config = config
+        self.photos = photos
+        self.faces = faces
+        self.noise_frames = noise_frames
+        self.outputs = outputs
+        self.timing = timing
+        super().__init__()
+
+    def get_noise_frames(self) -> List[Tuple[int, int]]:
+        """the keys of every noise frame the session took, in the order the photos were taken"""
+        return [key for photo_frames in self.noise_frames for key in photo_frames]
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+
+def load_recording(path: str) -> RecordedSession:
+    with zipfile.ZipFile(path) as archive:
+        data = json.loads(archive.read(_SESSION_FILE_NAME))
+        if data.get("version") != _RECORDING_VERSION:
+            raise ValueError(f"{path} is a version {data.get('version')} recording, expected {_RECORDING_VERSION}")
+
+        photos = []
+        for photo in data["photos"]:
+            img = Image.open(io.BytesIO(archive.read(photo["file"])))
+            img.load()
+            photos.append(img)
+
+    return RecordedSession(
+        path,
+        data["seed"],
+        data["config"],
+        photos,
+        [[FaceMetadata.from_dict(face) for face in photo["faces"]] for photo in data["photos"]],
+        [[tuple(key) for key in photo["noise_frames"]] for photo in data["photos"]],
+        data["outputs"],
+        data["timing"],
+    )
+
+
+class RecordedFaces(object):
+    """
+    Stands in for a FaceCache, handing out the faces recorded with each photo
+    so that a replay never has to find them again (or have dlib installed).
+    Photos are matched by their pixels, whatever the detection settings
+    """
+
+    def __init__(self, photos: List[np.array], faces: List[List[FaceMetadata]]):
+        self.__faces = {self.get_key(img_data): photo_faces for img_data, photo_faces in zip(photos, faces)}
+        super().__init__()
+
+    def get_key(self, img_data: np.array, settings: DetectionSettings = None) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{img_data.shape}{img_data.dtype.str}".encode())
+        digest.update(np.ascontiguousarray(img_data).data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[FaceMetadata]]:
+        return self.__faces.get(key)
+
+    def put(self, key: str, faces: List[FaceMetadata]):
+        pass
+
+
+def get_file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_photo(img_data: np.array, compress_level: int) -> bytes:
+    output = io.BytesIO()
+    Image.fromarray(img_data).save(output, "PNG", compress_level=compress_level)
+    return output.getvalue()
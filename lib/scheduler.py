@@ -0,0 +1,207 @@
+import asyncio
+import contextvars
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from lib.photobooth import Photobooth, PhotoboothState
+from lib.timing import span
+
+
+class SessionStage(object):
+    WAITING = "waiting"
+    CAPTURING = "capturing"
+    RENDERING = "rendering"
+    PRINTING = "printing"
+
+
+class ScheduledSession(object):
+    def __init__(self, number: int, source: str):
+        self.number = number
+        self.source = source
+        self.stage = SessionStage.WAITING
+        self.started_at = time.time()
+        super().__init__()
+
+    def to_dict(self) -> dict:
+        return {
+            "number": self.number,
+            "source": self.source,
+            "stage": self.stage,
+            "seconds": round(time.time() - self.started_at, 1),
+        }
+
+
+class SessionScheduler(object):
+    """
+    Runs photobooth sessions so that they overlap. As soon as a session's
+    photos are taken, they are spookified on a fixed pool of render workers
+    and then saved and printed in a separate print lane, while the next
+    session's countdown starts straight away.
+
+    At most max_in_flight sessions can be between the start of their
+    countdown and the end of their printing, which bounds how many sessions
+    worth of photos and canvases are held in memory at once. Only one session
+    is ever taking photos at a time.
+    """
+
+    def __init__(
+        self,
+        photobooth: Photobooth,
+        render_workers: int = 2,
+        max_in_flight: int = 2,
+        on_session_done: Callable[[], None] = None,
+    ):
+        if render_workers <= 0:
+            raise ValueError("there must be at least one render worker")
+        if max_in_flight <= 0:
+            raise ValueError("at least one session must be allowed in flight")
+
+        self.photobooth = photobooth
+        self.render_workers = render_workers
+        self.max_in_flight = max_in_flight
+        self.on_session_done = on_session_done
+
+        self.sessions_completed = 0
+        self.sessions_failed = 0
+        self.__first_started_at: Optional[float] = None
+        self.__last_finished_at: Optional[float] = None
+
+        self.__render_executor = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="render")
+        self.__print_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="print")
+        self.__sessions: Dict[int, ScheduledSession] = {}
+        self.__numbers = itertools.count(1)
+        self.__tasks = set()
+
+        # asyncio primitives belong to the loop they are first used on, so
+        # they are only created once we are running on it
+        self.__in_flight: Optional[asyncio.Semaphore] = None
+        self.__capture_lock: Optional[asyncio.Lock] = None
+
+        super().__init__()
+
+    async def run_session(self, source: str = ""):
+        """
+        run a session up to the end of taking its photos, then leave it to be
+        rendered and printed in the background. If max_in_flight sessions are
+        already running, this first waits for one of them to finish
+        """
+        if self.__in_flight is None:
+            self.__in_flight = asyncio.Semaphore(self.max_in_flight)
+            self.__capture_lock = asyncio.Lock()
+
+        session = ScheduledSession(next(self.__numbers), source)
+        self.__sessions[session.number] = session
+
+        try:
+            await self.__in_flight.acquire()
+        except BaseException:
+            del self.__sessions[session.number]
+            raise
+
+        if self.__first_started_at is None:
+            self.__first_started_at = time.time()
+
+        captured = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self.__run(session, captured))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+        await captured
+
+    async def wait_for_all(self):
+        """wait for every session that has been started to be printed"""
+        while len(self.__tasks) > 0:
+            await asyncio.gather(*list(self.__tasks))
+
+    def get_report(self) -> dict:
+        return {
+            "sessions_completed": self.sessions_completed,
+            "sessions_failed": self.sessions_failed,
+            "sessions_per_hour": round(self.get_sessions_per_hour(), 1),
+            "render_workers": self.render_workers,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": [session.to_dict() for session in self.__sessions.values()],
+        }
+
+    def get_sessions_per_hour(self) -> float:
+        """how many sessions have been finished per hour, from the start of the first to the end of the last"""
+        if self.__first_started_at is None or self.__last_finished_at is None:
+            return 0.0
+
+        elapsed = self.__last_finished_at - self.__first_started_at
+        if elapsed <= 0:
+            return 0.0
+
+        return self.sessions_completed * 3600 / elapsed
+
+    def describe(self) -> str:
+        """a short description of the sessions being worked on, for showing to guests"""
+        rendering = sum(1 for session in self.__sessions.values() if session.stage == SessionStage.RENDERING)
+        status = self.photobooth.get_state()["print_status"]
+        if rendering == 0:
+            return status
+
+        text = f"spookifying {rendering} strip{'s' if rendering > 1 else ''}..."
+        return f"{text} {status}" if status else text
+
+    def close(self):
+        self.__render_executor.shutdown()
+        self.__print_executor.shutdown()
+
+    async def __run(self, session: ScheduledSession, captured: asyncio.Future):
+        loop = asyncio.get_running_loop()
+
+        def run_in(executor, fn, *args):
+            # run in a copy of our context so that the timings are recorded
+            # in this session
+            return loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+        try:
+            with self.photobooth.session(
+                scheduled=True, source=session.source, in_flight=len(self.__sessions)
+            ) as timing:
+                try:
+                    async with self.__capture_lock:
+                        session.stage = SessionStage.CAPTURING
+                        self.photobooth.is_running = True
+                        try:
+                            with span("capture"):
+                                imgs = await self.photobooth.capture_async()
+                        finally:
+                            self.photobooth.state = PhotoboothState.IDLE
+                            self.photobooth.is_running = False
+                finally:
+                    # the next session can start its countdown now, even if
+                    # this one failed
+                    captured.set_result(None)
+
+                session.stage = SessionStage.RENDERING
+                spooked_images = await run_in(self.__render_executor, self.photobooth.process_photos, imgs)
+                final_canvas, unspooked_canvas = await run_in(
+                    self.__render_executor, self.photobooth.composite, spooked_images
+                )
+
+                session.stage = SessionStage.PRINTING
+                await run_in(self.__print_executor, self.photobooth.print_strip, final_canvas, unspooked_canvas)
+
+            if timing.attributes.get("success"):
+                self.sessions_completed += 1
+            else:
+                self.sessions_failed += 1
+        finally:
+            if not captured.done():
+                captured.set_result(None)
+
+            self.__last_finished_at = time.time()
+            del self.__sessions[session.number]
+            self.__in_flight.release()
+
+        print(
+            f"{self.sessions_completed} sessions done ({self.sessions_failed} failed), "
+            f"{self.get_sessions_per_hour():.0f} sessions/hour"
+        )
+
+        if self.on_session_done is not None:
+            self.on_session_done()
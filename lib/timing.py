@@ -0,0 +1,170 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+_current_session = contextvars.ContextVar("current_timing_session", default=None)
+
+
+class SessionTiming(object):
+    """
+    The timings of every stage in a single photobooth session.
+
+    Stages are recorded with `span` while the session is current (see
+    `timed_session`). Work handed off to another thread needs to be run in a
+    copy of the current context (`contextvars.copy_context().run`) for its
+    spans to end up in the session.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.now()
+        self.attributes = {}
+        self.spans: List[dict] = []
+        self.duration_seconds = None
+
+        self.__start = time.perf_counter()
+        self.__lock = threading.Lock()
+
+        super().__init__()
+
+    def add_span(self, name: str, start: float, duration: float, attributes: dict):
+        span = {
+            "name": name,
+            "start_ms": round((start - self.__start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        span.update(attributes)
+
+        with self.__lock:
+            self.spans.append(span)
+
+    def finish(self):
+        self.duration_seconds = time.perf_counter() - self.__start
+
+    def to_record(self) -> dict:
+        return {
+            "session": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((self.duration_seconds or 0) * 1000, 3),
+            **self.attributes,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+@contextmanager
+def timed_session(name: str = "session"):
+    """make a new session current for the duration of the block, so spans are recorded into it"""
+    session = SessionTiming(name)
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        session.finish()
+        _current_session.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    time the block as a stage of the current session. The yielded dict can be
+    used to add attributes that are only known once the stage is done. If there
+    is no current session, nothing is recorded
+    """
+    session = _current_session.get()
+    if session is None:
+        yield attributes
+        return
+
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        session.add_span(name, start, time.perf_counter() - start, attributes)
+
+
+class TimingLog(object):
+    """
+    Writes each session as a json line, and keeps the durations of the last
+    `window` sessions so a p50/p95 summary of each stage can be exported as a
+    prometheus text file
+    """
+
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None, window: int = 200):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.__durations: Dict[str, deque] = {}
+        self.__window = window
+        self.__lock = threading.Lock()
+
+        for path in (jsonl_path, prometheus_path):
+            if path is not None and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        super().__init__()
+
+    def write(self, session: SessionTiming):
+        record = session.to_record()
+
+        with self.__lock:
+            self.__add_duration("session", record["duration_ms"] / 1000)
+            for s in record["spans"]:
+                self.__add_duration(s["name"], s["duration_ms"] / 1000)
+
+            if self.jsonl_path is not None:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+            if self.prometheus_path is not None:
+                self.__write_prometheus()
+
+    def summary(self) -> Dict[str, dict]:
+        with self.__lock:
+            return {stage: _summarise(durations) for stage, durations in self.__durations.items()}
+
+    def __add_duration(self, stage: str, seconds: float):
+        if stage not in self.__durations:
+            self.__durations[stage] = deque(maxlen=self.__window)
+
+        self.__durations[stage].append(seconds)
+
+    def __write_prometheus(self):
+        lines = [
+            "# HELP photobooth_stage_duration_seconds How long each photobooth stage took over the recent sessions",
+            "# TYPE photobooth_stage_duration_seconds summary",
+        ]
+        for stage in sorted(self.__durations):
+            summary = _summarise(self.__durations[stage])
+            lines.append(f'photobooth_stage_duration_seconds{{stage="{stage}",quantile="0.5"}} {summary["p50"]:.6f}')
+            lines.append(f'photobooth_stage_duration_seconds{{stage="{stage}",quantile="0.95"}} {summary["p95"]:.6f}')
+            lines.append(f'photobooth_stage_duration_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'photobooth_stage_duration_seconds_count{{stage="{stage}"}} {summary["count"]}')
+
+        # write to a temp file first so a scraper never sees half a file
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
+
+
+def _summarise(durations) -> dict:
+    ordered = sorted(durations)
+    return {
+        "p50": _percentile(ordered, 0.5),
+        "p95": _percentile(ordered, 0.95),
+        "sum": sum(ordered),
+        "count": len(ordered),
+    }
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if len(ordered) == 0:
+        return 0.0
+
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from lib.photobooth import Photobooth
+from lib.scheduler import SessionScheduler
+
+# the most of a request body the http endpoint will read
+_MAX_BODY_BYTES = 64 * 1024
+
+_HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    429: "Too Many Requests",
+}
+
+
+class SessionTrigger(object):
+    """a request to start a session, and where it came from"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.triggered_at = time.time()
+        super().__init__()
+
+    def to_dict(self) -> dict:
+        return {"source": self.source, "triggered_at": self.triggered_at}
+
+
+class TriggerService(object):
+    """
+    Starts photobooth sessions when triggered from stdin (ENTER), a local
+    http endpoint, or a button.
+
+    Triggers wait in a bounded queue and sessions are run one after another
+    on an asyncio event loop. Once the queue is full, triggers are turned
+    away (the http endpoint answers 429) until a session finishes. The
+    countdown and photos are taken on the event loop, and the CPU heavy
+    spookifying and printing is run in an executor, so the service keeps
+    answering triggers and state requests while a session runs.
+
+    http endpoints (only bound to localhost by default):
+        POST /trigger   queue a session
+        GET  /state     what the booth is up to, as json
+
+    If a scheduler is given, sessions overlap: the next session's countdown
+    starts as soon as the last one's photos are taken, while those are
+    rendered and printed in the background.
+
+    The button is a file that is polled for its value, so it can be a linux
+    gpio value file (/sys/class/gpio/gpioN/value) or a plain file standing in
+    for one: `echo 1 > FILE` presses it and `echo 0 > FILE` lets it go.
+    """
+
+    def __init__(
+        self,
+        photobooth: Photobooth,
+        max_queued_sessions: int = 2,
+        http_host: str = "127.0.0.1",
+        http_port: Optional[int] = None,
+        button_path: Optional[str] = None,
+        button_poll_seconds: float = 0.05,
+        read_stdin: bool = True,
+        processing_workers: int = 1,
+        scheduler: SessionScheduler = None,
+    ):
+        if max_queued_sessions <= 0:
+            raise ValueError("at least one session must be able to be queued")
+
+        self.photobooth = photobooth
+        self.max_queued_sessions = max_queued_sessions
+        self.http_host = http_host
+        self.http_port = http_port
+        self.button_path = button_path
+        self.button_poll_seconds = button_poll_seconds
+        self.read_stdin = read_stdin
+        self.processing_workers = processing_workers
+        self.scheduler = scheduler
+
+        self.sessions_rejected = 0
+        self.__current: Optional[SessionTrigger] = None
+        self.__queue: Optional[asyncio.Queue] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+
+        super().__init__()
+
+    def run(self):
+        """run the service until the process is stopped"""
+        asyncio.run(self.__serve())
+
+    def trigger(self, source: str) -> Optional[int]:
+        """
+        queue a session, returning how many sessions are now waiting (this one
+        included), or None if the queue is full. Must be called on the event
+        loop
+        """
+        trigger = SessionTrigger(source)
+        try:
+            self.__queue.put_nowait(trigger)
+        except asyncio.QueueFull:
+            self.sessions_rejected += 1
+            print(f"[WARN]: the session queue is full, ignoring the trigger from {source}")
+            return None
+
+        print(f"session triggered from {source}, {self.__queue.qsize()} waiting")
+        return self.__queue.qsize()
+
+    def get_state(self) -> dict:
+        state = self.photobooth.get_state()
+        state.update(
+            {
+                "current_session": self.__current.to_dict() if self.__current is not None else None,
+                "queued_sessions": self.__queue.qsize() if self.__queue is not None else 0,
+                "max_queued_sessions": self.max_queued_sessions,
+                "sessions_rejected": self.sessions_rejected,
+            }
+        )
+        if self.scheduler is not None:
+            state["scheduler"] = self.scheduler.get_report()
+
+        return state
+
+    async def __serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__queue = asyncio.Queue(maxsize=self.max_queued_sessions)
+
+        tasks = [self.__run_sessions()]
+
+        if self.http_port is not None:
+            server = await asyncio.start_server(self.__handle_http, self.http_host, self.http_port)
+            print(f"listening for triggers on http://{self.http_host}:{self.http_port}/trigger")
+            tasks.append(server.serve_forever())
+
+        if self.button_path is not None:
+            print(f"watching {self.button_path} for button presses")
+            tasks.append(self.__watch_button())
+
+        if self.read_stdin:
+            # reading stdin blocks, and a daemon thread is the only way to do
+            # that without keeping the process alive at exit
+            threading.Thread(target=self.__read_stdin, daemon=True).start()
+
+        await asyncio.gather(*tasks)
+
+    async def __run_sessions(self):
+        if self.scheduler is not None and self.scheduler.on_session_done is None:
+            self.scheduler.on_session_done = self.__show_ready_if_idle
+
+        with ThreadPoolExecutor(max_workers=self.processing_workers, thread_name_prefix="session") as executor:
+            self.__show_ready_if_idle()
+
+            while True:
+                self.__current = await self.__queue.get()
+                waited = time.time() - self.__current.triggered_at
+                print(f"starting the session from {self.__current.source} after waiting {waited:.1f}s")
+
+                if self.scheduler is not None:
+                    # returns once the photos are taken, the rest of the
+                    # session carries on in the background
+                    await self.scheduler.run_session(self.__current.source)
+                else:
+                    await self.photobooth.run_async(executor)
+
+                self.__current = None
+                self.__queue.task_done()
+
+                self.__show_ready_if_idle()
+
+    def __show_ready_if_idle(self):
+        if self.__current is not None or not self.__queue.empty():
+            return
+
+        status = self.scheduler.describe() if self.scheduler is not None else None
+        self.photobooth.show_ready(status)
+
+    def __read_stdin(self):
+        print("waiting for input...")
+        while (line := sys.stdin.readline()) != "":
+            print("detected key press!")
+            self.__loop.call_soon_threadsafe(self.trigger, "stdin")
+
+        print("stdin closed, no longer reading triggers from it")
+
+    async def __watch_button(self):
+        pressed = False
+        while True:
+            try:
+                with open(self.button_path) as f:
+                    value = f.read().strip()
+            except OSError:
+                value = "0"
+
+            # only trigger when the button goes down, not for as long as it is held
+            if value == "1" and not pressed:
+                self.trigger("button")
+            pressed = value == "1"
+
+            await asyncio.sleep(self.button_poll_seconds)
+
+    async def __handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2:
+                await _write_http_response(writer, 400, {"error": "bad request"})
+                return
+
+            method, path = parts[0], parts[1].split("?")[0]
+
+            content_length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = int(value.strip() or 0)
+
+            # the body isn't used, but needs reading so the client isn't cut off
+            if content_length > 0:
+                await reader.readexactly(min(content_length, _MAX_BODY_BYTES))
+
+            if path == "/trigger" and method == "POST":
+                waiting = self.trigger("http")
+                if waiting is None:
+                    await _write_http_response(writer, 429, {"error": "too many sessions queued", **self.get_state()})
+                else:
+                    await _write_http_response(writer, 202, {"waiting": waiting, **self.get_state()})
+            elif path == "/state" and method == "GET":
+                await _write_http_response(writer, 200, self.get_state())
+            elif path in ("/trigger", "/state"):
+                await _write_http_response(writer, 405, {"error": f"{method} is not allowed on {path}"})
+            else:
+                await _write_http_response(writer, 404, {"error": f"{path} not found"})
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"[WARN]: bad http request: {e}")
+        finally:
+            writer.close()
+
+
+async def _write_http_response(writer: asyncio.StreamWriter, status: int, body: dict):
+    content = json.dumps(body).encode("utf-8")
+    headers = (
+        f"HTTP/1.1 {status} {_HTTP_REASONS[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(content)}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    )
+    writer.write(headers.encode("latin-1") + content)
+    await writer.drain()
@@ -3,28 +3,29 @@
 import argparse
 import numpy as np
 import os
+import time
+from typing import Dict, List
 
 from PIL import Image
 
-from lib.detection import find_faces_from_array
-from lib.effect import (
-    FaceIdentifyEffect,
-    GhostEffect,
-    ImageEffect,
-    ImageProcessingContext,
-    SaturationEffect,
-    SketchyEyeEffect,
-    SwirlFaceEffect,
-    TvStaticEffect,
-)
+from lib.batch import create_effect_chain, find_input_files, parse_effect_chain, run_batch, run_effect_chain
+from lib.detection import DetectionSettings, find_faces_from_array
+from lib.effect import ImageProcessingContext
+from lib.face_cache import DEFAULT_FACE_CACHE_DIR, FaceCache
 
 
 def main():
     parser = argparse.ArgumentParser(description="Some spooky ass photobombing")
-    parser.add_argument(
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
         "--input-file",
         help="the full path to the input image file",
-        required=True,
+    )
+    inputs.add_argument(
+        "--batch",
+        nargs="+",
+        help="""the image files, directories or globs to process in batch mode.
+                Every image found is run through every effect chain""",
     )
     parser.add_argument(
         "--output-dir",
@@ -37,7 +38,43 @@ def main():
         help="""the effects to apply on an image. Will be
                 processed in order they are defined.
                 One of -> [identify-face, swirl, ghost, saturation, eyes, noise]""",
-        required=True,
+    )
+    parser.add_argument(
+        "--chain",
+        action="append",
+        help="""a named effect chain to run in batch mode, in the form
+                name=effect,effect. Can be given more than once""",
+        default=[],
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="the number of processes to use in batch mode",
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--detection-size",
+        type=int,
+        help="""the max size (in pixels) of the longest side of the image faces
+                are found on. By default faces are found on the full size image""",
+        default=None,
+    )
+    parser.add_argument(
+        "--face-cache-dir",
+        help="the directory to cache the faces found in each image in",
+        default=DEFAULT_FACE_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--no-face-cache",
+        action="store_true",
+        help="always find faces, ignoring and not updating the face cache",
+        default=False,
+    )
+    parser.add_argument(
+        "--clear-face-cache",
+        action="store_true",
+        help="remove everything from the face cache before running",
+        default=False,
     )
     parser.add_argument(
         "--show",
@@ -47,56 +84,48 @@ def main():
     )
 
     args = parser.parse_args()
-    input_file_path = args.input_file
     output_dir = args.output_dir
     effects = args.effects
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    # the cache is cleared even if it isn't going to be used
+    if args.clear_face_cache:
+        print("clearing the face cache")
+        FaceCache(args.face_cache_dir).clear()
+
+    face_cache = None
+    if not args.no_face_cache:
+        face_cache = FaceCache(args.face_cache_dir)
+
+    detection_settings = DetectionSettings(args.detection_size)
+
+    if args.batch:
+        chains = dict(parse_effect_chain(chain) for chain in args.chain)
+        if effects:
+            chains["-".join(effects)] = effects
+        if len(chains) == 0:
+            parser.error("batch mode needs at least one --chain or --effects")
+
+        run_batch_mode(args.batch, chains, output_dir, args.workers, detection_settings, face_cache)
+        return
+
+    if not effects:
+        parser.error("--effects is required when processing a single --input-file")
+
+    input_file_path = args.input_file
     input_file_name = os.path.basename(input_file_path)
     output_file_name = input_file_name.split(".")[0] + "-" + "-".join(effects) + ".png"
     output_file_path = os.path.join(output_dir, output_file_name)
 
     img = Image.open(input_file_path)
-    image_processors = []
     result: Image.Image
 
-    context = create_context_from_image(img)
-
-    for effect in effects:
-        image_processor: ImageEffect
-        if effect == "identify-face":
-            print("identify face effect added")
-            image_processor = FaceIdentifyEffect()
-        elif effect == "swirl":
-            print("swirl effect added")
-            image_processor = SwirlFaceEffect(1)
-        elif effect == "ghost":
-            print("ghost friend effect added")
-            image_processor = GhostEffect()
-        elif effect == "saturation":
-            print("saturation effect added")
-            image_processor = SaturationEffect(0.7)
-        elif effect == "eyes":
-            print("eye effect added")
-            image_processor = SketchyEyeEffect()
-        elif effect == "noise":
-            print("noise effect added")
-            image_processor = TvStaticEffect(500)
-        else:
-            raise Exception(f"the effect {effect} is currently unsupported")
-
-        image_processors.append(image_processor)
-
-    if len(image_processors) < 1:
-        raise Exception(f"you must choose at least one type of image effect")
+    context = create_context_from_image(img, detection_settings, face_cache)
 
-    for p in image_processors:
-        print(f"applying effect: {p.__class__.__name__}")
-        result = p.process_image(context)
-        context.img = result
-        context.img_data = np.array(result)
+    image_processors = create_effect_chain(effects)
+    result = run_effect_chain(context, image_processors)
 
     # write to the output file
     result.save(output_file_path, "PNG", quality=95)
@@ -105,9 +134,56 @@ def main():
         result.show()
 
 
-def create_context_from_image(img: Image) -> ImageProcessingContext:
+def run_batch_mode(
+    inputs: List[str],
+    chains: Dict[str, List[str]],
+    output_dir: str,
+    num_workers: int,
+    detection_settings: DetectionSettings,
+    face_cache: FaceCache = None,
+):
+    input_paths = find_input_files(inputs)
+    if len(input_paths) == 0:
+        raise Exception(f"no images found in {inputs}")
+
+    print(f"processing {len(input_paths)} images with the chains {list(chains)} using {num_workers} workers")
+
+    start = time.perf_counter()
+    num_done = 0
+    num_failed = 0
+    for result in run_batch(
+        input_paths,
+        chains,
+        output_dir,
+        num_workers,
+        detection_settings,
+        face_cache.cache_dir if face_cache is not None else None,
+    ):
+        num_done += 1
+        if result.error is not None:
+            num_failed += 1
+            print(f"[{num_done}/{len(input_paths)}] failed to process {result.input_path}: {result.error}")
+        else:
+            print(
+                f"[{num_done}/{len(input_paths)}] {result.input_path} -> {result.output_paths} "
+                f"({result.seconds:.2f}s)"
+            )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"processed {num_done - num_failed}/{len(input_paths)} images in {elapsed:.1f}s "
+        f"({num_done / elapsed:.2f} images/sec, {num_done * len(chains) / elapsed:.2f} outputs/sec)"
+    )
+
+
+def create_context_from_image(
+    img: Image, detection_settings: DetectionSettings = None, face_cache: FaceCache = None
+) -> ImageProcessingContext:
     img_data = np.array(img)
-    faces = find_faces_from_array(img_data)
+    if face_cache is not None:
+        faces = face_cache.find_faces(img_data, detection_settings)
+    else:
+        faces = find_faces_from_array(img_data, detection_settings)
     return ImageProcessingContext(img, img_data, faces)
 
 
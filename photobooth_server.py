@@ -2,17 +2,29 @@
 
 import argparse
 import threading
+import time
+from lib.burst import BURST_FORMATS, BurstRecorder
+from lib.compositor import LAYOUTS
+from lib.detection import DetectionPool, DetectionSettings
 from lib.display import PhotoboothDisplay
+from lib.encoding import ENCODER_PROFILES
+from lib.frame_bus import SharedCamera
+from lib.printing import PrintSpooler
+from lib.recording import SessionRecorder
 
 from lib.photobooth import (
     Photobooth,
     PhotoPrinter,
     PhotoTaker,
-    WebCamPhotoTaker,
+    SharedCameraPhotoTaker,
 )
+from lib.scheduler import SessionScheduler
+from lib.timing import TimingLog
+from lib.triggers import TriggerService
 
 
 def main():
+    start_time = time.perf_counter()
     print("Starting the photobooth server...")
     print(
         """
@@ -49,23 +61,214 @@ def main():
         help="Specify the index of the webcam to use. Built in webcam is usually 0.",
         default=-0,
     )
+    parser.add_argument(
+        "--detection-size",
+        default=800,
+        help="""the max size (in pixels) of the longest side of the image faces
+                are found on. Photos bigger than this are shrunk before finding
+                faces. Use 0 to find faces on the full size photo""",
+    )
+    parser.add_argument(
+        "--detection-workers",
+        default=4,
+        help="""the number of processes used to find faces in the photos at the
+                same time. Use 0 to find faces one photo at a time""",
+    )
+    parser.add_argument(
+        "--spooky-preview",
+        action="store_true",
+        help="whether to show ghosts, static and spooky eyes on the live preview",
+    )
+    parser.add_argument(
+        "--preview-fps",
+        default=15,
+        help="""the frame rate the spooky preview aims for. Effects are dropped, or
+                run on a smaller frame, when they don't fit""",
+    )
+    parser.add_argument(
+        "--layout",
+        default="strip",
+        choices=sorted(LAYOUTS),
+        help="""how the photos are laid out on the page: one under another (strip),
+                in rows of two (grid), or two copies of the strip side by side for
+                4x6 paper (4x6)""",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="whether to spookify each photo in the background while the next one is being taken",
+    )
+    parser.add_argument(
+        "--stream-strips",
+        action="store_true",
+        help="""whether to write each photo into the strip files as soon as it is spookified,
+                instead of putting the whole strip together in memory first. Only works with png""",
+    )
+    parser.add_argument(
+        "--record-sessions",
+        default=None,
+        help="""a directory to record every session into, so they can be replayed
+                with benchmarks/replay_sessions.py""",
+    )
+    parser.add_argument(
+        "--overlap-sessions",
+        action="store_true",
+        help="""whether to start the next session's countdown as soon as the photos
+                are taken, spookifying and printing them in the background""",
+    )
+    parser.add_argument(
+        "--render-workers",
+        default=2,
+        help="the number of sessions that can be spookified at the same time with --overlap-sessions",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        default=2,
+        help="""the most sessions that can be running at once with --overlap-sessions,
+                from the start of their countdown to being printed""",
+    )
+    parser.add_argument(
+        "--burst-frames",
+        default=0,
+        help="""the number of frames to record for an animation instead of taking
+                photos for a strip. Use 0 to take photos""",
+    )
+    parser.add_argument(
+        "--burst-fps",
+        default=10,
+        help="the number of frames a second recorded and played back with --burst-frames",
+    )
+    parser.add_argument(
+        "--burst-format",
+        default="gif",
+        choices=BURST_FORMATS,
+        help="how the animation is saved with --burst-frames",
+    )
+    parser.add_argument(
+        "--burst-keyframe-interval",
+        default=10,
+        help="""how often faces are found properly with --burst-frames. They are
+                tracked on the frames in between""",
+    )
+    parser.add_argument(
+        "--timing-log",
+        default="./output/timings.jsonl",
+        help="the file to write the timings of each session to, one json line per session",
+    )
+    parser.add_argument(
+        "--timing-prometheus",
+        default=None,
+        help="the file to write a p50/p95 summary of the session timings to, in the prometheus text format",
+    )
+    parser.add_argument(
+        "--image-type",
+        default="png",
+        choices=sorted(ENCODER_PROFILES),
+        help="how the printed strip is saved",
+    )
+    parser.add_argument(
+        "--unspooked-image-type",
+        default=None,
+        choices=sorted(ENCODER_PROFILES),
+        help="how the unspooked copy of the strip is saved. Defaults to --image-type",
+    )
+    parser.add_argument(
+        "--http-port",
+        default=8000,
+        help="the port to listen for triggers on (POST /trigger, GET /state), on localhost only. Use 0 to turn it off",
+    )
+    parser.add_argument(
+        "--button-file",
+        default=None,
+        help="""a file to watch for button presses: a gpio value file (e.g.
+                /sys/class/gpio/gpio17/value), or any file that `echo 1 >` is
+                written to""",
+    )
+    parser.add_argument(
+        "--max-queued-sessions",
+        default=2,
+        help="the number of sessions that can be waiting to start before new triggers are ignored",
+    )
     parser.add_argument(
         "--should-print",
         dest="should_print",
         action="store_true",
         help="whether the resulting photo should actually be printed",
     )
+    parser.add_argument(
+        "--print-command",
+        default="lp",
+        help="""the command the photos are printed with, the file is added to the
+                end. Use "python3 tools/fake_printer.py lp" to try it out without a printer""",
+    )
+    parser.add_argument(
+        "--print-status-command",
+        default="lpstat -o",
+        help="""the command that lists the print jobs that are not finished yet.
+                Use "python3 tools/fake_printer.py lpstat -o" with the fake printer""",
+    )
+    parser.add_argument(
+        "--max-print-jobs",
+        default=4,
+        help="""the number of strips that can be waiting to be sent to, or printed by, the printer
+                before a new session has to wait""",
+    )
 
     args = parser.parse_args()
 
+    if int(args.burst_frames) > 0 and args.overlap_sessions:
+        parser.error("--burst-frames can't be used with --overlap-sessions")
+    if args.stream_strips and args.overlap_sessions:
+        parser.error("--stream-strips can't be used with --overlap-sessions")
+    if args.record_sessions and (args.overlap_sessions or int(args.burst_frames) > 0):
+        parser.error("--record-sessions can't be used with --overlap-sessions or --burst-frames")
+
     print(f"Starting the photobooth with params: {args}")
 
-    printer = PhotoPrinter("./output", "photobooth", "png", args.should_print)
+    # photos are printed in the background, so the next guests don't have to
+    # wait for the printer
+    spooler = PrintSpooler(args.print_command, args.print_status_command, int(args.max_print_jobs))
+    printer = PhotoPrinter(
+        "./output",
+        "photobooth",
+        args.image_type,
+        args.should_print,
+        spooler,
+        args.unspooked_image_type,
+    )
 
     webcam_to_use = int(args.use_webcam)
 
-    photo_taker: PhotoTaker = WebCamPhotoTaker(webcam_to_use)
-    display = PhotoboothDisplay(webcam_to_use)
+    # only one process opens the camera, the display and the photo taker both
+    # read its frames from shared memory. The preview is started before
+    # anything else so guests see it as soon as possible
+    shared_camera = SharedCamera(webcam_to_use)
+    photo_taker: PhotoTaker = SharedCameraPhotoTaker(shared_camera)
+    preview_options = {"target_fps": float(args.preview_fps)} if args.spooky_preview else None
+    display = PhotoboothDisplay(webcam_to_use, shared_camera, preview_options)
+    display.put_text("Press ENTER to get SPOOKED!")
+
+    detection_settings = DetectionSettings(int(args.detection_size) or None)
+
+    # start the face finding workers now, so they are ready to go by the time
+    # the first photos are taken. They load dlib in the background
+    detection_pool = None
+    if int(args.detection_workers) > 0:
+        detection_pool = DetectionPool(int(args.detection_workers), detection_settings)
+
+    burst_recorder = None
+    if int(args.burst_frames) > 0:
+        burst_recorder = BurstRecorder(
+            int(args.burst_frames),
+            float(args.burst_fps),
+            int(args.burst_keyframe_interval),
+            args.burst_format,
+            detection_settings=detection_settings,
+        )
+
+    session_recorder = None
+    if args.record_sessions:
+        session_recorder = SessionRecorder(args.record_sessions)
 
     photobooth = Photobooth(
         display,
@@ -74,16 +277,30 @@ def main():
         int(args.num_photos),
         int(args.border_size),
         float(args.photo_delay),
+        detection_settings,
+        detection_pool,
+        args.pipelined,
+        timing_log=TimingLog(args.timing_log, args.timing_prometheus),
+        layout=args.layout,
+        burst_recorder=burst_recorder,
+        stream_strips=args.stream_strips,
+        session_recorder=session_recorder,
+    )
+
+    scheduler = None
+    if args.overlap_sessions:
+        scheduler = SessionScheduler(photobooth, int(args.render_workers), int(args.max_in_flight))
+
+    trigger_service = TriggerService(
+        photobooth,
+        int(args.max_queued_sessions),
+        http_port=int(args.http_port) or None,
+        button_path=args.button_file,
+        scheduler=scheduler,
     )
 
-    print("Server starting. Waiting on enter press...")
-    while True:
-        display.clear_text()
-        display.put_text("Press ENTER to get SPOOKED!")
-        _ = input("waiting for input...\n")
-        print("detected key press!")
-        print("")
-        photobooth.run()
+    print(f"Server started in {time.perf_counter() - start_time:.1f}s. Waiting on enter press...")
+    trigger_service.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+A stand in for the `lp` and `lpstat` commands, for trying out the print
+spooler without a printer:
+
+    python3 tools/fake_printer.py lp FILE
+    python3 tools/fake_printer.py lpstat -o
+
+Every job "prints" for FAKE_PRINTER_SECONDS (default 20) seconds. The jobs are
+kept in FAKE_PRINTER_DIR (default /tmp/fake_printer). Set FAKE_PRINTER_FAIL=1
+to make `lp` fail, like it does when the printer is unplugged.
+"""
+
+import os
+import sys
+import time
+
+PRINTER_NAME = "fake_printer"
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} lp FILE | lpstat -o", file=sys.stderr)
+        sys.exit(2)
+
+    state_dir = os.environ.get("FAKE_PRINTER_DIR", "/tmp/fake_printer")
+    os.makedirs(state_dir, exist_ok=True)
+
+    command = sys.argv[1]
+    if command == "lp":
+        lp(state_dir, sys.argv[2:])
+    elif command == "lpstat":
+        lpstat(state_dir)
+    else:
+        print(f"unknown command {command}", file=sys.stderr)
+        sys.exit(2)
+
+
+def lp(state_dir: str, files):
+    if os.environ.get("FAKE_PRINTER_FAIL") == "1":
+        print("lp: The printer or class does not exist.", file=sys.stderr)
+        sys.exit(1)
+
+    if len(files) == 0 or not os.path.exists(files[-1]):
+        print("lp: Error - unable to access file", file=sys.stderr)
+        sys.exit(1)
+
+    job_number = len(os.listdir(state_dir)) + 1
+    job_id = f"{PRINTER_NAME}-{job_number}"
+    done_at = time.time() + float(os.environ.get("FAKE_PRINTER_SECONDS", "20"))
+
+    with open(os.path.join(state_dir, job_id), "w") as f:
+        f.write(f"{done_at} {files[-1]}\n")
+
+    print(f"request id is {job_id} (1 file(s))")
+
+
+def lpstat(state_dir: str):
+    for job_id in sorted(os.listdir(state_dir)):
+        with open(os.path.join(state_dir, job_id)) as f:
+            done_at, file_path = f.read().split(maxsplit=1)
+
+        if float(done_at) > time.time():
+            size = os.path.getsize(file_path.strip()) if os.path.exists(file_path.strip()) else 0
+            print(f"{job_id:<24} photobooth {size:>12}   {time.ctime(float(done_at))}")
+
+
+if __name__ == "__main__":
+    main()